@@ -0,0 +1,212 @@
+# backfill.py
+# Загрузка истории OHLCV в локальное хранилище data_lake (parquet по месяцам).
+#
+#   python backfill.py --exchange binance --symbols SOL/USDT,BTC/USDT --timeframe 1m --since 2022-01-01
+#
+# Повторный запуск докачивает только недостающее: хвост после последнего бара и пропуски внутри месяцев.
+import argparse
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+
+import ccxt.async_support as ccxt
+import ccxt as ccxt_sync
+import numpy as np
+
+import data_lake
+from candle_buffer import tf_ms
+
+log = logging.getLogger("backfill")
+
+RETRYABLE = (ccxt_sync.NetworkError, ccxt_sync.RequestTimeout, ccxt_sync.DDoSProtection,
+             ccxt_sync.ExchangeNotAvailable, asyncio.TimeoutError)
+
+
+def parse_date(s: str) -> int:
+    dt = datetime.fromisoformat(s)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp() * 1000)
+
+
+def split_windows(gaps: list, step_ms: int, limit: int) -> list[tuple[int, int]]:
+    """Режет пропуски на окна не длиннее limit баров — по одному запросу на окно."""
+    span = step_ms * limit
+    out = []
+    for a, b in gaps:
+        while a < b:
+            out.append((a, min(b, a + span)))
+            a += span
+    return out
+
+
+def _inside(window: tuple[int, int], holes: list) -> bool:
+    return any(h[0] <= window[0] and window[1] <= h[1] for h in holes)
+
+
+class Backfill:
+    def __init__(self, exchange, timeframe: str, root: str | None = None, limit: int = 1000,
+                 concurrency: int = 8, retries: int = 5):
+        self.exchange = exchange
+        self.timeframe = timeframe
+        self.step = tf_ms(timeframe)
+        self.root = root
+        self.limit = limit
+        self.sem = asyncio.Semaphore(concurrency)
+        self.retries = retries
+        self._hole_locks: dict[str, asyncio.Lock] = {}
+        self.stats = {"requests": 0, "bars": 0, "months": 0, "holes": 0}
+
+    async def fetch_window(self, symbol: str, a: int, b: int) -> list:
+        """Бары [a, b) — постранично, с повторами на сетевых ошибках."""
+        rows, since = [], a
+        while since < b:
+            for attempt in range(self.retries):
+                try:
+                    async with self.sem:
+                        self.stats["requests"] += 1
+                        bars = await self.exchange.fetch_ohlcv(symbol, self.timeframe, since=since, limit=self.limit)
+                    break
+                except RETRYABLE as e:
+                    wait = min(30.0, 1.5 ** attempt)
+                    log.warning(f"{symbol} since={since}: {e}; retry {attempt+1}/{self.retries} in {wait:.1f}s")
+                    await asyncio.sleep(wait)
+            else:
+                raise RuntimeError(f"{symbol}: window {a}..{b} failed after {self.retries} retries")
+            bars = [r for r in bars or [] if since <= r[0] < b]
+            if not bars:
+                break
+            rows.extend(bars)
+            since = int(bars[-1][0]) + self.step
+        return rows
+
+    async def fill_month(self, symbol: str, key: str, start_ms: int, end_ms: int, recheck_holes: bool) -> int:
+        m_start, m_end = data_lake.month_bounds(key)
+        lo, hi = max(start_ms, m_start), min(end_ms, m_end)
+        path = data_lake.partition_path(self.exchange.id, self.timeframe, symbol, key, self.root)
+        loop = asyncio.get_running_loop()
+        ts = await loop.run_in_executor(None, data_lake.partition_ts, path) \
+            if data_lake.os.path.exists(path) else np.empty(0, dtype=np.int64)
+        gaps = data_lake.find_gaps(ts, self.step, lo, hi)
+        if not gaps:
+            if recheck_holes:
+                await self._merge_holes(symbol, lo, hi, [], replace=True)
+            return 0
+        holes = [] if recheck_holes else data_lake.load_holes(self.exchange.id, self.timeframe, symbol, self.root)
+        windows = [w for w in split_windows(gaps, self.step, self.limit) if not _inside(w, holes)]
+        if not windows:
+            return 0
+        parts = await asyncio.gather(*[self.fetch_window(symbol, a, b) for a, b in windows])
+        rows = [r for p in parts for r in p]
+        self.stats["bars"] += len(rows)
+        if rows:
+            await loop.run_in_executor(None, data_lake.write_partition, path, np.asarray(rows, dtype=np.float64))
+            ts = await loop.run_in_executor(None, data_lake.partition_ts, path)
+        still = [w for w in data_lake.find_gaps(ts, self.step, lo, hi) if not _inside(w, holes)]
+        if still or recheck_holes:
+            # биржа не отдала эти бары — запоминаем, чтобы не запрашивать снова
+            self.stats["holes"] += len(still)
+            await self._merge_holes(symbol, lo, hi, still, replace=recheck_holes)
+        self.stats["months"] += 1
+        log.info(f"{symbol} {self.timeframe} {key}: +{len(rows)} bars, {len(still)} hole(s)")
+        return len(rows)
+
+    async def _merge_holes(self, symbol: str, lo: int, hi: int, found: list, replace: bool):
+        """Дописывает пропуски месяца [lo, hi) в файл символа. Месяцы одного символа идут параллельно,
+        поэтому чтение-слияние-запись — под замком символа и по свежему файлу. replace (--recheck-holes)
+        заменяет старые пропуски этого месяца найденными; другие месяцы не трогаются."""
+        async with self._hole_locks.setdefault(symbol, asyncio.Lock()):
+            loop = asyncio.get_running_loop()
+            holes = await loop.run_in_executor(None, data_lake.load_holes, self.exchange.id, self.timeframe,
+                                               symbol, self.root)
+            kept = [h for h in holes if not (replace and lo <= h[0] and h[1] <= hi)]
+            merged = sorted(set(kept) | set(map(tuple, found)))
+            if merged != sorted(set(holes)):
+                await loop.run_in_executor(None, data_lake.save_holes, self.exchange.id, self.timeframe,
+                                           symbol, merged, self.root)
+
+    async def run(self, symbols: list[str], start_ms: int, end_ms: int, jobs: int = 4,
+                  recheck_holes: bool = False):
+        queue: asyncio.Queue = asyncio.Queue()
+        for symbol in symbols:
+            first = start_ms
+            listed = self._listing_ms(symbol)
+            if listed:
+                first = max(first, listed)
+            for key in data_lake.months_between(first, end_ms):
+                queue.put_nowait((symbol, key, first))
+
+        async def worker():
+            while True:
+                try:
+                    symbol, key, first = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    await self.fill_month(symbol, key, first, end_ms, recheck_holes)
+                except Exception as e:
+                    log.error(f"{symbol} {key} failed: {e}")
+
+        await asyncio.gather(*[worker() for _ in range(max(1, jobs))])
+        return self.stats
+
+    def _listing_ms(self, symbol: str) -> int | None:
+        info = (self.exchange.markets or {}).get(symbol, {}).get("info") or {}
+        for k in ("onboardDate", "listTime", "launchTime"):
+            if info.get(k):
+                try:
+                    return int(info[k])
+                except (TypeError, ValueError):
+                    pass
+        return None
+
+
+async def main_async(args):
+    exchange = getattr(ccxt, args.exchange)({
+        "enableRateLimit": True,
+        "options": {"defaultType": args.market_type},
+    })
+    if args.rate_limit_ms:
+        exchange.rateLimit = args.rate_limit_ms
+    try:
+        await exchange.load_markets()
+        symbols = [s for s in args.symbols.split(",") if s]
+        missing = [s for s in symbols if s not in exchange.markets]
+        if missing:
+            log.error(f"Unknown symbols on {exchange.id}: {missing}")
+            symbols = [s for s in symbols if s in exchange.markets]
+        step = tf_ms(args.timeframe)
+        end_ms = parse_date(args.until) if args.until else int(time.time() * 1000) // step * step
+        start_ms = parse_date(args.since)
+        bf = Backfill(exchange, args.timeframe, root=args.lake, limit=args.limit, concurrency=args.concurrency)
+        t0 = time.perf_counter()
+        stats = await bf.run(symbols, start_ms, end_ms, jobs=args.jobs, recheck_holes=args.recheck_holes)
+        log.info(f"Done in {time.perf_counter() - t0:.1f}s: {stats}")
+        for s in symbols:
+            log.info(f"{s}: {data_lake.coverage(exchange.id, args.timeframe, s, args.lake)}")
+    finally:
+        await exchange.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill OHLCV history into the local parquet lake.")
+    parser.add_argument("--exchange", default="binance")
+    parser.add_argument("--market-type", default="spot", help="ccxt defaultType: spot/swap")
+    parser.add_argument("--symbols", required=True, help="comma-separated ccxt symbols")
+    parser.add_argument("--timeframe", default="1m")
+    parser.add_argument("--since", required=True, help="ISO date, e.g. 2022-01-01")
+    parser.add_argument("--until", default=None, help="ISO date (default: last closed bar)")
+    parser.add_argument("--lake", default=None, help=f"lake root (default {data_lake.LAKE_ROOT})")
+    parser.add_argument("--limit", type=int, default=1000, help="bars per request")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight")
+    parser.add_argument("--jobs", type=int, default=4, help="symbol-months processed in parallel")
+    parser.add_argument("--rate-limit-ms", type=int, default=None, help="override ccxt rateLimit")
+    parser.add_argument("--recheck-holes", action="store_true", help="re-request ranges marked as missing")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    asyncio.run(main_async(args))
+
+
+if __name__ == "__main__":
+    main()
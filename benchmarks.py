@@ -0,0 +1,299 @@
+# benchmarks.py
+# Бенчмарки горячих путей стратегий на синтетическом рынке (synthetic_market + replay.FakeExchange).
+#
+#   python benchmarks.py --out bench.json
+#   python benchmarks.py --symbols 100,500 --repeat 3 --compare bench.json
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+import clock
+import replay
+import synthetic_market
+import trade_executor
+from candle_buffer import OHLCV_COLUMNS, tf_ms
+
+log = logging.getLogger("benchmarks")
+
+DAY_MS = 86_400_000
+
+
+def _stats(samples_ms: list) -> dict:
+    return {
+        "n": len(samples_ms),
+        "min_ms": round(min(samples_ms), 4),
+        "median_ms": round(statistics.median(samples_ms), 4),
+        "mean_ms": round(statistics.fmean(samples_ms), 4),
+        "max_ms": round(max(samples_ms), 4),
+    }
+
+
+def bench_sync(fn, repeat: int, number: int = 1) -> dict:
+    """Время одного вызова fn (мс): repeat замеров по number вызовов."""
+    fn()  # прогрев
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append((time.perf_counter() - t0) * 1000 / number)
+    return _stats(samples)
+
+
+async def bench_async(make_coro, repeat: int, setup=None) -> dict:
+    samples = []
+    for i in range(repeat + 1):
+        if setup:
+            setup()
+        t0 = time.perf_counter()
+        await make_coro()
+        if i:  # первый прогон — прогрев
+            samples.append((time.perf_counter() - t0) * 1000)
+    return _stats(samples)
+
+
+@contextmanager
+def virtual_time(start: float):
+    prev = clock.CLOCK
+    vclock = clock.VirtualClock(start)
+    clock.set_clock(vclock)
+    try:
+        yield vclock
+    finally:
+        clock.set_clock(prev)
+
+
+@contextmanager
+def patched(obj, name: str, value):
+    prev = getattr(obj, name)
+    setattr(obj, name, value)
+    try:
+        yield
+    finally:
+        setattr(obj, name, prev)
+
+
+def _end_ms() -> int:
+    return int(time.time() * 1000) // DAY_MS * DAY_MS
+
+
+# ---------------------------------------------------------------------------
+# BMR-DCA
+# ---------------------------------------------------------------------------
+async def bench_bmr(repeat: int) -> dict:
+    import scanner_bmr_dca as bmr
+    cfg = bmr.CONFIG
+    end_ms = _end_ms()
+    entry_limit = max(60, cfg.VOL_WIN + cfg.ADX_LEN + 20)
+    markets, bars = synthetic_market.make_market(
+        1, {cfg.TF_ENTRY: cfg.ENTRY_BUF_BARS, cfg.TF_RANGE: cfg.RANGE_BUF_BARS}, end_ms, seed=1)
+    symbol = next(iter(markets))
+    out = {}
+
+    df5 = pd.DataFrame(bars[(symbol, cfg.TF_ENTRY)][-entry_limit:], columns=OHLCV_COLUMNS)
+    out["bmr.compute_indicators_5m"] = bench_sync(lambda: bmr.compute_indicators_5m(df5), repeat)
+
+    h1 = bars[(symbol, cfg.TF_RANGE)]
+    exchange = replay.FakeExchange.from_bars(markets, {(symbol, cfg.TF_RANGE): h1})
+    await exchange.load_markets()
+    with virtual_time(end_ms / 1000 + 1):
+        for days in (cfg.STRATEGIC_LOOKBACK_DAYS, cfg.TACTICAL_LOOKBACK_DAYS):
+            out[f"bmr.build_range_for_days[{days}d]"] = await bench_async(
+                lambda: bmr.build_range_for_days(exchange, symbol, days), repeat)
+
+    rng_strat = bmr.range_from_ohlcv(h1[-cfg.STRATEGIC_LOOKBACK_DAYS * 24:])
+    rng_tac = bmr.range_from_ohlcv(h1[-cfg.TACTICAL_LOOKBACK_DAYS * 24:])
+    px = float(df5["close"].iloc[-1])
+    tick = markets[symbol]["precision"]["price"]
+    out["bmr.compute_mixed_targets"] = bench_sync(
+        lambda: bmr.compute_mixed_targets(px, "LONG", rng_strat, rng_tac, tick), repeat, number=200)
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Swing scanner
+# ---------------------------------------------------------------------------
+def _swing_frame(se, ohlcv) -> pd.DataFrame:
+    cfg = se.CONFIG
+    df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
+    df.ta.ema(length=cfg.EMA_FAST_PERIOD, append=True); df.ta.ema(length=cfg.EMA_SLOW_PERIOD, append=True)
+    df.ta.ema(length=cfg.EMA_TREND_PERIOD, append=True)
+    df.ta.stochrsi(length=cfg.STOCH_RSI_PERIOD, k=cfg.STOCH_RSI_K, d=cfg.STOCH_RSI_D, append=True)
+    df.ta.atr(length=cfg.ATR_PERIOD, append=True)
+    return df
+
+
+async def bench_swing(symbol_counts: list, repeat: int) -> dict:
+    import scanner_engine as se
+    cfg = se.CONFIG
+    out = {}
+    step = tf_ms(cfg.TIMEFRAME)
+    end_ms = _end_ms()
+
+    _, one = synthetic_market.make_market(1, {cfg.TIMEFRAME: cfg.OHLCV_LIMIT}, end_ms, seed=2)
+    df = _swing_frame(se, next(iter(one.values())))
+    out["swing.check_entry_conditions"] = bench_sync(lambda: se.check_entry_conditions(df), repeat, number=200)
+
+    opened = []
+
+    async def _record_open(symbol, side, entry_price, exchange, app, atr_entry):
+        opened.append((symbol, side))
+
+    for n in symbol_counts:
+        t_gen = time.perf_counter()
+        markets, bars = synthetic_market.make_market(
+            n, {cfg.TIMEFRAME: cfg.OHLCV_LIMIT + 1, "4h": 250, "1d": 201}, end_ms, seed=3,
+            extra_symbols=["BTC/USDT:USDT"])
+        log.info(f"Synthetic market with {n} symbols generated in {time.perf_counter() - t_gen:.1f}s")
+        exchange = replay.FakeExchange.from_bars(markets, bars)
+        await exchange.load_markets()
+        app = replay.ReplayApp()
+        # свежий индекс рынков под этот набор символов
+        import market_cache
+        market_cache.INDEX_BY_EXCHANGE[exchange.id] = market_cache.build_index(exchange.markets)
+
+        def _reset():
+            se.OHLCV_CACHE.clear(); se.LAST_EVAL_BAR.clear(); se.CORR.reset()
+            app.bot_data = {"active_trades": [], "trade_cooldown": {}, "market_regime_cache": {}}
+
+        cold, warm, fetches = [], [], []
+        with virtual_time(0) as vclock, patched(se, "open_new_trade", _record_open):
+            for i in range(repeat + 1):
+                _reset()
+                vclock._now = (end_ms - step) / 1000 + cfg.SCAN_BAR_CLOSE_DELAY_SEC
+                calls0 = exchange.calls.get("fetch_ohlcv", 0)
+                t0 = time.perf_counter()
+                await se.find_trade_signals(exchange, app)
+                t1 = time.perf_counter()
+                vclock.advance(step / 1000)
+                await se.find_trade_signals(exchange, app)
+                t2 = time.perf_counter()
+                if i:
+                    cold.append((t1 - t0) * 1000); warm.append((t2 - t1) * 1000)
+                    fetches.append(exchange.calls.get("fetch_ohlcv", 0) - calls0)
+        out[f"swing.find_trade_signals[{n}].cold"] = _stats(cold)
+        out[f"swing.find_trade_signals[{n}].next_bar"] = _stats(warm)
+        out[f"swing.find_trade_signals[{n}].next_bar"]["fetch_ohlcv_per_cycle"] = int(np.median(fetches))
+        market_cache.INDEX_BY_EXCHANGE.pop(exchange.id, None)
+    se.OHLCV_CACHE.clear(); se.LAST_EVAL_BAR.clear()
+    out["swing.signals_opened"] = {"count": len(opened)}
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Sheets buffer
+# ---------------------------------------------------------------------------
+async def bench_sheets_buffer(repeat: int, events: int = 200) -> dict:
+    headers = list(trade_executor.BMR_HEADERS)
+    payload = {h: 1.2345 for h in headers}
+    payload.update({"Event_ID": "OPEN_EUR_1", "Signal_ID": "EUR_1", "Pair": "EUR/USDT:USDT",
+                    "Side": "LONG", "Event": "ADD", "Timestamp_UTC": "2024-01-01 00:00:00"})
+    buffered, flushed = [], []
+    prev_ws = trade_executor.TRADE_LOG_WS
+    try:
+        for i in range(repeat + 1):
+            trade_executor.TRADE_LOG_WS = replay.MemoryWorksheet("BMR_DCA_Log", [headers])
+            trade_executor.clear_headers_cache()
+            del trade_executor.PENDING_TRADES[:]
+            t0 = time.perf_counter()
+            for _ in range(events):
+                await trade_executor.bmr_log_event(dict(payload))
+            t1 = time.perf_counter()
+            await trade_executor.flush_log_buffers()
+            t2 = time.perf_counter()
+            if i:
+                buffered.append((t1 - t0) * 1000 / events)
+                flushed.append((t2 - t1) * 1000)
+    finally:
+        trade_executor.TRADE_LOG_WS = prev_ws
+        trade_executor.clear_headers_cache()
+    return {"sheets.bmr_log_event": _stats(buffered),
+            f"sheets.flush_log_buffers[{events}]": _stats(flushed)}
+
+
+# ---------------------------------------------------------------------------
+# Report
+# ---------------------------------------------------------------------------
+def _meta(args) -> dict:
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                             text=True, timeout=5).stdout.strip() or None
+    except Exception:
+        rev = None
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_rev": rev,
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "repeat": args.repeat,
+        "symbols": args.symbols,
+    }
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list:
+    """Строки сравнения по median_ms; возвращает список регрессий."""
+    regressions = []
+    for name, cur in current["results"].items():
+        base = baseline.get("results", {}).get(name)
+        if not base or "median_ms" not in cur or "median_ms" not in base:
+            continue
+        ratio = cur["median_ms"] / max(base["median_ms"], 1e-9)
+        flag = "REGRESSION" if ratio > 1 + threshold else ("faster" if ratio < 1 - threshold else "")
+        print(f"  {name:<48} {base['median_ms']:>10.3f} -> {cur['median_ms']:>10.3f} ms  x{ratio:.2f} {flag}")
+        if flag == "REGRESSION":
+            regressions.append(name)
+    return regressions
+
+
+async def run(args) -> dict:
+    results = {}
+    results.update(await bench_bmr(args.repeat))
+    results.update(await bench_swing(args.symbols, args.repeat))
+    results.update(await bench_sheets_buffer(args.repeat))
+    return {"meta": _meta(args), "results": results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark strategy hot paths on a synthetic market.")
+    parser.add_argument("--symbols", default="100,500,1000",
+                        type=lambda s: [int(x) for x in s.split(",") if x])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", default="bench.json")
+    parser.add_argument("--compare", default=None, help="baseline JSON from a previous run")
+    parser.add_argument("--threshold", type=float, default=0.15, help="relative slowdown treated as regression")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    log.setLevel(logging.INFO)
+
+    report = asyncio.run(run(args))
+    for name, st in report["results"].items():
+        if "median_ms" in st:
+            print(f"{name:<48} median {st['median_ms']:>10.3f} ms  (min {st['min_ms']:.3f}, n={st['n']})")
+        else:
+            print(f"{name:<48} {st}")
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=1)
+    print(f"Saved to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} ({baseline.get('meta', {}).get('git_rev')}):")
+        if compare(report, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# candle_buffer.py
+import numpy as np
+
+OHLCV_COLUMNS = ["ts", "open", "high", "low", "close", "volume"]
+
+
+def tf_ms(tf: str) -> int:
+    unit = tf[-1].lower(); n = int(tf[:-1])
+    if unit == "m": return n * 60_000
+    if unit == "h": return n * 3_600_000
+    if unit == "d": return n * 86_400_000
+    return 0
+
+
+class CandleBuffer:
+    """Буфер OHLCV фиксированной длины на numpy: слияние по ts, последний бар может обновляться."""
+
+    def __init__(self, timeframe: str, maxlen: int):
+        self.timeframe = timeframe
+        self.maxlen = int(maxlen)
+        self.tf_ms = tf_ms(timeframe)
+        self.data = np.empty((0, 6), dtype=np.float64)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def last_ts(self) -> int | None:
+        return int(self.data[-1, 0]) if len(self.data) else None
+
+    def merge(self, ohlcv) -> int:
+        """Вливает бары (список ccxt или массив). Возвращает число новых баров."""
+        if ohlcv is None or len(ohlcv) == 0:
+            return 0
+        rows = np.asarray(ohlcv, dtype=np.float64).reshape(-1, 6)
+        if not len(self.data):
+            self.data = rows[-self.maxlen:].copy()
+            return len(self.data)
+        before = self.data[self.data[:, 0] < rows[0, 0]]
+        after = self.data[self.data[:, 0] > rows[-1, 0]]
+        added = int(np.count_nonzero(rows[:, 0] > self.data[-1, 0]))
+        self.data = np.concatenate([before, rows, after])[-self.maxlen:]
+        return added
+
+    def delta_limit(self, now_ms: float, full_limit: int, pad: int = 2) -> int:
+        """Сколько баров запросить, чтобы догнать буфер (полная загрузка, если он пуст или устарел)."""
+        if not len(self.data) or not self.tf_ms:
+            return full_limit
+        missing = int((now_ms - self.data[-1, 0]) // self.tf_ms) + pad
+        return full_limit if missing >= full_limit or len(self.data) < full_limit else max(pad, missing)
+
+    def tail(self, n: int) -> np.ndarray:
+        return self.data[-n:]
+
+    def closed(self, now_ms: float) -> np.ndarray:
+        """Только закрытые бары (без формирующегося)."""
+        if len(self.data) and now_ms - self.data[-1, 0] < self.tf_ms:
+            return self.data[:-1]
+        return self.data
+
+    def to_frame(self, n: int | None = None):
+        import pandas as pd
+        rows = self.data if n is None else self.data[-n:]
+        return pd.DataFrame(rows, columns=OHLCV_COLUMNS)
+
+    def __getstate__(self):
+        return {"timeframe": self.timeframe, "maxlen": self.maxlen, "data": self.data}
+
+    def __setstate__(self, st):
+        self.timeframe = st["timeframe"]
+        self.maxlen = st["maxlen"]
+        self.tf_ms = tf_ms(self.timeframe)
+        self.data = st["data"]
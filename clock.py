@@ -0,0 +1,78 @@
+# clock.py
+# Источник времени для торговых циклов. В проде — системные часы,
+# в replay/бенчмарках подменяется на VirtualClock через set_clock().
+import asyncio
+import time
+from datetime import datetime, timezone
+
+
+class SystemClock:
+    def time(self) -> float:
+        return time.time()
+
+    async def sleep(self, seconds: float):
+        await asyncio.sleep(seconds)
+
+    async def wait_for(self, aw, timeout: float):
+        return await asyncio.wait_for(aw, timeout=timeout)
+
+
+class VirtualClock:
+    """Виртуальное время: sleep мгновенно сдвигает часы. Рассчитан на один управляющий цикл."""
+
+    def __init__(self, start: float, until: float | None = None, on_deadline=None):
+        self._now = float(start)
+        self.until = until
+        self.on_deadline = on_deadline
+        self._deadline_fired = False
+
+    def time(self) -> float:
+        return self._now
+
+    def advance(self, seconds: float):
+        self._now += max(0.0, float(seconds))
+        if self.until is not None and self._now >= self.until and not self._deadline_fired:
+            self._deadline_fired = True
+            if self.on_deadline:
+                self.on_deadline()
+
+    async def sleep(self, seconds: float):
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+    async def wait_for(self, aw, timeout: float):
+        task = asyncio.ensure_future(aw)
+        await asyncio.sleep(0)
+        if task.done():
+            return task.result()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        self.advance(timeout)
+        raise asyncio.TimeoutError
+
+
+CLOCK = SystemClock()
+
+
+def set_clock(clock):
+    global CLOCK
+    CLOCK = clock
+
+
+def now() -> float:
+    return CLOCK.time()
+
+
+def utcnow() -> datetime:
+    return datetime.fromtimestamp(CLOCK.time(), timezone.utc)
+
+
+async def sleep(seconds: float):
+    await CLOCK.sleep(seconds)
+
+
+async def wait_for(aw, timeout: float):
+    return await CLOCK.wait_for(aw, timeout)
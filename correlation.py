@@ -0,0 +1,187 @@
+# correlation.py
+# Корреляции доходностей по всей ликвидной вселенной сканера: кольцевой буфер лог-доходностей (W, N)
+# и попарные суммы (N, N), которые обновляются на каждом баре rank-1 поправками (добавить новый бар,
+# вычесть выпавший). Пропуски учитываются попарно: статистика пары — только по барам, где есть обе.
+# Новый символ засевается всей присланной историей: его доходности раскладываются по строкам кольца
+# по времени бара, суммы пересчитываются один раз перед следующим запросом.
+import logging
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+log = logging.getLogger("correlation")
+
+
+class CorrelationEngine:
+    def __init__(self, window: int = 96, min_obs: int = 48, capacity: int = 256):
+        self.window = window
+        self.min_obs = min_obs
+        self.index: Dict[str, int] = {}
+        self._free: List[int] = []
+        self.ring = np.full((window, 0), np.nan)
+        self.ring_ts = np.full(window, np.nan)     # время бара каждой строки кольца
+        self.head = 0
+        self.rows = 0
+        self.pending_bar: Optional[int] = None
+        self.pending = np.full(0, np.nan)
+        self.since_rebuild = 0
+        self._dirty = False
+        self._alloc(capacity)
+
+    def reset(self):
+        self.__init__(self.window, self.min_obs, self.ring.shape[1])
+
+    # --- хранение ---
+    def _alloc(self, cap: int):
+        old = self.ring.shape[1]
+        ring = np.full((self.window, cap), np.nan)
+        ring[:, :old] = self.ring
+        pending = np.full(cap, np.nan)
+        pending[:old] = self.pending
+        self.ring, self.pending = ring, pending
+        self._free += list(range(cap - 1, old - 1, -1))
+        self._rebuild()
+
+    def _col(self, symbol: str) -> int:
+        col = self.index.get(symbol)
+        if col is None:
+            if not self._free:
+                self._alloc(self.ring.shape[1] * 2)
+            col = self.index[symbol] = self._free.pop()
+        return col
+
+    def _rebuild(self):
+        """Полный пересчёт сумм по кольцу: при росте N и раз в окно (гасит накопленную ошибку)."""
+        m = ~np.isnan(self.ring)
+        x = np.where(m, self.ring, 0.0)
+        mf = m.astype(np.float64)
+        self.C = x.T @ x            # Σ x_i x_j
+        self.SX = x.T @ mf          # Σ x_i по барам, где есть j
+        self.SXX = (x * x).T @ mf   # Σ x_i² по барам, где есть j
+        self.P = mf.T @ mf          # число общих баров
+        self.since_rebuild = 0
+        self._dirty = False
+
+    def _push_row(self, row: np.ndarray, ts: float):
+        if self._dirty:
+            self._rebuild()
+        rows = np.stack([self.ring[self.head], row])       # выпадающий бар и новый — одна rank-2 поправка
+        m = ~np.isnan(rows)
+        x = np.where(m, rows, 0.0)
+        mf = m.astype(np.float64)
+        sign = np.array([[-1.0], [1.0]])
+        self.C += (sign * x).T @ x
+        self.SX += (sign * x).T @ mf
+        self.SXX += (sign * x * x).T @ mf
+        self.P += (sign * mf).T @ mf
+        self.ring[self.head] = row
+        self.ring_ts[self.head] = ts
+        self.head = (self.head + 1) % self.window
+        self.rows = min(self.rows + 1, self.window)
+        self.since_rebuild += 1
+        if self.since_rebuild >= self.window:
+            self._rebuild()
+
+    # --- поток данных ---
+    def observe(self, symbol: str, closed: np.ndarray):
+        """Доходность последнего закрытого бара символа (closed — OHLCV по возрастанию времени).
+        Бар копится в текущей строке; строка уходит в окно, когда приходит бар новее.
+        Для нового символа более длинный closed засевает кольцо его историей."""
+        if len(closed) < 2:
+            return
+        bar = int(closed[-1, 0])
+        if self.pending_bar is None or bar > self.pending_bar:
+            if self.pending_bar is not None:
+                self._push_row(self.pending.copy(), self.pending_bar)
+            else:
+                self._start_timeline(closed[:-1, 0])
+            self.pending[:] = np.nan
+            self.pending_bar = bar
+        elif bar < self.pending_bar:
+            return
+        if symbol not in self.index and len(closed) > 2:
+            self._seed(self._col(symbol), closed[:-1])
+        prev, last = float(closed[-2, 4]), float(closed[-1, 4])
+        if prev > 0 and last > 0:
+            col = self._col(symbol)           # может расширить массивы — до обращения к pending
+            self.pending[col] = np.log(last / prev)
+
+    def _start_timeline(self, ts: np.ndarray):
+        """Первый бар движка: строки кольца — предыдущие бары первой присланной истории."""
+        ts = ts[-self.window:]
+        self.ring_ts[:] = np.nan
+        self.ring_ts[:len(ts)] = ts
+        self.head = len(ts) % self.window
+        self.rows = len(ts)
+
+    def _seed(self, col: int, closed: np.ndarray):
+        """Доходности закрытых баров closed в строки кольца с тем же временем бара."""
+        c = closed[:, 4]
+        ok = (c[1:] > 0) & (c[:-1] > 0)
+        r = np.full(len(c) - 1, np.nan)
+        r[ok] = np.log(c[1:][ok] / c[:-1][ok])
+        ts = closed[1:, 0]
+        rows = np.flatnonzero(~np.isnan(self.ring_ts))
+        at = np.minimum(np.searchsorted(ts, self.ring_ts[rows]), len(ts) - 1)
+        hit = ts[at] == self.ring_ts[rows]
+        self.ring[rows[hit], col] = r[at[hit]]
+        self._dirty = True
+
+    def forget(self, symbol: str):
+        col = self.index.pop(symbol, None)
+        if col is None:
+            return
+        self.ring[:, col] = np.nan
+        self.pending[col] = np.nan
+        for a in (self.C, self.SX, self.SXX, self.P):
+            a[col, :] = 0.0
+            a[:, col] = 0.0
+        self._free.append(col)
+
+    # --- запросы ---
+    def corr(self, symbols: Sequence[str]) -> np.ndarray:
+        """Матрица корреляций (k, k); NaN там, где общих баров меньше min_obs или символ неизвестен."""
+        k = len(symbols)
+        cols = np.array([self.index.get(s, -1) for s in symbols], dtype=np.int64)
+        out = np.full((k, k), np.nan)
+        known = np.flatnonzero(cols >= 0)
+        if not len(known):
+            return out
+        if self._dirty:
+            self._rebuild()
+        ix = np.ix_(cols[known], cols[known])
+        n = self.P[ix]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mi = self.SX[ix] / n                 # среднее i по общим барам
+            mj = mi.T
+            cov = self.C[ix] / n - mi * mj
+            vi = self.SXX[ix] / n - mi * mi
+            vj = vi.T
+            r = cov / np.sqrt(vi * vj)
+        r[(n < self.min_obs) | ~np.isfinite(r)] = np.nan
+        out[np.ix_(known, known)] = np.clip(r, -1.0, 1.0)
+        return out
+
+    def select(self, candidates: Iterable[Tuple[str, str]], held: Iterable[Tuple[str, str]], k: int,
+               max_corr: float) -> List[int]:
+        """Жадный выбор: кандидаты (symbol, side) уже по убыванию score; берём следующий, если его
+        корреляция с позициями и уже выбранными (с учётом стороны) не выше max_corr.
+        Возвращает индексы выбранных кандидатов."""
+        cands, held = list(candidates), list(held)
+        if k <= 0 or not cands:
+            return []
+        pairs = held + cands
+        sign = np.array([1.0 if side == "LONG" else -1.0 for _, side in pairs])
+        r = self.corr([s for s, _ in pairs]) * np.outer(sign, sign)   # лонг+шорт с r<0 — та же ставка
+        taken = list(range(len(held)))
+        picked = []
+        for i in range(len(held), len(pairs)):
+            worst = np.nanmax(r[i, taken]) if taken and not np.isnan(r[i, taken]).all() else -np.inf
+            if worst > max_corr:
+                log.info(f"Skip {pairs[i][1]} {pairs[i][0]}: corr {worst:.2f} > {max_corr} with held/selected pairs")
+                continue
+            taken.append(i)
+            picked.append(i - len(held))
+            if len(picked) >= k:
+                break
+        return picked
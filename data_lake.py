@@ -0,0 +1,167 @@
+# data_lake.py
+# Локальное хранилище OHLCV: {root}/{exchange}/{timeframe}/{symbol}/{YYYY-MM}.parquet (zstd).
+# Пишет backfill.py; читают обучение, бэктесты и построители диапазонов. Файл читается через memory-map,
+# но read_partition/read_ohlcv возвращают собственные массивы float64 (колонки копируются в один массив).
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from candle_buffer import OHLCV_COLUMNS, tf_ms
+
+LAKE_ROOT = os.getenv("DATA_LAKE", os.path.join("data", "lake"))
+SCHEMA = pa.schema([("ts", pa.int64())] + [(c, pa.float64()) for c in OHLCV_COLUMNS[1:]])
+COMPRESSION = "zstd"
+HOLES_FILE = "_holes.json"
+
+
+def safe_symbol(symbol: str) -> str:
+    return symbol.replace("/", "-").replace(":", "-")
+
+
+def symbol_dir(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> str:
+    return os.path.join(root or LAKE_ROOT, exchange_id, timeframe, safe_symbol(symbol))
+
+
+def month_key(ts_ms: int) -> str:
+    return datetime.fromtimestamp(ts_ms / 1000, timezone.utc).strftime("%Y-%m")
+
+
+def month_bounds(key: str) -> tuple[int, int]:
+    """[start, end) месяца в мс UTC."""
+    y, m = map(int, key.split("-"))
+    start = datetime(y, m, 1, tzinfo=timezone.utc)
+    end = datetime(y + (m == 12), m % 12 + 1, 1, tzinfo=timezone.utc)
+    return int(start.timestamp() * 1000), int(end.timestamp() * 1000)
+
+
+def months_between(start_ms: int, end_ms: int) -> list[str]:
+    keys, t = [], start_ms
+    while t < end_ms:
+        k = month_key(t)
+        keys.append(k)
+        t = month_bounds(k)[1]
+    return keys
+
+
+def partition_path(exchange_id: str, timeframe: str, symbol: str, key: str, root: str | None = None) -> str:
+    return os.path.join(symbol_dir(exchange_id, timeframe, symbol, root), f"{key}.parquet")
+
+
+def list_partitions(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> list[tuple[str, str]]:
+    d = symbol_dir(exchange_id, timeframe, symbol, root)
+    if not os.path.isdir(d):
+        return []
+    return sorted((f[:-8], os.path.join(d, f)) for f in os.listdir(d) if f.endswith(".parquet"))
+
+
+def read_partition(path: str, columns: list[str] | None = None) -> np.ndarray:
+    """Месяц как новый массив (n, len(columns)) float64 (копия колонок); ts точен до 2**53 мс."""
+    table = pq.read_table(path, columns=columns, memory_map=True)
+    cols = [table.column(c).to_numpy() for c in (columns or OHLCV_COLUMNS)]
+    return np.column_stack(cols).astype(np.float64, copy=False) if cols else np.empty((0, 0))
+
+
+def partition_ts(path: str) -> np.ndarray:
+    return pq.read_table(path, columns=["ts"], memory_map=True).column("ts").to_numpy()
+
+
+def write_partition(path: str, rows: np.ndarray) -> int:
+    """Сливает бары с существующим файлом месяца (по ts, новые побеждают). Возвращает число строк."""
+    rows = np.asarray(rows, dtype=np.float64).reshape(-1, 6)
+    if os.path.exists(path):
+        rows = np.concatenate([read_partition(path), rows])
+    if not len(rows):
+        return 0
+    # последнее вхождение каждого ts
+    rev = rows[::-1]
+    _, first_idx = np.unique(rev[:, 0], return_index=True)
+    rows = rev[first_idx]
+    table = pa.table([pa.array(rows[:, 0].astype(np.int64))] +
+                     [pa.array(rows[:, i]) for i in range(1, 6)], schema=SCHEMA)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    pq.write_table(table, tmp, compression=COMPRESSION)
+    os.replace(tmp, path)
+    return len(rows)
+
+
+def find_gaps(ts: np.ndarray, step_ms: int, start_ms: int, end_ms: int) -> list[tuple[int, int]]:
+    """Пропуски [a, b) в сетке баров step_ms внутри [start_ms, end_ms)."""
+    start_ms = -(-start_ms // step_ms) * step_ms
+    if end_ms <= start_ms:
+        return []
+    ts = np.asarray(ts, dtype=np.int64)
+    ts = ts[(ts >= start_ms) & (ts < end_ms)]
+    edges = np.concatenate([[start_ms - step_ms], np.sort(ts), [end_ms]])
+    d = np.diff(edges)
+    idx = np.flatnonzero(d > step_ms)
+    return [(int(edges[i] + step_ms), int(edges[i + 1])) for i in idx]
+
+
+def last_timestamp(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> int | None:
+    parts = list_partitions(exchange_id, timeframe, symbol, root)
+    for _, path in reversed(parts):
+        ts = partition_ts(path)
+        if len(ts):
+            return int(ts.max())
+    return None
+
+
+def load_holes(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> list[tuple[int, int]]:
+    """Диапазоны, которых нет на бирже (после повторной загрузки) — не перезапрашиваем."""
+    path = os.path.join(symbol_dir(exchange_id, timeframe, symbol, root), HOLES_FILE)
+    try:
+        with open(path) as f:
+            return [tuple(h) for h in json.load(f).get("holes", [])]
+    except (FileNotFoundError, ValueError):
+        return []
+
+
+def save_holes(exchange_id: str, timeframe: str, symbol: str, holes: list, root: str | None = None):
+    d = symbol_dir(exchange_id, timeframe, symbol, root)
+    os.makedirs(d, exist_ok=True)
+    tmp = os.path.join(d, HOLES_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"holes": sorted(set(map(tuple, holes)))}, f)
+    os.replace(tmp, os.path.join(d, HOLES_FILE))
+
+
+def read_ohlcv(exchange_id: str, timeframe: str, symbol: str, start_ms: int | None = None,
+               end_ms: int | None = None, root: str | None = None) -> np.ndarray:
+    """Бары (n, 6) из нужных месяцев, отсортированы по ts."""
+    parts = list_partitions(exchange_id, timeframe, symbol, root)
+    lo = month_key(start_ms) if start_ms is not None else None
+    hi = month_key(end_ms - 1) if end_ms is not None else None
+    chunks = [read_partition(p) for k, p in parts if (lo is None or k >= lo) and (hi is None or k <= hi)]
+    if not chunks:
+        return np.empty((0, 6))
+    data = np.concatenate(chunks)
+    mask = np.ones(len(data), dtype=bool)
+    if start_ms is not None:
+        mask &= data[:, 0] >= start_ms
+    if end_ms is not None:
+        mask &= data[:, 0] < end_ms
+    return data[mask]
+
+
+def read_frame(exchange_id: str, timeframe: str, symbol: str, start_ms: int | None = None,
+               end_ms: int | None = None, root: str | None = None):
+    import pandas as pd
+    return pd.DataFrame(read_ohlcv(exchange_id, timeframe, symbol, start_ms, end_ms, root),
+                        columns=["timestamp", "open", "high", "low", "close", "volume"])
+
+
+def coverage(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> dict:
+    """Сводка по символу: месяцы, строки, первый/последний бар, число пропусков."""
+    step = tf_ms(timeframe)
+    parts = list_partitions(exchange_id, timeframe, symbol, root)
+    ts = np.concatenate([partition_ts(p) for _, p in parts]) if parts else np.empty(0, dtype=np.int64)
+    if not len(ts):
+        return {"months": 0, "rows": 0}
+    gaps = find_gaps(ts, step, int(ts.min()), int(ts.max()) + step)
+    return {"months": len(parts), "rows": int(len(ts)), "first": int(ts.min()), "last": int(ts.max()),
+            "gaps": len(gaps), "missing_bars": int(sum((b - a) // step for a, b in gaps))}
@@ -0,0 +1,187 @@
+# equity_curve.py
+# Переоценка открытой DCA-позиции на каждом тике: нереализованный PnL (net, с комиссиями входа и
+# оценкой выхода), маржа и её доля в банке, расстояние до ликвидации. Всё за O(1) на обновление:
+#   - кольцо последних RAW_LEN тиков;
+#   - сжатая история по корзинам BUCKET_SEC: когда корзин HIST_LEN, корзина удваивается и попавшие
+#     в одну сливаются — вся жизнь позиции в фиксированной памяти;
+#   - бегущие пик, максимальная просадка, время «под водой» (текущее и максимальное), MAE/MFE.
+# Трекер живёт в Position.mtm (сохраняется снапшотом и уходит фронту вместе с позицией).
+import math
+from typing import List, Optional
+
+import numpy as np
+
+RAW_LEN = 360
+HIST_LEN = 240
+BUCKET_SEC = 60.0
+# пороги оповещений: расстояние до ликвидации, % цены; просадка от пика, % банка
+LIQ_ALERT_PCT = (10.0, 5.0, 2.5)
+DD_ALERT_BANK_PCT = (5.0, 10.0, 20.0)
+
+RAW_DTYPE = np.dtype([("ts", "f8"), ("upnl", "f8"), ("margin", "f8"), ("usage", "f8"), ("liq_dist", "f8")])
+HIST_DTYPE = np.dtype([("ts", "f8"), ("upnl_min", "f8"), ("upnl_max", "f8"), ("upnl_last", "f8"),
+                       ("usage_max", "f8"), ("liq_dist_min", "f8")])
+SPARK = "▁▂▃▄▅▆▇█"
+
+
+def _nanmin(a: float, b: float) -> float:
+    return b if math.isnan(a) else a if math.isnan(b) else min(a, b)
+
+
+class PositionEquity:
+    def __init__(self, opened_at: float, bucket_sec: float = BUCKET_SEC):
+        self.opened_at = opened_at
+        self.raw = np.full(RAW_LEN, np.nan, dtype=RAW_DTYPE)
+        self.head = 0
+        self.count = 0
+        self.hist = np.full(HIST_LEN, np.nan, dtype=HIST_DTYPE)
+        self.buckets = 0
+        self.bucket_sec = bucket_sec
+        self.last = None                    # последний тик (ts, upnl, margin, usage, liq_dist)
+        self.peak, self.peak_ts = 0.0, opened_at
+        self.max_dd, self.max_dd_ts = 0.0, None
+        self.mae, self.mfe = 0.0, 0.0
+        self.tuw_max = 0.0
+        self.liq_dist_min = float("nan")
+        self.usage_max = 0.0
+        self.alerted_liq = 0                # сколько порогов LIQ_ALERT_PCT уже объявлено
+        self.alerted_dd = 0
+
+    # --- обновление ---
+    def update(self, ts: float, upnl: float, margin: float, usage: float, liq_dist: float,
+               bank: Optional[float] = None) -> List[str]:
+        """Тик переоценки. Возвращает тексты новых оповещений (каждый порог — один раз за позицию)."""
+        self.raw[self.head] = (ts, upnl, margin, usage, liq_dist)
+        self.head = (self.head + 1) % RAW_LEN
+        self.count += 1
+        self.last = (ts, upnl, margin, usage, liq_dist)
+        self._bucket(ts, upnl, usage, liq_dist)
+
+        if upnl >= self.peak:
+            self.peak, self.peak_ts = upnl, ts
+        dd = self.peak - upnl
+        if dd > self.max_dd:
+            self.max_dd, self.max_dd_ts = dd, ts
+        self.tuw_max = max(self.tuw_max, self.under_water(ts))
+        self.mae, self.mfe = min(self.mae, upnl), max(self.mfe, upnl)
+        self.liq_dist_min = _nanmin(self.liq_dist_min, liq_dist)
+        self.usage_max = max(self.usage_max, usage)
+        return self._alerts(dd, liq_dist, bank)
+
+    def _start(self, ts: float) -> float:
+        return self.opened_at + math.floor((ts - self.opened_at) / self.bucket_sec) * self.bucket_sec
+
+    def _bucket(self, ts: float, upnl: float, usage: float, liq_dist: float):
+        start = self._start(ts)
+        if self.buckets and self.hist["ts"][self.buckets - 1] != start and self.buckets == HIST_LEN:
+            self._compact()
+            start = self._start(ts)
+        if self.buckets and self.hist["ts"][self.buckets - 1] == start:
+            b = self.hist[self.buckets - 1]
+            b["upnl_min"] = min(b["upnl_min"], upnl)
+            b["upnl_max"] = max(b["upnl_max"], upnl)
+            b["upnl_last"] = upnl
+            b["usage_max"] = max(b["usage_max"], usage)
+            b["liq_dist_min"] = _nanmin(float(b["liq_dist_min"]), liq_dist)
+            return
+        self.hist[self.buckets] = (start, upnl, upnl, upnl, usage, liq_dist)
+        self.buckets += 1
+
+    def _compact(self):
+        """Удваивает корзину и сливает попавшие в одну новую корзину (история с пропусками может
+        потребовать нескольких удвоений)."""
+        h = self.hist[:self.buckets].copy()
+        while True:
+            self.bucket_sec *= 2
+            key = np.floor((h["ts"] - self.opened_at) / self.bucket_sec)
+            starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+            if len(starts) < HIST_LEN:
+                break
+        ends = np.r_[starts[1:], len(h)] - 1
+        out = np.empty(len(starts), dtype=HIST_DTYPE)
+        out["ts"] = self.opened_at + key[starts] * self.bucket_sec
+        out["upnl_min"] = np.minimum.reduceat(h["upnl_min"], starts)
+        out["upnl_max"] = np.maximum.reduceat(h["upnl_max"], starts)
+        out["upnl_last"] = h["upnl_last"][ends]
+        out["usage_max"] = np.maximum.reduceat(h["usage_max"], starts)
+        out["liq_dist_min"] = np.fmin.reduceat(h["liq_dist_min"], starts)
+        self.hist[:] = np.nan
+        self.hist[:len(out)] = out
+        self.buckets = len(out)
+
+    def _alerts(self, dd: float, liq_dist: float, bank: Optional[float]) -> List[str]:
+        out = []
+        while self.alerted_liq < len(LIQ_ALERT_PCT) and not math.isnan(liq_dist) \
+                and liq_dist <= LIQ_ALERT_PCT[self.alerted_liq]:
+            out.append(f"⚠️ До ликвидации {liq_dist:.2f}% (порог {LIQ_ALERT_PCT[self.alerted_liq]:g}%)")
+            self.alerted_liq += 1
+        while bank and self.alerted_dd < len(DD_ALERT_BANK_PCT) and dd / bank * 100 >= DD_ALERT_BANK_PCT[self.alerted_dd]:
+            out.append(f"📉 Просадка позиции {dd:.2f} USDT ({dd / bank * 100:.1f}% банка, порог "
+                       f"{DD_ALERT_BANK_PCT[self.alerted_dd]:g}%)")
+            self.alerted_dd += 1
+        return out
+
+    # --- чтение ---
+    def under_water(self, ts: Optional[float] = None) -> float:
+        """Секунды с последнего пика (0, если PnL сейчас на пике)."""
+        if self.last is None or self.last[1] >= self.peak:
+            return 0.0
+        return (ts if ts is not None else self.last[0]) - self.peak_ts
+
+    def recent(self) -> np.ndarray:
+        """Тики из кольца по возрастанию времени."""
+        n = min(self.count, RAW_LEN)
+        return np.roll(self.raw, -self.head)[RAW_LEN - n:]
+
+    def history(self) -> np.ndarray:
+        return self.hist[:self.buckets].copy()
+
+    def sparkline(self, width: int = 32) -> str:
+        v = self.hist["upnl_last"][:self.buckets]
+        if not len(v):
+            return ""
+        if len(v) > width:
+            v = v[np.linspace(0, len(v) - 1, width).round().astype(int)]
+        lo, hi = float(np.min(v)), float(np.max(v))
+        if hi - lo < 1e-12:
+            return SPARK[3] * len(v)
+        return "".join(SPARK[int((x - lo) / (hi - lo) * (len(SPARK) - 1))] for x in v)
+
+
+def format_status(eq: Optional[PositionEquity]) -> str:
+    if eq is None or eq.last is None:
+        return ""
+    ts, upnl, margin, usage, liq_dist = eq.last
+    pct = upnl / margin * 100 if margin else 0.0
+    liq_txt = "N/A" if math.isnan(liq_dist) else f"{liq_dist:.2f}%"
+    liq_min = "N/A" if math.isnan(eq.liq_dist_min) else f"{eq.liq_dist_min:.2f}%"
+    lines = [
+        f"• <b>Нереализ. PnL (net):</b> {upnl:+.2f} USDT ({pct:+.2f}% маржи)",
+        f"• <b>Пик / MAE:</b> {eq.peak:+.2f} / {eq.mae:+.2f} USDT",
+        f"• <b>Просадка:</b> сейчас {eq.peak - upnl:.2f}, макс {eq.max_dd:.2f} USDT",
+        f"• <b>Под водой:</b> {eq.under_water() / 60:.0f} мин (макс {eq.tuw_max / 60:.0f} мин)",
+        f"• <b>Маржа:</b> {margin:.2f} USDT ({usage * 100:.1f}% банка, макс {eq.usage_max * 100:.1f}%)",
+        f"• <b>До ликвидации:</b> {liq_txt} (мин {liq_min})",
+    ]
+    spark = eq.sparkline()
+    if spark:
+        lines.append(f"• <b>PnL по {eq.bucket_sec / 60:g} мин:</b> <code>{spark}</code>")
+    return "\n".join(lines)
+
+
+def prometheus(pos) -> str:
+    """Gauges текущей позиции для /metrics; без позиции — только bot_position_open 0."""
+    eq = getattr(pos, "mtm", None) if pos is not None else None
+    out = ["# TYPE bot_position_open gauge", f"bot_position_open {int(pos is not None)}"]
+    if eq is None or eq.last is None:
+        return "\n".join(out)
+    import metrics
+    labels = f'{{signal="{metrics.escape(pos.signal_id)}",side="{pos.side}"}}'
+    ts, upnl, margin, usage, liq_dist = eq.last
+    for name, value in (("unrealized_pnl_usdt", upnl), ("margin_usdt", margin), ("margin_usage_ratio", usage),
+                        ("liq_distance_pct", liq_dist), ("liq_distance_min_pct", eq.liq_dist_min),
+                        ("peak_pnl_usdt", eq.peak), ("drawdown_usdt", eq.peak - upnl),
+                        ("max_drawdown_usdt", eq.max_dd), ("time_under_water_seconds", eq.under_water()),
+                        ("max_time_under_water_seconds", eq.tuw_max)):
+        out += [f"# TYPE bot_position_{name} gauge", f"bot_position_{name}{labels} {value:.6f}"]
+    return "\n".join(out)
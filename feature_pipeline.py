@@ -0,0 +1,132 @@
+# feature_pipeline.py
+# Потоковая подготовка обучающей выборки: OHLCV читается кусками, индикаторы считаются с переносом
+# состояния (EMA200/RSI/стохастик), метки (labeling, первое касание) — с переносом look-forward хвоста.
+# Результат — шарды float32 на диске (manifest.json + {i}_X.npy / {i}_y.npy / {i}_t.npy); обучение (walk_forward)
+# сводит их в упорядоченный по времени кэш.
+import json
+import os
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+from incremental import AtrState, EmaState, RsiState, StochState
+from labeling import triple_barrier_labels
+
+FEATURES = ["RSI_14", "STOCHk_14_3_3", "EMA_50", "EMA_200", "close", "volume"]
+SUPPORTED_FEATURES = FEATURES + ["ATRr_14"]
+LABELS = ["SL/Nothing", "LONG Win", "SHORT Win"]
+CHUNK_ROWS = 500_000
+MANIFEST = "manifest.json"
+
+
+class FeatureState:
+    """Состояние индикаторов одного символа между кусками."""
+
+    def __init__(self, features: List[str] = FEATURES):
+        unknown = set(features) - set(SUPPORTED_FEATURES)
+        if unknown:
+            raise ValueError(f"Unsupported features: {sorted(unknown)}")
+        self.features = list(features)
+        self.rsi = RsiState(14)
+        self.stoch = StochState(14, 3, 3)
+        self.ema50 = EmaState(50)
+        self.ema200 = EmaState(200)
+        self.atr = AtrState(14) if "ATRr_14" in features else None
+
+    def transform(self, ohlcv: np.ndarray) -> np.ndarray:
+        """(n, 6) ts/o/h/l/c/v -> (n, len(features)) float32; строки прогрева — NaN."""
+        h, l, c, v = ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4], ohlcv[:, 5]
+        cols = {"RSI_14": self.rsi.update_many(c), "STOCHk_14_3_3": self.stoch.update_many(h, l, c)[0],
+                "EMA_50": self.ema50.update_many(c), "EMA_200": self.ema200.update_many(c),
+                "close": c, "volume": v}
+        if self.atr is not None:
+            cols["ATRr_14"] = self.atr.update_many(h, l, c)
+        return np.column_stack([cols[f] for f in self.features]).astype(np.float32)
+
+
+class LabelCarry:
+    """Держит последние look_forward баров до прихода следующего куска."""
+
+    def __init__(self, look_forward: int = 30, tp_pct: float = 0.01, sl_pct: float = 0.005):
+        self.look_forward = look_forward
+        self.tp_pct, self.sl_pct = tp_pct, sl_pct
+        self._ohlcv = np.empty((0, 6))
+        self._X = np.empty((0, len(FEATURES)), dtype=np.float32)
+
+    def push(self, ohlcv: np.ndarray, X: np.ndarray):
+        """Возвращает (ts, X, y) для баров, у которых горизонт уже полностью известен."""
+        ohlcv = np.concatenate([self._ohlcv, ohlcv])
+        X = np.concatenate([self._X, X])
+        y = triple_barrier_labels(ohlcv[:, 2], ohlcv[:, 3], ohlcv[:, 4], self.look_forward, self.tp_pct, self.sl_pct)
+        n = len(y)
+        self._ohlcv, self._X = ohlcv[n:], X[n:]
+        return ohlcv[:n, 0], X[:n], y
+
+
+# ---------------------------------------------------------------------------
+# Источники
+# ---------------------------------------------------------------------------
+def iter_csv(path: str, chunk_rows: int = CHUNK_ROWS) -> Iterator[np.ndarray]:
+    import pandas as pd
+    offset = 0
+    for df in pd.read_csv(path, chunksize=chunk_rows):
+        ts = df["timestamp"].to_numpy(np.float64) if "timestamp" in df else np.arange(offset, offset + len(df), dtype=np.float64)
+        offset += len(df)
+        yield np.column_stack([ts] + [df[c].to_numpy(np.float64) for c in ("open", "high", "low", "close", "volume")])
+
+
+def iter_lake(exchange_id: str, timeframe: str, symbol: str, root: str | None = None) -> Iterator[np.ndarray]:
+    import data_lake
+    for _, path in data_lake.list_partitions(exchange_id, timeframe, symbol, root):
+        yield data_lake.read_partition(path)
+
+
+# ---------------------------------------------------------------------------
+# Сборка шардов
+# ---------------------------------------------------------------------------
+def build_dataset(sources: Dict[str, Iterable[np.ndarray]], out_dir: str, look_forward: int = 30,
+                  tp_pct: float = 0.01, sl_pct: float = 0.005) -> dict:
+    """Прогоняет источники {symbol: куски OHLCV} через индикаторы и разметку, пишет шарды в out_dir."""
+    os.makedirs(out_dir, exist_ok=True)
+    shards: List[dict] = []
+    for symbol, chunks in sources.items():
+        feats, labels = FeatureState(), LabelCarry(look_forward, tp_pct, sl_pct)
+        for chunk in chunks:
+            if not len(chunk):
+                continue
+            ts, X, y = labels.push(chunk, feats.transform(chunk))
+            ok = ~np.isnan(X).any(axis=1)
+            if not ok.any():
+                continue
+            i = len(shards)
+            np.save(os.path.join(out_dir, f"{i:05d}_X.npy"), np.ascontiguousarray(X[ok]))
+            np.save(os.path.join(out_dir, f"{i:05d}_y.npy"), y[ok])
+            np.save(os.path.join(out_dir, f"{i:05d}_t.npy"), ts[ok].astype(np.int64))
+            shards.append({"id": i, "symbol": symbol, "rows": int(ok.sum()),
+                           "first_ts": int(ts[ok][0]), "last_ts": int(ts[ok][-1])})
+    manifest = {"features": FEATURES, "labels": LABELS, "labeler": "first_touch", "look_forward": look_forward,
+                "tp_pct": tp_pct, "sl_pct": sl_pct, "shards": shards}
+    with open(os.path.join(out_dir, MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=1)
+    return manifest
+
+
+def load_manifest(out_dir: str) -> dict:
+    with open(os.path.join(out_dir, MANIFEST)) as f:
+        return json.load(f)
+
+
+def load_shard(out_dir: str, shard_id: int):
+    """(X, y) шарда, отображённые в память."""
+    return (np.load(os.path.join(out_dir, f"{shard_id:05d}_X.npy"), mmap_mode="r"),
+            np.load(os.path.join(out_dir, f"{shard_id:05d}_y.npy"), mmap_mode="r"))
+
+
+def load_shard_ts(out_dir: str, shard_id: int) -> np.ndarray:
+    return np.load(os.path.join(out_dir, f"{shard_id:05d}_t.npy"), mmap_mode="r")
+
+
+def iter_shards(out_dir: str, manifest: dict) -> Iterator[tuple]:
+    """(X, y) по всем шардам по порядку манифеста."""
+    for sh in manifest["shards"]:
+        X, y = load_shard(out_dir, sh["id"])
+        yield np.asarray(X), np.asarray(y)
@@ -0,0 +1,230 @@
+# incremental.py
+# Инкрементальные индикаторы: O(1) на бар, значения совпадают с pandas_ta (без TA-Lib) с первого бара:
+#   EMA — ta.ema(sma=True): SMA-затравка, дальше рекуррентно;
+#   RSI/ATR — ta.rma = ewm(alpha=1/length, adjust=True, min_periods=length): веса нормируются с первого бара.
+# update_many — то же самое для целого куска истории (векторно), состояние переносится между кусками.
+import math
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def _recurrence(xs: np.ndarray, alpha: float, y0: float) -> np.ndarray:
+    """y[t] = alpha * x[t] + (1 - alpha) * y[t-1], y[-1] = y0."""
+    from scipy.signal import lfilter
+    y, _ = lfilter([alpha], [1.0, alpha - 1.0], xs, zi=[(1.0 - alpha) * y0])
+    return y
+
+
+def _rolling(tail: np.ndarray, xs: np.ndarray, window: int, fn):
+    """Скользящее fn по окну window для новых значений xs с учётом хвоста прошлого куска."""
+    buf = np.concatenate([tail, xs])
+    out = np.full(len(xs), np.nan)
+    if len(buf) >= window:
+        r = fn(sliding_window_view(buf, window), axis=1)
+        m = min(len(r), len(xs))
+        out[len(xs) - m:] = r[len(r) - m:]
+    return out, buf[max(0, len(buf) - (window - 1)):]
+
+
+class EmaState:
+    """EMA с SMA-затравкой (как ta.ema(sma=True))."""
+
+    def __init__(self, length: int):
+        self.length = int(length)
+        self.alpha = 2.0 / (self.length + 1)
+        self.value = None
+        self.n = 0
+        self._seed = 0.0
+
+    def update(self, x: float) -> float | None:
+        self.n += 1
+        if self.value is None:
+            self._seed += x
+            if self.n >= self.length:
+                self.value = self._seed / self.length
+            return self.value
+        self.value = self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+    def peek(self, x: float) -> float | None:
+        """Значение с учётом ещё не закрытого бара, без изменения состояния."""
+        if self.value is None:
+            return None
+        return self.alpha * x + (1 - self.alpha) * self.value
+
+    def update_many(self, xs) -> np.ndarray:
+        xs = np.asarray(xs, dtype=np.float64)
+        out = np.full(len(xs), np.nan)
+        i = 0
+        if self.value is None:
+            i = min(self.length - self.n, len(xs))
+            self._seed += float(xs[:i].sum())
+            self.n += i
+            if self.n >= self.length:
+                self.value = self._seed / self.length
+                out[i - 1] = self.value
+        if i < len(xs) and self.value is not None:
+            out[i:] = _recurrence(xs[i:], self.alpha, self.value)
+            self.n += len(xs) - i
+            self.value = float(out[-1])
+        return out
+
+
+class RmaState(EmaState):
+    """Сглаживание Уайлдера с SMA-затравкой (как в TA-Lib; alpha = 1/length)."""
+
+    def __init__(self, length: int):
+        super().__init__(length)
+        self.alpha = 1.0 / self.length
+
+
+class EwmState:
+    """ta.rma без TA-Lib: pandas ewm(alpha=1/length, adjust=True, min_periods=length).
+    Хранит взвешенную сумму num и число наблюдений; знаменатель — сумма весов (1 - (1-alpha)^n) / alpha.
+    От RmaState отличается только на прогреве (след затравки ~(1-1/length)^n)."""
+
+    def __init__(self, length: int):
+        self.length = int(length)
+        self.alpha = 1.0 / self.length
+        self.num = 0.0
+        self.n = 0
+
+    def _mean(self, num, n):
+        return num * self.alpha / (1.0 - (1.0 - self.alpha) ** n)
+
+    @property
+    def value(self) -> float | None:
+        return float(self._mean(self.num, self.n)) if self.n >= self.length else None
+
+    def update(self, x: float) -> float | None:
+        self.num = x + (1.0 - self.alpha) * self.num
+        self.n += 1
+        return self.value
+
+    def peek(self, x: float) -> float | None:
+        if self.n + 1 < self.length:
+            return None
+        return float(self._mean(x + (1.0 - self.alpha) * self.num, self.n + 1))
+
+    def update_many(self, xs) -> np.ndarray:
+        from scipy.signal import lfilter
+        xs = np.asarray(xs, dtype=np.float64)
+        out = np.full(len(xs), np.nan)
+        if not len(xs):
+            return out
+        b = 1.0 - self.alpha
+        num, _ = lfilter([1.0], [1.0, -b], xs, zi=[b * self.num])
+        n = self.n + np.arange(1, len(xs) + 1)
+        ok = n >= self.length
+        out[ok] = self._mean(num[ok], n[ok])
+        self.num, self.n = float(num[-1]), int(n[-1])
+        return out
+
+
+class AtrState:
+    """ATR (ta.atr): true range, сглаженный ta.rma."""
+
+    def __init__(self, length: int):
+        self.rma = EwmState(length)
+        self.prev_close = None
+
+    @property
+    def value(self) -> float | None:
+        return self.rma.value
+
+    def _tr(self, high: float, low: float) -> float | None:
+        if self.prev_close is None:
+            return None
+        return max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+
+    def update(self, high: float, low: float, close: float) -> float | None:
+        tr = self._tr(high, low)
+        self.prev_close = close
+        if tr is None or math.isnan(tr):
+            return self.rma.value
+        return self.rma.update(tr)
+
+    def peek(self, high: float, low: float, close: float) -> float | None:
+        tr = self._tr(high, low)
+        return self.rma.value if tr is None else self.rma.peek(tr)
+
+    def update_many(self, highs, lows, closes) -> np.ndarray:
+        h, l, c = (np.asarray(a, dtype=np.float64) for a in (highs, lows, closes))
+        out = np.full(len(c), np.nan)
+        if not len(c):
+            return out
+        start = 1 if self.prev_close is None else 0
+        pc = np.r_[c[0] if self.prev_close is None else self.prev_close, c[:-1]]
+        tr = np.maximum(h - l, np.maximum(np.abs(h - pc), np.abs(l - pc)))[start:]
+        self.prev_close = float(c[-1])
+        out[start:] = self.rma.update_many(tr)
+        return out
+
+
+class RsiState:
+    """RSI (ta.rsi): средние роста/падения через ta.rma."""
+
+    def __init__(self, length: int = 14):
+        self.gain = EwmState(length)
+        self.loss = EwmState(length)
+        self.prev_close = None
+
+    @staticmethod
+    def _rsi(g, l):
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return 100.0 * g / (g + l)
+
+    @property
+    def value(self) -> float | None:
+        if self.gain.value is None:
+            return None
+        return float(self._rsi(self.gain.value, self.loss.value))
+
+    def update(self, close: float) -> float | None:
+        if self.prev_close is None:
+            self.prev_close = close
+            return None
+        d = close - self.prev_close
+        self.prev_close = close
+        self.gain.update(max(d, 0.0))
+        self.loss.update(max(-d, 0.0))
+        return self.value
+
+    def update_many(self, closes) -> np.ndarray:
+        closes = np.asarray(closes, dtype=np.float64)
+        out = np.full(len(closes), np.nan)
+        if not len(closes):
+            return out
+        prev = closes[0] if self.prev_close is None else self.prev_close
+        start = 1 if self.prev_close is None else 0
+        d = np.diff(np.r_[prev, closes])[start:]
+        self.prev_close = float(closes[-1])
+        out[start:] = self._rsi(self.gain.update_many(np.maximum(d, 0.0)),
+                                self.loss.update_many(np.maximum(-d, 0.0)))
+        return out
+
+
+class StochState:
+    """Стохастик (ta.stoch): возвращает пару (%K, %D)."""
+
+    def __init__(self, k: int = 14, d: int = 3, smooth_k: int = 3):
+        self.k, self.d, self.smooth_k = int(k), int(d), int(smooth_k)
+        self._h = np.empty(0)
+        self._l = np.empty(0)
+        self._raw = np.empty(0)
+        self._k = np.empty(0)
+
+    def update_many(self, highs, lows, closes) -> tuple[np.ndarray, np.ndarray]:
+        hh, self._h = _rolling(self._h, np.asarray(highs, dtype=np.float64), self.k, np.max)
+        ll, self._l = _rolling(self._l, np.asarray(lows, dtype=np.float64), self.k, np.min)
+        rng = hh - ll
+        rng[rng == 0] = np.finfo(float).eps
+        raw = 100.0 * (np.asarray(closes, dtype=np.float64) - ll) / rng
+        k, self._raw = _rolling(self._raw, raw, self.smooth_k, np.mean)
+        d, self._k = _rolling(self._k, k, self.d, np.mean)
+        return k, d
+
+    def update(self, high: float, low: float, close: float) -> tuple[float, float]:
+        k, d = self.update_many([high], [low], [close])
+        return float(k[0]), float(d[0])
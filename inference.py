@@ -0,0 +1,115 @@
+# inference.py
+# Онлайн-скоринг модели для сканера: бустер грузится один раз, фичи по символам ведутся
+# инкрементально (feature_pipeline.FeatureState), все пары бара оцениваются одним inplace_predict.
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+
+from feature_pipeline import FEATURES, FeatureState
+
+log = logging.getLogger("inference")
+
+CLASS_INDEX = {"LONG": 1, "SHORT": 2}
+# EMA_200 (самый длинный индикатор) засевается SMA; на обучении история длинная и засев давно забыт.
+# Скоринг — только когда след засева < ~0.1%: 200 баров засева + ln(1e-3)/ln(1-2/201) ≈ 690.
+WARMUP_BARS = 900
+
+
+class _SymbolFeatures:
+    def __init__(self, features):
+        self.state = FeatureState(features)
+        self.last_ts: Optional[int] = None
+        self.row: Optional[np.ndarray] = None
+        self.bars = 0
+
+
+class ModelScorer:
+    def __init__(self, booster, features=None, history: int = 500, warmup: int = WARMUP_BARS):
+        self.booster = booster
+        self.warmup = warmup
+        self.features = list(features or booster.feature_names or FEATURES)
+        self.symbols: Dict[str, _SymbolFeatures] = {}
+        self.latency_ms = deque(maxlen=history)
+        self.batch_sizes = deque(maxlen=history)
+
+    @classmethod
+    def load(cls, path: str) -> "ModelScorer":
+        import xgboost as xgb
+        if path.endswith(".pkl"):
+            import joblib
+            booster = joblib.load(path).get_booster()
+        else:
+            booster = xgb.Booster()
+            booster.load_model(path)
+        booster.set_param({"nthread": 1})
+        return cls(booster)
+
+    def needs_history(self, symbol: str, closed: np.ndarray) -> bool:
+        """observe начнёт прогрев заново (символ новый или разрыв истории) — стоит подгрузить бары до closed."""
+        sf = self.symbols.get(symbol)
+        return sf is None or sf.last_ts is None or not len(closed) or closed[0, 0] > sf.last_ts
+
+    def observe(self, symbol: str, closed: np.ndarray, history: Optional[np.ndarray] = None) -> bool:
+        """Досчитывает фичи по новым закрытым барам; при разрыве истории — прогрев заново, с history
+        (бары до closed: data lake / длинная загрузка), если она есть. True, если вектор готов и прогрет."""
+        if self.needs_history(symbol, closed):
+            sf = self.symbols[symbol] = _SymbolFeatures(self.features)
+            new = closed
+            if history is not None and len(history) and len(closed):
+                new = np.concatenate([history[history[:, 0] < closed[0, 0]], closed])
+        else:
+            sf = self.symbols[symbol]
+            new = closed[closed[:, 0] > sf.last_ts]
+        if len(new):
+            sf.row = sf.state.transform(new)[-1]
+            sf.last_ts = int(new[-1, 0])
+            sf.bars += len(new)
+        return self._ready(sf)
+
+    def _ready(self, sf: _SymbolFeatures) -> bool:
+        return sf.bars >= self.warmup and sf.row is not None and not np.isnan(sf.row).any()
+
+    def forget(self, symbol: str):
+        self.symbols.pop(symbol, None)
+
+    def predict(self, symbols: Iterable[str]) -> Dict[str, np.ndarray]:
+        """Вероятности классов (SL/Nothing, LONG, SHORT) одним батчем; пары без готовых фичей пропускаются."""
+        ready = [s for s in symbols if (sf := self.symbols.get(s)) is not None and self._ready(sf)]
+        if not ready:
+            return {}
+        X = np.stack([self.symbols[s].row for s in ready])
+        t0 = time.perf_counter()
+        proba = self.booster.inplace_predict(X)
+        self.latency_ms.append((time.perf_counter() - t0) * 1000)
+        self.batch_sizes.append(len(ready))
+        return dict(zip(ready, np.asarray(proba).reshape(len(ready), -1)))
+
+    def stats(self) -> dict:
+        if not self.latency_ms:
+            return {"calls": 0}
+        lat = np.array(self.latency_ms)
+        return {"calls": len(lat), "p50_ms": float(np.percentile(lat, 50)), "p95_ms": float(np.percentile(lat, 95)),
+                "max_ms": float(lat.max()), "last_ms": float(lat[-1]), "last_batch": int(self.batch_sizes[-1])}
+
+
+def side_prob(proba: Optional[np.ndarray], side: str) -> Optional[float]:
+    return None if proba is None else float(proba[CLASS_INDEX[side]])
+
+
+def load_scorer(path: str) -> Optional[ModelScorer]:
+    if not path or not os.path.exists(path):
+        if path:
+            log.warning(f"Model file {path} not found; ML scoring disabled.")
+        return None
+    try:
+        t0 = time.perf_counter()
+        scorer = ModelScorer.load(path)
+        log.info(f"Model {path} loaded in {time.perf_counter() - t0:.2f}s; features: {scorer.features}")
+        return scorer
+    except Exception as e:
+        log.error(f"Could not load model {path}: {e}", exc_info=True)
+        return None
@@ -0,0 +1,295 @@
+# ipc_bus.py
+# Стратегия в отдельном процессе: Telegram-процесс (main.py) держит bot_data, команды и рассылку,
+# воркер крутит scanner_main_loop движка со своим event loop и своим ядром CPU. Связь — duplex Pipe
+# (socketpair) с короткими сообщениями (вид, данные):
+#   фронт -> воркер: ("set", {ключ: значение}) — управляющие ключи bot_data; ("cmd", "close"|"open"|"stop");
+#                    ("ask", (id, "stalls"|"profile", аргумент)) — диагностика процесса стратегии;
+#   воркер -> фронт: ("state", {"set": {ключ: pickle}, "del": [...]}) — изменившиеся ключи bot_data;
+#                    ("say", текст) — рассылка; ("shadow", pickle книги); ("answer", (id, ответ));
+#                    ("done", None) — цикл завершён.
+# Включается STRATEGY_PROCESS=1; без него движок работает в процессе бота, как раньше.
+import asyncio
+import importlib
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import pickle
+import threading
+import time
+from typing import Any, Dict, Optional
+
+log = logging.getLogger("ipc_bus")
+
+ENABLED = os.getenv("STRATEGY_PROCESS", "0") == "1"
+PUBLISH_SEC = 0.5        # как часто воркер отдаёт изменения bot_data
+SHADOW_SEC = 30.0        # как часто — книгу теневых вариантов (/shadow)
+# ключи, которыми управляет фронт (команды); остальное состояние — за воркером
+CONTROL_KEYS = ("bot_on", "scan_paused", "safety_bank_usdt", "buffer_over_edge", "fee_maker", "fee_taker",
+                "force_close", "manual_open")
+_MISSING = object()
+
+
+class _Inbox:
+    """Чтение Connection для event loop: recv() в отдельном потоке (сообщение может прийти частями —
+    в loop он бы заблокировался до конца сообщения), готовые сообщения — в asyncio.Queue."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self._loop = asyncio.get_running_loop()
+        self._closed = False
+        self._thread = threading.Thread(target=self._read, name="ipc-inbox", daemon=True)
+        self._thread.start()
+
+    def _put(self, msg):
+        try:
+            self._loop.call_soon_threadsafe(self.queue.put_nowait, msg)
+        except RuntimeError:          # loop уже закрыт
+            self._closed = True
+
+    def _read(self):
+        while not self._closed:
+            try:
+                msg = self.conn.recv()
+            except (EOFError, OSError):
+                break
+            self._put(msg)
+        self._put(("eof", None))
+
+    def close(self):
+        # поток выйдет на EOF/OSError, когда пайп закроют (он daemon и не держит выход процесса)
+        self._closed = True
+
+    async def get(self):
+        return await self.queue.get()
+
+
+def _send(conn, kind: str, data: Any = None) -> bool:
+    try:
+        conn.send((kind, data))
+        return True
+    except (BrokenPipeError, EOFError, OSError):
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Фронт (процесс Telegram)
+# ---------------------------------------------------------------------------
+def _controls(bot_data: dict) -> Dict[str, Any]:
+    return {k: bot_data[k] for k in CONTROL_KEYS if k in bot_data}
+
+
+def sync(app):
+    """Отправляет воркеру управляющие ключи bot_data, изменившиеся с прошлой отправки."""
+    conn = getattr(app, "_ipc_conn", None)
+    if conn is None:
+        return
+    sent = getattr(app, "_ipc_sent", {})
+    cur = _controls(app.bot_data)
+    diff = {k: v for k, v in cur.items() if sent.get(k, _MISSING) != v}
+    diff.update({k: None for k in sent if k not in cur})
+    if diff and _send(conn, "set", diff):
+        setattr(app, "_ipc_sent", cur)
+
+
+def post_command(app, cmd: str):
+    """Аналог scanner_bmr_dca.post_command: сперва ключи (force_close/manual_open), потом сама команда."""
+    conn = getattr(app, "_ipc_conn", None)
+    if conn is None:
+        return
+    sync(app)
+    _send(conn, "cmd", cmd)
+
+
+_ASK_IDS = itertools.count(1)
+
+
+async def ask(app, what: str, arg: Any = None, timeout: float = 10.0) -> Optional[Any]:
+    """Запрос диагностики у процесса стратегии; None — процесса нет или он не ответил за timeout."""
+    conn = getattr(app, "_ipc_conn", None)
+    if conn is None:
+        return None
+    waiting = getattr(app, "_ipc_waiting", None)
+    if waiting is None:
+        waiting = {}
+        setattr(app, "_ipc_waiting", waiting)
+    rid = next(_ASK_IDS)
+    fut = waiting[rid] = asyncio.get_running_loop().create_future()
+    try:
+        if not _send(conn, "ask", (rid, what, arg)):
+            return None
+        return await asyncio.wait_for(fut, timeout)
+    except asyncio.TimeoutError:
+        log.warning(f"Strategy process did not answer '{what}' in {timeout:.0f}s.")
+        return None
+    finally:
+        waiting.pop(rid, None)
+
+
+def _apply_state(app, data: dict):
+    # то, что воркер сам поменял в управляющих ключах (force_close=False и т.п.), ему уже известно
+    sent = getattr(app, "_ipc_sent", {})
+    for k, blob in data.get("set", {}).items():
+        app.bot_data[k] = pickle.loads(blob)
+        if k in CONTROL_KEYS:
+            sent[k] = app.bot_data[k]
+    for k in data.get("del", ()):
+        app.bot_data.pop(k, None)
+        sent.pop(k, None)
+
+
+async def run_remote(app, broadcast, module: str = "scanner_bmr_dca"):
+    """Замена module.scanner_main_loop(app, broadcast) для фронта: цикл идёт в отдельном процессе."""
+    ctx = mp.get_context("spawn")
+    conn, child = ctx.Pipe(duplex=True)
+    init = {k: v for k, v in app.bot_data.items() if _picklable(v)}
+    proc = ctx.Process(target=worker_main, args=(child, module, init), name=f"strategy-{module}", daemon=True)
+    proc.start()
+    child.close()
+    setattr(app, "_ipc_conn", conn)
+    setattr(app, "_ipc_sent", _controls(init))
+    inbox = _Inbox(conn)
+    log.info(f"Strategy {module} started in process {proc.pid}.")
+    try:
+        while True:
+            kind, data = await inbox.get()
+            if kind == "state":
+                _apply_state(app, data)
+            elif kind == "say":
+                await broadcast(app, data)
+            elif kind == "shadow":
+                setattr(app, "_bmr_shadow", pickle.loads(data) if data is not None else None)
+            elif kind == "answer":
+                fut = getattr(app, "_ipc_waiting", {}).get(data[0])
+                if fut is not None and not fut.done():
+                    fut.set_result(data[1])
+            elif kind in ("done", "eof"):
+                break
+    finally:
+        inbox.close()
+        for fut in getattr(app, "_ipc_waiting", {}).values():
+            if not fut.done():
+                fut.set_result(None)
+        setattr(app, "_ipc_conn", None)
+        conn.close()
+        await asyncio.to_thread(proc.join, 10)
+        if proc.is_alive():
+            proc.terminate()
+        log.info(f"Strategy process {proc.pid} exited ({proc.exitcode}).")
+
+
+def _picklable(v) -> bool:
+    try:
+        pickle.dumps(v)
+        return True
+    except Exception:
+        return False
+
+
+# ---------------------------------------------------------------------------
+# Воркер (процесс стратегии)
+# ---------------------------------------------------------------------------
+class WorkerApp:
+    """Заменитель telegram Application в процессе стратегии: циклу нужны bot_data и атрибуты."""
+
+    def __init__(self, bot_data: dict):
+        self.bot_data = bot_data
+
+
+def worker_main(conn, module: str, bot_data: dict):
+    logging.basicConfig(level=logging.INFO,
+                        format="%(asctime)s - %(name)s - %(levelname)s - [strategy] %(message)s")
+    asyncio.run(_worker(conn, module, bot_data))
+
+
+async def _worker(conn, module_name: str, bot_data: dict):
+    module = importlib.import_module(module_name)
+    app = WorkerApp(bot_data)
+    sent: Dict[str, bytes] = {k: pickle.dumps(v) for k, v in bot_data.items()}
+    inbox = _Inbox(conn)
+
+    async def broadcast(_app, text: str):
+        _send(conn, "say", text)
+
+    import loop_monitor
+    monitor = loop_monitor.LoopMonitor()
+    monitor.start()
+    asking: set = set()
+
+    async def answer(rid: int, what: str, arg: Any):
+        try:
+            if what == "stalls":
+                result = monitor.format_report(int(arg or 10))
+            elif what == "profile":
+                import profiler
+                prof = await profiler.profile_for(float(arg or 30.0))
+                result = {"summary": prof.format_summary(), "collapsed": prof.collapsed()}
+            else:
+                result = None
+        except Exception:
+            log.exception(f"ask '{what}' failed")
+            result = None
+        _send(conn, "answer", (rid, result))
+
+    def publish():
+        changed = {}
+        for k, v in list(app.bot_data.items()):
+            try:
+                blob = pickle.dumps(v)
+            except Exception:
+                continue
+            if sent.get(k) != blob:
+                changed[k] = sent[k] = blob
+        gone = [k for k in sent if k not in app.bot_data]
+        for k in gone:
+            del sent[k]
+        if changed or gone:
+            _send(conn, "state", {"set": changed, "del": gone})
+
+    async def read_front():
+        while True:
+            kind, data = await inbox.get()
+            if kind == "set":
+                for k, v in data.items():
+                    if v is None:
+                        app.bot_data.pop(k, None)
+                        sent.pop(k, None)
+                    else:
+                        app.bot_data[k] = v
+                        sent[k] = pickle.dumps(v)
+            elif kind == "cmd":
+                module.post_command(app, data)
+            elif kind == "ask":
+                t = asyncio.create_task(answer(*data), name=f"ipc_ask_{data[1]}")
+                asking.add(t)
+                t.add_done_callback(asking.discard)
+            elif kind == "eof":
+                # фронт пропал — останавливаем цикл штатно (снапшот, закрытие биржи)
+                app.bot_data["bot_on"] = False
+                module.post_command(app, "stop")
+                return
+
+    async def publisher():
+        last_shadow = 0.0
+        while True:
+            await asyncio.sleep(PUBLISH_SEC)
+            publish()
+            if hasattr(module, "shadow_book") and time.monotonic() - last_shadow >= SHADOW_SEC:
+                book = module.shadow_book(app)
+                _send(conn, "shadow", pickle.dumps(book) if book is not None else None)
+                last_shadow = time.monotonic()
+
+    tasks = [asyncio.create_task(read_front(), name="ipc_read"), asyncio.create_task(publisher(), name="ipc_publish")]
+    try:
+        await module.scanner_main_loop(app, broadcast)
+    except Exception:
+        log.exception(f"{module_name} loop crashed")
+    finally:
+        for t in tasks:
+            t.cancel()
+        monitor.stop()
+        publish()
+        _send(conn, "done")
+        inbox.close()
+        conn.close()
@@ -0,0 +1,346 @@
+# journal.py
+# Локальный журнал событий сделок (OPEN/ADD/RETEST_ADD/TRAIL_SET/TP_HIT/SL_HIT/MANUAL_CLOSE) в схеме
+# BMR_HEADERS с типизированными колонками. Только дозапись:
+#   {root}/tail.jsonl        — свежие события, строка на событие (переживает падение процесса);
+#   {root}/seg-000001.parquet — неизменяемые колоночные сегменты (zstd), в них хвост сливается по SEGMENT_ROWS;
+#   {root}/stats.json        — агрегаты для /stats, обновляются на каждом событии за O(1).
+# Если stats.json потерян или отстал от журнала (число строк не совпало), агрегаты пересчитываются с нуля.
+import copy
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+log = logging.getLogger("journal")
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", os.path.join("data", "journal"))
+SEGMENT_ROWS = 1000
+COMPRESSION = "zstd"
+TAIL_FILE = "tail.jsonl"
+STATS_FILE = "stats.json"
+CLOSE_EVENTS = ("TP_HIT", "SL_HIT", "MANUAL_CLOSE")
+# корзины «времени в сделке», мин: [0,15), [15,60), ... [4320, inf)
+TIME_EDGES = (15, 60, 240, 1440, 4320)
+
+STR_COLUMNS = {"Event_ID", "Signal_ID", "Pair", "Side", "Event", "Next_DCA_Label", "Triggered_Label", "Supertrend"}
+INT_COLUMNS = {"Step_No", "Leverage", "Trail_Stage"}
+TS_COLUMNS = {"Timestamp_UTC"}
+
+
+def _headers() -> List[str]:
+    from trade_executor import BMR_HEADERS
+    return BMR_HEADERS
+
+
+def schema():
+    import pyarrow as pa
+
+    def typ(c):
+        if c in STR_COLUMNS:
+            return pa.string()
+        if c in INT_COLUMNS:
+            return pa.int32()
+        if c in TS_COLUMNS:
+            return pa.timestamp("s", tz="UTC")
+        return pa.float64()
+    return pa.schema([(c, typ(c)) for c in _headers()])
+
+
+def _typed(c: str, v: Any):
+    """Значение из payload -> тип колонки; пустые строки, None и мусор -> null."""
+    if v is None or v == "":
+        return None
+    try:
+        if c in STR_COLUMNS:
+            return str(v)
+        if c in TS_COLUMNS:
+            if isinstance(v, (int, float)):
+                return int(v)
+            return int(datetime.strptime(str(v), "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp())
+        if c in INT_COLUMNS:
+            return int(float(v))
+        f = float(v)
+        return f if f == f else None
+    except (TypeError, ValueError):
+        return None
+
+
+def to_row(payload: dict) -> Dict[str, Any]:
+    return {c: _typed(c, payload.get(c)) for c in _headers()}
+
+
+# ---------------------------------------------------------------------------
+# Агрегаты
+# ---------------------------------------------------------------------------
+def _side() -> dict:
+    return {"trades": 0, "wins": 0, "pnl_usd": 0.0, "pnl_pct": 0.0, "steps": 0}
+
+
+def empty_stats() -> dict:
+    return {
+        "rows": 0, "first_ts": None, "last_ts": None,
+        "events": {},
+        "open": {},                          # Signal_ID -> {"side", "ts", "steps"}
+        "trades": 0, "wins": 0,
+        "sides": {"LONG": _side(), "SHORT": _side()},
+        "exits": {e: 0 for e in CLOSE_EVENTS},
+        "steps_hist": {},                    # шагов в сделке -> число сделок
+        "time_hist": [0] * (len(TIME_EDGES) + 1),
+        "time_sum": 0.0, "time_max": 0.0,
+        "equity": 0.0, "peak": 0.0, "max_dd": 0.0, "max_dd_ts": None,
+    }
+
+
+def update_stats(st: dict, row: Dict[str, Any]):
+    """Одно событие в агрегаты (строка уже типизирована to_row)."""
+    st["rows"] += 1
+    ts, ev, sid = row.get("Timestamp_UTC"), row.get("Event") or "", row.get("Signal_ID") or ""
+    if ts is not None:
+        st["first_ts"] = ts if st["first_ts"] is None else min(st["first_ts"], ts)
+        st["last_ts"] = ts if st["last_ts"] is None else max(st["last_ts"], ts)
+    st["events"][ev] = st["events"].get(ev, 0) + 1
+    step = row.get("Step_No")
+    if ev == "OPEN":
+        st["open"][sid] = {"side": row.get("Side"), "ts": ts, "steps": step or 1}
+    elif ev in ("ADD", "RETEST_ADD") and sid in st["open"] and step is not None:
+        st["open"][sid]["steps"] = max(st["open"][sid]["steps"], step)
+    if ev not in CLOSE_EVENTS:
+        return
+    trade = st["open"].pop(sid, None)
+    side = row.get("Side") or (trade or {}).get("side")
+    pnl = row.get("PNL_Realized_USDT") or 0.0
+    s = st["sides"].setdefault(side or "?", _side())
+    win = pnl > 0
+    st["trades"] += 1
+    st["wins"] += win
+    st["exits"][ev] = st["exits"].get(ev, 0) + 1
+    s["trades"] += 1
+    s["wins"] += win
+    s["pnl_usd"] += pnl
+    s["pnl_pct"] += row.get("PNL_Realized_Pct") or 0.0
+    if trade is not None:
+        n = int(trade["steps"])
+        s["steps"] += n
+        st["steps_hist"][str(n)] = st["steps_hist"].get(str(n), 0) + 1
+    t = row.get("Time_In_Trade_min")
+    if t is not None:
+        st["time_hist"][sum(t >= e for e in TIME_EDGES)] += 1
+        st["time_sum"] += t
+        st["time_max"] = max(st["time_max"], t)
+    st["equity"] += pnl
+    st["peak"] = max(st["peak"], st["equity"])
+    if st["peak"] - st["equity"] > st["max_dd"]:
+        st["max_dd"] = st["peak"] - st["equity"]
+        st["max_dd_ts"] = ts
+
+
+# ---------------------------------------------------------------------------
+# Хранилище
+# ---------------------------------------------------------------------------
+class Journal:
+    def __init__(self, root: str = JOURNAL_DIR):
+        os.makedirs(root, exist_ok=True)
+        self.root = root
+        self._recover()
+        self.tail_rows = self._count_tail()
+        self.stats = self._load_stats()
+        rows = self.segment_rows() + self.tail_rows
+        if self.stats is None and not rows:
+            self.stats = empty_stats()
+        elif self.stats is None or self.stats["rows"] != rows:
+            log.warning(f"Journal stats in {root} missing or stale; rebuilding from events.")
+            self.stats = self.rebuild()
+            self._save_stats()
+
+    # --- файлы ---
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root, name)
+
+    def segments(self) -> List[str]:
+        return sorted(self._path(f) for f in os.listdir(self.root) if f.startswith("seg-") and f.endswith(".parquet"))
+
+    def segment_rows(self) -> int:
+        segs = self.segments()
+        if not segs:
+            return 0
+        import pyarrow.parquet as pq
+        return sum(pq.ParquetFile(p).metadata.num_rows for p in segs)
+
+    def _count_tail(self) -> int:
+        try:
+            with open(self._path(TAIL_FILE), "rb") as f:
+                return sum(1 for line in f if line.strip())
+        except FileNotFoundError:
+            return 0
+
+    def _read_tail(self, path: Optional[str] = None) -> List[dict]:
+        try:
+            with open(path or self._path(TAIL_FILE), encoding="utf-8") as f:
+                return [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    def _recover(self):
+        """Сегмент, сливавшийся при падении: запечатанный хвост либо дописываем в сегмент, либо удаляем."""
+        for f in sorted(os.listdir(self.root)):
+            if f.startswith("sealed-") and f.endswith(".jsonl"):
+                seg = self._path(f"seg-{f[7:-6]}.parquet")
+                if not os.path.exists(seg):
+                    self._write_segment(seg, self._read_tail(self._path(f)))
+                os.remove(self._path(f))
+
+    def _write_segment(self, path: str, rows: List[dict]):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pylist(rows, schema=schema())
+        tmp = path + ".tmp"
+        pq.write_table(table, tmp, compression=COMPRESSION)
+        os.replace(tmp, path)
+
+    def _seal(self):
+        segs = self.segments()
+        n = int(os.path.basename(segs[-1])[4:-8]) + 1 if segs else 1
+        sealed = self._path(f"sealed-{n:06d}.jsonl")
+        os.replace(self._path(TAIL_FILE), sealed)
+        self._write_segment(self._path(f"seg-{n:06d}.parquet"), self._read_tail(sealed))
+        os.remove(sealed)
+        self.tail_rows = 0
+        log.info(f"Journal segment {n:06d} written.")
+
+    def _load_stats(self) -> Optional[dict]:
+        try:
+            with open(self._path(STATS_FILE), encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_stats(self):
+        tmp = self._path(STATS_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.stats, f)
+        os.replace(tmp, self._path(STATS_FILE))
+
+    # --- API ---
+    def append(self, payload: dict):
+        row = to_row(payload)
+        with open(self._path(TAIL_FILE), "a", encoding="utf-8") as f:
+            f.write(json.dumps(row) + "\n")
+        self.tail_rows += 1
+        update_stats(self.stats, row)
+        self._save_stats()
+        if self.tail_rows >= SEGMENT_ROWS:
+            self._seal()
+
+    def read(self, columns: Optional[List[str]] = None):
+        """Весь журнал как pyarrow.Table (сегменты + хвост) в порядке записи."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        sch = schema()
+        names = columns or sch.names
+        target = pa.schema([sch.field(c) for c in names])
+        # parquet хранит timestamp[s] как ms — приводим сегменты к схеме журнала
+        parts = [pq.read_table(p, columns=names, memory_map=True).cast(target) for p in self.segments()]
+        tail = self._read_tail()
+        if tail:
+            parts.append(pa.Table.from_pylist(tail, schema=sch).select(names))
+        if not parts:
+            return target.empty_table()
+        return pa.concat_tables(parts)
+
+    def rebuild(self) -> dict:
+        cols = ["Timestamp_UTC", "Signal_ID", "Side", "Event", "Step_No",
+                "PNL_Realized_USDT", "PNL_Realized_Pct", "Time_In_Trade_min"]
+        table = self.read(cols)
+        st = empty_stats()
+        data = {c: table.column(c).to_pylist() for c in cols}
+        data["Timestamp_UTC"] = [None if t is None else int(t.timestamp()) for t in data["Timestamp_UTC"]]
+        for i in range(table.num_rows):
+            update_stats(st, {c: data[c][i] for c in cols})
+        return st
+
+
+_JOURNAL: Optional[Journal] = None
+_LOCK = threading.Lock()      # record() идёт из пула потоков: дозаписи и чтение агрегатов — по очереди
+
+
+def journal() -> Journal:
+    global _JOURNAL
+    if _JOURNAL is None:
+        _JOURNAL = Journal()
+    return _JOURNAL
+
+
+def use(root: Optional[str]):
+    """Переключает журнал процесса на другой каталог (replay пишет в свою временную папку); None — по умолчанию."""
+    global _JOURNAL
+    _JOURNAL = Journal(root) if root else None
+
+
+def record(payload: dict):
+    """Дозапись события: пишет на диск (раз в SEGMENT_ROWS — parquet-сегмент), из цикла — через executor."""
+    try:
+        with _LOCK:
+            journal().append(payload)
+    except Exception:
+        log.exception("journal append failed")
+
+
+def current_stats(root: str = JOURNAL_DIR) -> dict:
+    """Агрегаты без открытия журнала: в режиме STRATEGY_PROCESS пишет воркер, /stats читает файл."""
+    if _JOURNAL is not None and os.path.abspath(_JOURNAL.root) == os.path.abspath(root):
+        with _LOCK:
+            return copy.deepcopy(_JOURNAL.stats)
+    try:
+        with open(os.path.join(root, STATS_FILE), encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return empty_stats()
+
+
+# ---------------------------------------------------------------------------
+# Отчёт
+# ---------------------------------------------------------------------------
+def _pct(a: float, b: float) -> str:
+    return f"{100.0 * a / b:.1f}%" if b else "—"
+
+
+def _day(ts: Optional[int]) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%d") if ts else "—"
+
+
+def format_stats(st: dict) -> str:
+    n = st["trades"]
+    if not st["rows"]:
+        return "Журнал пуст."
+    lines = [f"Событий: {st['rows']} ({_day(st['first_ts'])} .. {_day(st['last_ts'])}), "
+             f"открыто сейчас: {len(st['open'])}",
+             f"Сделок: {n}, винрейт {_pct(st['wins'], n)}  "
+             + " / ".join(f"{e} {st['exits'].get(e, 0)}" for e in CLOSE_EVENTS)]
+    steps_n = sum(st["steps_hist"].values())
+    if steps_n:
+        avg = sum(int(k) * v for k, v in st["steps_hist"].items()) / steps_n
+        hist = " ".join(f"{k}:{v}" for k, v in sorted(st["steps_hist"].items(), key=lambda kv: int(kv[0])))
+        lines.append(f"Шагов в сделке: ср. {avg:.2f}  [{hist}]")
+    lines.append("")
+    lines.append(f"{'side':<6}{'сделок':>7}{'винрейт':>9}{'PnL USDT':>11}{'ср.%':>8}{'шагов':>7}")
+    total = 0.0
+    for side in sorted(st["sides"]):
+        s = st["sides"][side]
+        if not s["trades"]:
+            continue
+        total += s["pnl_usd"]
+        lines.append(f"{side:<6}{s['trades']:>7}{_pct(s['wins'], s['trades']):>9}{s['pnl_usd']:>+11.2f}"
+                     f"{s['pnl_pct'] / s['trades']:>+8.2f}{s['steps'] / s['trades']:>7.2f}")
+    lines.append(f"{'всего':<6}{n:>7}{_pct(st['wins'], n):>9}{total:>+11.2f}")
+    lines.append("")
+    timed = sum(st["time_hist"])
+    if timed:
+        labels = [f"<{TIME_EDGES[0]}м"] + [f"{a}-{b}м" for a, b in zip(TIME_EDGES, TIME_EDGES[1:])] + [f"≥{TIME_EDGES[-1]}м"]
+        lines.append(f"Время в сделке: ср. {st['time_sum'] / timed:.0f} мин, макс {st['time_max']:.0f} мин")
+        lines += [f"  {lab:<10}{c:>6}  {_pct(c, timed):>6}" for lab, c in zip(labels, st["time_hist"])]
+    dd_now = st["peak"] - st["equity"]
+    lines.append(f"Просадка (по закрытым): макс {st['max_dd']:.2f} USDT ({_day(st['max_dd_ts'])}), "
+                 f"текущая {dd_now:.2f} USDT, пик {st['peak']:+.2f}")
+    return "\n".join(lines)
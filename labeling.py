@@ -0,0 +1,77 @@
+# labeling.py
+# Разметка по первому касанию барьеров (triple barrier): TP/SL/горизонт.
+# Первое касание ищется двоичным подъёмом по разреженной таблице максимумов — O(n log k) без цикла по барам.
+import numpy as np
+
+BLOCK_ROWS = 262_144
+
+
+def _sparse_table(v: np.ndarray, levels: int) -> list[np.ndarray]:
+    """table[j][p] = max(v[p : p + 2**j])."""
+    table = [v]
+    for j in range(1, levels + 1):
+        prev, half = table[-1], 1 << (j - 1)
+        table.append(np.maximum(prev[:-half], prev[half:]))
+    return table
+
+
+def _first_touch_block(table: list[np.ndarray], t: np.ndarray, horizon: int) -> np.ndarray:
+    n = len(t)
+    out = np.full(n, horizon + 1, dtype=np.int32)
+    # максимум всего окна [i+1, i+horizon] из двух перекрывающихся блоков; подъём — только где касание есть
+    top = table[-1]
+    w = 1 << (len(table) - 1)
+    base = np.flatnonzero(np.maximum(top[1:n + 1], top[horizon - w + 1:horizon - w + 1 + n]) >= t)
+    if not len(base):
+        return out
+    t = t[base]
+    pos, end = base + 1, base + horizon
+    for j in range(len(table) - 1, -1, -1):
+        step, tab = 1 << j, table[j]
+        skip = (pos + step - 1 <= end) & (tab[np.minimum(pos, len(tab) - 1)] < t)
+        pos += step * skip
+    out[base] = pos - base
+    return out
+
+
+def first_touch(x: np.ndarray, thresholds, horizon: int, above: bool = True,
+                block_rows: int = BLOCK_ROWS):
+    """Смещение (1..horizon) первого бара после i, где x >= thr[i] (above) или x <= thr[i].
+
+    thresholds — массив или список массивов (таблица строится один раз на все).
+    len(x) >= len(thr) + horizon; нет касания — horizon + 1.
+    """
+    many = isinstance(thresholds, (list, tuple))
+    ts = [np.asarray(t, dtype=np.float64) for t in (thresholds if many else [thresholds])]
+    x = np.asarray(x, dtype=np.float64)
+    if not above:
+        x, ts = -x, [-t for t in ts]
+    n = len(ts[0])
+    outs = [np.empty(n, dtype=np.int32) for _ in ts]
+    levels = int(np.log2(horizon))
+    for s in range(0, n, block_rows):
+        e = min(n, s + block_rows)
+        table = _sparse_table(x[s:e + horizon], levels)
+        for t, out in zip(ts, outs):
+            out[s:e] = _first_touch_block(table, t[s:e], horizon)
+    return outs if many else outs[0]
+
+
+def triple_barrier_labels(high: np.ndarray, low: np.ndarray, close: np.ndarray, look_forward: int = 30,
+                          tp_pct: float = 0.01, sl_pct: float = 0.005) -> np.ndarray:
+    """Метки для первых len - look_forward баров: 0 = SL/ничего, 1 = LONG TP, 2 = SHORT TP.
+
+    Победа — TP коснулся раньше SL; касание обоих в одном баре считается SL.
+    """
+    n = len(close) - look_forward
+    if n <= 0:
+        return np.empty(0, dtype=np.int8)
+    c = np.asarray(close[:n], dtype=np.float64)
+    long_tp, short_sl = first_touch(high, [c * (1 + tp_pct), c * (1 + sl_pct)], look_forward, above=True)
+    long_sl, short_tp = first_touch(low, [c * (1 - sl_pct), c * (1 - tp_pct)], look_forward, above=False)
+    long_win = (long_tp <= look_forward) & (long_tp < long_sl)
+    short_win = (short_tp <= look_forward) & (short_tp < short_sl)
+    y = np.zeros(n, dtype=np.int8)
+    y[long_win] = 1
+    y[short_win & (~long_win | (short_tp < long_tp))] = 2
+    return y
@@ -0,0 +1,177 @@
+# loop_monitor.py
+# Детектор зависаний event loop: heartbeat-задача меряет задержку планирования, сторожевой поток
+# во время зависания снимает стек потока loop и привязывает зависание к месту в коде.
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, Optional
+
+import metrics
+
+log = logging.getLogger("loop_monitor")
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+STALL_THRESHOLD_SEC = float(os.getenv("LOOP_STALL_MS", "250")) / 1000
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class StallSite:
+    __slots__ = ("site", "count", "total", "max", "last_at", "leaf", "task", "stack")
+
+    def __init__(self, site: str):
+        self.site = site
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last_at = 0.0
+        self.leaf = ""
+        self.task = ""
+        self.stack = ""
+
+
+def _label(fs: traceback.FrameSummary) -> str:
+    path = os.path.relpath(fs.filename, PROJECT_DIR) if fs.filename.startswith(PROJECT_DIR) else \
+        "/".join(fs.filename.replace("\\", "/").split("/")[-2:])
+    return f"{path}:{fs.lineno} {fs.name}"
+
+
+class LoopMonitor:
+    def __init__(self, threshold: float = STALL_THRESHOLD_SEC, interval: float = 0.05, top_n: int = 20,
+                 stack_depth: int = 15):
+        self.threshold = threshold
+        self.interval = interval
+        self.top_n = top_n
+        self.stack_depth = stack_depth
+        self.sites: Dict[str, StallSite] = {}
+        self.stalls = 0
+        self.stall_seconds = 0.0
+        self.lag_last = 0.0
+        self.lag_max = 0.0
+        self.lag_sum = 0.0
+        self.lag_hist = [0] * (len(LAG_BUCKETS) + 1)
+        self.started_at: Optional[float] = None
+        self._beat = time.monotonic()
+        self._pending = None          # (beat, site, leaf, task, stack), снятый во время текущего зависания
+        self._loop = None
+        self._loop_thread = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    # --- запуск/остановка ---
+    def start(self):
+        """Вызывать из потока event loop."""
+        if self._task is not None and not self._task.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self.started_at = time.time()
+        self._stop.clear()
+        self._task = self._loop.create_task(self._heartbeat(), name="loop_monitor")
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+        log.info(f"Loop monitor started (threshold {self.threshold * 1000:.0f} ms).")
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    # --- heartbeat (в loop) ---
+    async def _heartbeat(self):
+        while not self._stop.is_set():
+            t0 = time.monotonic()
+            self._beat = t0
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - t0 - self.interval)
+            self.lag_last = lag
+            self.lag_max = max(self.lag_max, lag)
+            self.lag_sum += lag
+            self.lag_hist[next((i for i, b in enumerate(LAG_BUCKETS) if lag <= b), len(LAG_BUCKETS))] += 1
+            if lag >= self.threshold:
+                self._record(t0, lag)
+
+    def _record(self, beat: float, lag: float):
+        pending, self._pending = self._pending, None
+        if pending is not None and pending[0] == beat:
+            _, key, leaf, task, stack = pending
+        else:
+            key, leaf, task, stack = "(не пойман: короче интервала сторожа)", "", "", ""
+        st = self.sites.get(key) or self.sites.setdefault(key, StallSite(key))
+        st.count += 1
+        st.total += lag
+        st.max = max(st.max, lag)
+        st.last_at = time.time()
+        if leaf:
+            st.leaf, st.task, st.stack = leaf, task, stack
+        self.stalls += 1
+        self.stall_seconds += lag
+        log.warning(f"Event loop stalled {lag * 1000:.0f} ms at {key}" + (f" -> {leaf}" if leaf and leaf != key else ""))
+
+    # --- сторож (отдельный поток) ---
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            if time.monotonic() - beat < self.interval + self.threshold:
+                continue
+            if self._pending is not None and self._pending[0] == beat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._pending = (beat, *self._describe(frame))
+
+    def _describe(self, frame):
+        stack = traceback.extract_stack(frame)
+        del frame
+        own = os.path.abspath(__file__)
+        project = [fs for fs in stack if fs.filename.startswith(PROJECT_DIR) and fs.filename != own]
+        site = _label(project[-1]) if project else _label(stack[-1])
+        leaf = _label(stack[-1])
+        task = ""
+        try:
+            cur = asyncio.tasks._current_tasks.get(self._loop)
+            task = cur.get_name() if cur is not None else "(callback)"
+        except Exception:
+            pass
+        text = "".join(traceback.format_list(stack[-self.stack_depth:]))
+        return site, leaf, task, text
+
+    # --- отчёты ---
+    def top(self, n: Optional[int] = None):
+        return sorted(self.sites.values(), key=lambda s: s.total, reverse=True)[:n or self.top_n]
+
+    def format_report(self, n: int = 10) -> str:
+        up = time.time() - self.started_at if self.started_at else 0.0
+        lines = [f"stalls {self.stalls} ({self.stall_seconds:.1f}s) за {up / 3600:.1f} ч, "
+                 f"lag max {self.lag_max * 1000:.0f} ms, порог {self.threshold * 1000:.0f} ms"]
+        for s in self.top(n):
+            lines.append(f"{s.total:7.2f}s {s.count:4d}x max {s.max * 1000:6.0f}ms  {s.site}")
+            if s.leaf and s.leaf != s.site:
+                lines.append(f"{'':26}-> {s.leaf}")
+            if s.task:
+                lines.append(f"{'':26}task: {s.task}")
+        return "\n".join(lines)
+
+    def prometheus(self) -> str:
+        out = ["# TYPE bot_loop_lag_seconds histogram"]
+        acc = 0
+        for b, c in zip(LAG_BUCKETS, self.lag_hist):
+            acc += c
+            out.append(f'bot_loop_lag_seconds_bucket{{le="{b}"}} {acc}')
+        out.append(f'bot_loop_lag_seconds_bucket{{le="+Inf"}} {sum(self.lag_hist)}')
+        out.append(f"bot_loop_lag_seconds_sum {self.lag_sum:.6f}")
+        out.append(f"bot_loop_lag_seconds_count {sum(self.lag_hist)}")
+        out += ["# TYPE bot_loop_lag_last_seconds gauge", f"bot_loop_lag_last_seconds {self.lag_last:.6f}",
+                "# TYPE bot_loop_stalls_total counter", f"bot_loop_stalls_total {self.stalls}",
+                "# TYPE bot_loop_stall_seconds_total counter", f"bot_loop_stall_seconds_total {self.stall_seconds:.6f}",
+                "# TYPE bot_loop_stall_site_seconds_total counter"]
+        for s in self.top():
+            out.append(f'bot_loop_stall_site_seconds_total{{site="{metrics.escape(s.site)}"}} {s.total:.6f}')
+        out.append("# TYPE bot_loop_stall_site_max_seconds gauge")
+        for s in self.top():
+            out.append(f'bot_loop_stall_site_max_seconds{{site="{metrics.escape(s.site)}"}} {s.max:.6f}')
+        return "\n".join(out)
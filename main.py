@@ -1,12 +1,17 @@
+import startup
 import os
 import asyncio
 import logging
 from telegram import Update, constants, BotCommand
-from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, PicklePersistence
+from telegram.ext import Application, ApplicationBuilder, CommandHandler, ContextTypes, PicklePersistence, TypeHandler
 
-import scanner_bmr_dca as scanner_engine
-from scanner_bmr_dca import CONFIG
-import trade_executor
+# pandas/ccxt/gspread тянет scanner_bmr_dca — грузим его в фоне после старта polling (deferred_init)
+scanner_engine = startup.LazyModule("scanner_bmr_dca")
+equity_curve = startup.LazyModule("equity_curve")
+import ipc_bus
+import loop_monitor
+import metrics
+import profiler
 
 # --- Конфигурация ---
 BOT_VERSION = "BMR-DCA EURC v0.1"
@@ -27,18 +32,65 @@ def is_loop_running(app: Application) -> bool:
     task = getattr(app, "_main_loop_task", None)
     return task is not None and not task.done()
 
+def start_loop(app: Application) -> asyncio.Task:
+    """Основной цикл: в этом процессе или, при STRATEGY_PROCESS=1, в процессе стратегии (ipc_bus)."""
+    if ipc_bus.ENABLED:
+        coro = ipc_bus.run_remote(app, broadcast, "scanner_bmr_dca")
+    else:
+        coro = scanner_engine.scanner_main_loop(app, broadcast)
+    task = asyncio.create_task(coro)
+    setattr(app, "_main_loop_task", task)
+    return task
+
+def post_command(app: Application, cmd: str):
+    if ipc_bus.ENABLED:
+        ipc_bus.post_command(app, cmd)
+    else:
+        scanner_engine.post_command(app, cmd)
+
+async def sync_strategy(update: object, ctx: ContextTypes.DEFAULT_TYPE):
+    """После любой команды: изменённые ею ключи bot_data (банк, комиссии, пауза...) — процессу стратегии."""
+    if ipc_bus.ENABLED:
+        ipc_bus.sync(ctx.application)
+
 async def post_init(app: Application):
+    startup.STARTUP.mark("telegram_ready")
+    monitor = loop_monitor.LoopMonitor()
+    monitor.start()
+    setattr(app, "_loop_monitor", monitor)
+    metrics.register(monitor.prometheus)
+    metrics.register(lambda: equity_curve.prometheus(app.bot_data.get("position")) if equity_curve.loaded else "")
+    try:
+        await metrics.serve()
+    except OSError as e:
+        log.error(f"Metrics endpoint failed to start: {e}")
+
     try:
         await app.bot.delete_webhook(drop_pending_updates=True)
     except Exception as e:
         log.warning(f"delete_webhook failed: {e}")
 
+    # тяжёлая инициализация — в фоне, чтобы polling начался сразу
+    setattr(app, "_deferred_init_task", asyncio.create_task(deferred_init(app)))
+
+async def deferred_init(app: Application):
+    async def load_engine():
+        with startup.STARTUP.phase("import:scanner_bmr_dca"):
+            await startup.preload("scanner_bmr_dca")
+    try:
+        await asyncio.gather(load_engine(), set_commands(app))
+    except Exception as e:
+        log.error(f"Deferred init failed: {e}", exc_info=True)
+        return
+
     log.info("Бот запущен. Проверяем, нужно ли запускать основной цикл...")
-    if app.bot_data.get('run_loop_on_startup', False):
+    if app.bot_data.get('run_loop_on_startup', False) and not is_loop_running(app):
         log.info("Обнаружен флаг 'run_loop_on_startup'. Запускаю основной цикл.")
-        task = asyncio.create_task(scanner_engine.scanner_main_loop(app, broadcast))
-        setattr(app, "_main_loop_task", task)
+        start_loop(app)
+    else:
+        startup.STARTUP.finish()
 
+async def set_commands(app: Application):
     await app.bot.set_my_commands([
         BotCommand("start", "Запустить/перезапустить бота"),
         BotCommand("run", "Запустить сканер"),
@@ -52,6 +104,10 @@ async def post_init(app: Application):
         BotCommand("setbuf", "Установить буфер за границей (напр. 0.3 или 30%)"),
         BotCommand("setfees", "Установить комиссии, %: /setfees [maker] [taker]"),
         BotCommand("fees", "Показать текущие комиссии"),
+        BotCommand("stats", "Статистика сделок по локальному журналу"),
+        BotCommand("shadow", "Теневые варианты параметров: /shadow [N]"),
+        BotCommand("stalls", "Зависания event loop по местам в коде: /stalls [N]"),
+        BotCommand("profile", "Сэмплирующий профиль процесса: /profile [сек]"),
     ])
 
 async def broadcast(app: Application, txt: str):
@@ -88,8 +144,9 @@ async def cmd_run(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     app.bot_data['run_loop_on_startup'] = True
     app.bot_data['scan_paused'] = False
     log.info("Команда /run: запускаем основной цикл.")
-    task = asyncio.create_task(scanner_engine.scanner_main_loop(app, broadcast))
-    setattr(app, "_main_loop_task", task)
+    if not ipc_bus.ENABLED:
+        await scanner_engine.load()
+    start_loop(app)
     await update.message.reply_text("🚀 <b>Запускаю сканер...</b>", parse_mode=constants.ParseMode.HTML)
 
 async def cmd_stop(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
@@ -99,6 +156,7 @@ async def cmd_stop(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         return
 
     app.bot_data['bot_on'] = False
+    post_command(app, "stop")
     task = getattr(app, "_main_loop_task", None)
     if task:
         try:
@@ -135,17 +193,18 @@ async def cmd_close(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("ℹ️ Активной позиции нет.")
         return
     ctx.bot_data["force_close"] = True
-    await update.message.reply_text("🧰 Запрошено закрытие позиции. Закрою в ближайшем цикле.")
+    post_command(ctx.application, "close")
+    await update.message.reply_text("🧰 Закрываю позицию по последней цене…")
 
 async def cmd_open(update: Update, context: ContextTypes.DEFAULT_TYPE):
     app = context.application
+    await scanner_engine.load()
 
     if not is_loop_running(app):
         app.bot_data['bot_on'] = True
         app.bot_data['run_loop_on_startup'] = True
         app.bot_data['scan_paused'] = False
-        task = asyncio.create_task(scanner_engine.scanner_main_loop(app, broadcast))
-        setattr(app, "_main_loop_task", task)
+        start_loop(app)
         await update.message.reply_text("🔌 Сканер был выключен — запускаю его…")
 
     if app.bot_data.get("position"):
@@ -171,11 +230,12 @@ async def cmd_open(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception: steps = None
 
     if lev is not None:
-        lev = max(CONFIG.MIN_LEVERAGE, min(CONFIG.MAX_LEVERAGE, lev))
+        lev = max(scanner_engine.CONFIG.MIN_LEVERAGE, min(scanner_engine.CONFIG.MAX_LEVERAGE, lev))
     if steps is not None:
-        steps = max(1, min(CONFIG.DCA_LEVELS, steps))
+        steps = max(1, min(scanner_engine.CONFIG.DCA_LEVELS, steps))
 
     app.bot_data["manual_open"] = {"side": side, "leverage": lev, "max_steps": steps}
+    post_command(app, "open")
 
     await update.message.reply_text(
         f"Ок, открываю {side} по рынку текущей ценой. "
@@ -234,16 +294,98 @@ async def cmd_setfees(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⚠️ Неверные значения. Пример: /setfees 0.02 0.02 (это 0.02% на сторону)")
 
 async def cmd_fees(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
-    fm = float(ctx.bot_data.get("fee_maker", getattr(CONFIG, "FEE_MAKER", 0.0002)))
-    ft = float(ctx.bot_data.get("fee_taker", getattr(CONFIG, "FEE_TAKER", 0.0002)))
+    await scanner_engine.load()
+    cfg = scanner_engine.CONFIG
+    fm = float(ctx.bot_data.get("fee_maker", getattr(cfg, "FEE_MAKER", 0.0002)))
+    ft = float(ctx.bot_data.get("fee_taker", getattr(cfg, "FEE_TAKER", 0.0002)))
     await update.message.reply_text(f"Текущие комиссии: maker={fm*100:.4f}%  taker={ft*100:.4f}% (round-trip ≈ {(fm+ft)*100:.4f}%)")
 
+async def cmd_shadow(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    await scanner_engine.load()
+    book = scanner_engine.shadow_book(ctx.application)
+    if book is None:
+        await update.message.reply_text("Теневой режим выключен или цикл не запущен.")
+        return
+    try:
+        top = max(1, min(30, int(ctx.args[0]))) if ctx.args else 10
+    except ValueError:
+        top = 10
+    import shadow
+    hours = (scanner_engine.clock.now() - book.started_at) / 3600 if book.started_at else 0.0
+    await update.message.reply_text(
+        f"<b>Теневые варианты</b>: {len(book)} шт., тиков {book.ticks}, {hours:.1f} ч. "
+        f"Цена: <code>{scanner_engine.fmt(book.last_px)}</code>\n"
+        f"<pre>{shadow.format_report(book, top)}</pre>",
+        parse_mode=constants.ParseMode.HTML)
+
+async def cmd_stats(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    import journal
+    report = journal.format_stats(journal.current_stats()).replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+    await update.message.reply_text(f"<b>Статистика сделок</b>\n<pre>{report}</pre>", parse_mode=constants.ParseMode.HTML)
+
+def _pre(text: str) -> str:
+    return text.replace("&", "&amp;").replace("<", "&lt;").replace(">", "&gt;")
+
+async def cmd_stalls(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    monitor = getattr(ctx.application, "_loop_monitor", None)
+    if monitor is None:
+        await update.message.reply_text("Монитор event loop не запущен.")
+        return
+    try:
+        top = max(1, min(30, int(ctx.args[0]))) if ctx.args else 10
+    except ValueError:
+        top = 10
+    if not ipc_bus.ENABLED:
+        await update.message.reply_text(f"<b>Зависания event loop</b>\n<pre>{_pre(monitor.format_report(top))}</pre>",
+                                        parse_mode=constants.ParseMode.HTML)
+        return
+    # STRATEGY_PROCESS: у процесса стратегии свой event loop и свой монитор
+    remote = await ipc_bus.ask(ctx.application, "stalls", top) if is_loop_running(ctx.application) else None
+    remote_txt = _pre(remote) if remote is not None else "процесс стратегии не запущен или не ответил"
+    await update.message.reply_text(
+        f"<b>Зависания event loop — бот</b>\n<pre>{_pre(monitor.format_report(top))[:1800]}</pre>\n"
+        f"<b>— процесс стратегии</b>\n<pre>{remote_txt[:1800]}</pre>", parse_mode=constants.ParseMode.HTML)
+
+async def cmd_profile(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
+    app = ctx.application
+    if getattr(app, "_profiling", False):
+        await update.message.reply_text("Профилирование уже идёт, дождитесь результата.")
+        return
+    try:
+        seconds = max(1.0, min(float(profiler.MAX_SECONDS), float(ctx.args[0]))) if ctx.args else 30.0
+    except ValueError:
+        seconds = 30.0
+    # STRATEGY_PROCESS: торговый цикл живёт в другом процессе — профилируем его
+    remote = ipc_bus.ENABLED and is_loop_running(app)
+    where = "процесс стратегии" if remote else "процесс бота"
+    setattr(app, "_profiling", True)
+    await update.message.reply_text(f"⏱️ Профилирую {seconds:.0f} с ({where})…")
+    try:
+        if remote:
+            res = await ipc_bus.ask(app, "profile", seconds, timeout=seconds + 30)
+            summary, collapsed = (res["summary"], res["collapsed"]) if res else (None, None)
+        else:
+            prof = await profiler.profile_for(seconds)
+            summary, collapsed = prof.format_summary(), prof.collapsed()
+    finally:
+        setattr(app, "_profiling", False)
+    if summary is None:
+        await update.message.reply_text("Процесс стратегии не ответил — профиль не снят.")
+        return
+    await update.message.reply_text(f"<b>Профиль ({where})</b>\n<pre>{_pre(summary)[:3800]}</pre>",
+                                    parse_mode=constants.ParseMode.HTML)
+    await scanner_engine.load()
+    name = f"profile_{int(scanner_engine.clock.now())}.collapsed"
+    await update.message.reply_document(document=collapsed.encode(), filename=name,
+                                        caption="collapsed stacks (flamegraph.pl / speedscope)")
+
 async def cmd_status(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
     bot_data = ctx.bot_data
     is_running = is_loop_running(ctx.application)
     is_paused = bot_data.get("scan_paused", False)
     
     active_position = bot_data.get('position', None)
+    await scanner_engine.load()
     cfg = scanner_engine.CONFIG
 
     scanner_status = "🔌 ОСТАНОВЛЕН"
@@ -274,13 +416,19 @@ async def cmd_status(update: Update, ctx: ContextTypes.DEFAULT_TYPE):
             f"• <b>Резерв активирован:</b> {'Да' if reserved else 'Нет'}\n"
             f"• <b>Осталось (обычных | резерв):</b> {ordinary_left} | {reserved_left}"
         )
+        mtm_txt = equity_curve.format_status(getattr(pos, "mtm", None))
+        if mtm_txt:
+            position_status += f"\n\n<b>Переоценка:</b>\n{mtm_txt}"
+        ladder_txt = scanner_engine.format_ladder(pos)
+        if ladder_txt:
+            position_status += f"\n\n<b>Лесенка DCA:</b>\n<pre>{ladder_txt}</pre>"
     
     bank = bot_data.get("safety_bank_usdt", getattr(cfg, "SAFETY_BANK_USDT", DEFAULT_BANK_USDT))
     buf  = bot_data.get("buffer_over_edge", getattr(cfg, "BUFFER_OVER_EDGE", DEFAULT_BUFFER_OVER_EDGE))
     fm = bot_data.get("fee_maker", getattr(cfg, "FEE_MAKER", 0.0002))
     ft = bot_data.get("fee_taker", getattr(cfg, "FEE_TAKER", 0.0002))
     
-    dca_info = f"• DCA: max_steps={CONFIG.DCA_LEVELS} (резерв {'вкл' if active_position and getattr(active_position, 'reserved_one', False) else 'выкл'})\n"
+    dca_info = f"• DCA: max_steps={cfg.DCA_LEVELS} (резерв {'вкл' if active_position and getattr(active_position, 'reserved_one', False) else 'выкл'})\n"
 
     msg = (
         f"<b>Состояние бота {BOT_VERSION}</b>\n\n"
@@ -301,10 +449,11 @@ if __name__ == "__main__":
     persistence = PicklePersistence(filepath="bot_persistence")
     app = ApplicationBuilder().token(BOT_TOKEN).persistence(persistence).post_init(post_init).build()
 
+    # block=False: status/fees/shadow могут ждать импорта движка — не держим очередь остальных команд
     app.add_handler(CommandHandler("start", cmd_start))
     app.add_handler(CommandHandler("run", cmd_run))
     app.add_handler(CommandHandler("stop", cmd_stop))
-    app.add_handler(CommandHandler("status", cmd_status))
+    app.add_handler(CommandHandler("status", cmd_status, block=False))
     app.add_handler(CommandHandler("pause", cmd_pause))
     app.add_handler(CommandHandler("resume", cmd_resume))
     app.add_handler(CommandHandler("setbank", cmd_setbank))
@@ -312,7 +461,12 @@ if __name__ == "__main__":
     app.add_handler(CommandHandler("close", cmd_close))
     app.add_handler(CommandHandler("open", cmd_open))
     app.add_handler(CommandHandler("setfees", cmd_setfees))
-    app.add_handler(CommandHandler("fees", cmd_fees))
+    app.add_handler(CommandHandler("fees", cmd_fees, block=False))
+    app.add_handler(CommandHandler("stats", cmd_stats))
+    app.add_handler(CommandHandler("shadow", cmd_shadow, block=False))
+    app.add_handler(CommandHandler("stalls", cmd_stalls))
+    app.add_handler(CommandHandler("profile", cmd_profile, block=False))
+    app.add_handler(TypeHandler(Update, sync_strategy), group=1)
 
     log.info(f"Bot {BOT_VERSION} starting...")
     app.run_polling()
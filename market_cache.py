@@ -0,0 +1,178 @@
+# market_cache.py
+import asyncio
+import json
+import logging
+import os
+import time
+
+log = logging.getLogger("market_cache")
+
+MARKET_CACHE_FILE = os.getenv("MARKET_CACHE_FILE", "markets_cache.json")
+MARKET_CACHE_TTL_SEC = int(os.getenv("MARKET_CACHE_TTL_SEC", 6 * 3600))
+MARKET_CACHE_MAX_STALE_SEC = 7 * 86400   # старше этого кэш не используем даже как временный
+CACHE_VERSION = 1
+
+# Индексы по exchange.id: {"swap_usdt": set, "tick": {...}, "price_precision": {...}, ...}
+INDEX_BY_EXCHANGE: dict = {}
+_LOADED_AT: dict = {}
+_REFRESH_TASKS: dict = {}
+_LAST_ATTEMPT: dict = {}
+REFRESH_RETRY_SEC = 300
+
+
+def price_tick(market: dict, default: float = 1e-4) -> float:
+    """Шаг цены из описания рынка ccxt (поддерживает и TICK_SIZE, и DECIMAL_PLACES)."""
+    tick = None
+    p_prec = (market.get("precision") or {}).get("price")
+    if isinstance(p_prec, (int, float)):
+        if 0 < float(p_prec) < 1:
+            tick = float(p_prec)
+        elif int(p_prec) >= 0:
+            tick = 10 ** (-int(p_prec))
+    if not tick:
+        tick = ((market.get("limits") or {}).get("price") or {}).get("min")
+    if not tick or tick <= 0:
+        tick = default
+    return float(tick)
+
+
+def build_index(markets: dict) -> dict:
+    swap_usdt = []
+    ticks, p_prec, a_prec = {}, {}, {}
+    for sym, m in markets.items():
+        prec = m.get("precision") or {}
+        ticks[sym] = price_tick(m)
+        p_prec[sym] = prec.get("price")
+        a_prec[sym] = prec.get("amount")
+        if m.get("type") == "swap" and m.get("settle") == "USDT" and sym.endswith("USDT:USDT") \
+                and m.get("active", True) is not False:
+            swap_usdt.append(sym)
+    return {
+        "swap_usdt": set(swap_usdt),
+        "tick": ticks,
+        "price_precision": p_prec,
+        "amount_precision": a_prec,
+    }
+
+
+def get_index(exchange) -> dict:
+    idx = INDEX_BY_EXCHANGE.get(exchange.id)
+    if idx is None and getattr(exchange, "markets", None):
+        idx = INDEX_BY_EXCHANGE[exchange.id] = build_index(exchange.markets)
+    return idx or {"swap_usdt": set(), "tick": {}, "price_precision": {}, "amount_precision": {}}
+
+
+def _cache_path(exchange, path: str | None) -> str:
+    if path:
+        return path
+    root, ext = os.path.splitext(MARKET_CACHE_FILE)
+    return f"{root}_{exchange.id}{ext or '.json'}"
+
+
+def _read_cache(path: str) -> dict | None:
+    try:
+        with open(path, "r") as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        log.warning(f"Market cache {path} unreadable: {e}")
+        return None
+    if data.get("version") != CACHE_VERSION or not data.get("markets"):
+        return None
+    return data
+
+
+def _write_cache(path: str, markets: dict, currencies: dict | None):
+    idx = build_index(markets)
+    data = {
+        "version": CACHE_VERSION,
+        "saved_at": time.time(),
+        "markets": markets,
+        "currencies": currencies or {},
+        "index": {
+            "swap_usdt": sorted(idx["swap_usdt"]),
+            "tick": idx["tick"],
+            "price_precision": idx["price_precision"],
+            "amount_precision": idx["amount_precision"],
+        },
+    }
+    tmp = f"{path}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, separators=(",", ":"), default=str)
+    os.replace(tmp, path)
+
+
+def _index_from_cache(data: dict) -> dict:
+    raw = data.get("index") or {}
+    if not raw.get("tick"):
+        return build_index(data["markets"])
+    return {
+        "swap_usdt": set(raw.get("swap_usdt", [])),
+        "tick": raw.get("tick", {}),
+        "price_precision": raw.get("price_precision", {}),
+        "amount_precision": raw.get("amount_precision", {}),
+    }
+
+
+async def _fetch_and_store(exchange, path: str) -> dict:
+    t0 = time.time()
+    await exchange.load_markets(True)
+    INDEX_BY_EXCHANGE[exchange.id] = build_index(exchange.markets)
+    _LOADED_AT[exchange.id] = time.time()
+    log.info(f"Markets for {exchange.id} loaded from exchange in {time.time() - t0:.1f}s "
+             f"({len(exchange.markets)} markets).")
+    try:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, _write_cache, path, dict(exchange.markets),
+                                   dict(getattr(exchange, "currencies", None) or {}))
+    except Exception as e:
+        log.warning(f"Could not write market cache {path}: {e}")
+    return INDEX_BY_EXCHANGE[exchange.id]
+
+
+def _schedule_refresh(exchange, path: str):
+    task = _REFRESH_TASKS.get(exchange.id)
+    if task is not None and not task.done():
+        return
+    _LAST_ATTEMPT[exchange.id] = time.time()
+
+    async def _refresh():
+        try:
+            await _fetch_and_store(exchange, path)
+        except Exception as e:
+            log.warning(f"Background market refresh for {exchange.id} failed: {e}")
+
+    _REFRESH_TASKS[exchange.id] = asyncio.create_task(_refresh())
+
+
+async def load_markets_cached(exchange, path: str | None = None, ttl: int | None = None) -> dict:
+    """Заполняет exchange.markets из дискового кэша; при устаревании обновляет в фоне.
+
+    Сеть ждём только если кэша нет или он старше MARKET_CACHE_MAX_STALE_SEC.
+    Возвращает индекс USDT-свопов, шагов цены и точностей.
+    """
+    path = _cache_path(exchange, path)
+    ttl = MARKET_CACHE_TTL_SEC if ttl is None else ttl
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(None, _read_cache, path)
+    age = (time.time() - data.get("saved_at", 0)) if data else None
+
+    if data is None or age > MARKET_CACHE_MAX_STALE_SEC:
+        return await _fetch_and_store(exchange, path)
+
+    exchange.set_markets(data["markets"], data.get("currencies") or None)
+    INDEX_BY_EXCHANGE[exchange.id] = _index_from_cache(data)
+    _LOADED_AT[exchange.id] = data.get("saved_at", 0)
+    log.info(f"Markets for {exchange.id} restored from cache ({len(data['markets'])} markets, age {age/60:.0f} min).")
+    if age > ttl:
+        _schedule_refresh(exchange, path)
+    return INDEX_BY_EXCHANGE[exchange.id]
+
+
+def refresh_if_stale(exchange, path: str | None = None, ttl: int | None = None):
+    """Неблокирующая проверка TTL: запускает фоновое обновление, если кэш устарел."""
+    ttl = MARKET_CACHE_TTL_SEC if ttl is None else ttl
+    now = time.time()
+    if now - _LOADED_AT.get(exchange.id, 0) > ttl and now - _LAST_ATTEMPT.get(exchange.id, 0) > REFRESH_RETRY_SEC:
+        _schedule_refresh(exchange, _cache_path(exchange, path))
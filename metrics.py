@@ -0,0 +1,66 @@
+# metrics.py
+# Минимальный экспорт метрик в формате Prometheus: модули регистрируют функции, возвращающие текст,
+# HTTP-эндпоинт (/metrics) поднимается на asyncio без внешних зависимостей, если задан METRICS_PORT.
+import asyncio
+import logging
+import os
+from typing import Callable, List, Optional
+
+log = logging.getLogger("metrics")
+
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0") or 0)
+
+_COLLECTORS: List[Callable[[], str]] = []
+_SERVER: Optional[asyncio.AbstractServer] = None
+
+
+def escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def register(collector: Callable[[], str]):
+    if collector not in _COLLECTORS:
+        _COLLECTORS.append(collector)
+
+
+def unregister(collector: Callable[[], str]):
+    if collector in _COLLECTORS:
+        _COLLECTORS.remove(collector)
+
+
+def render() -> str:
+    parts = []
+    for c in list(_COLLECTORS):
+        try:
+            parts.append(c())
+        except Exception as e:
+            log.error(f"Metrics collector {getattr(c, '__qualname__', c)} failed: {e}")
+    return "\n".join(p for p in parts if p) + "\n"
+
+
+async def _handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request = await asyncio.wait_for(reader.readline(), 5)
+        while (await asyncio.wait_for(reader.readline(), 5)) not in (b"\r\n", b"\n", b""):
+            pass
+        path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+        if path.split("?")[0] in ("/", "/metrics"):
+            body, status = render().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        log.debug(f"metrics request failed: {e}")
+    finally:
+        writer.close()
+
+
+async def serve(port: int = METRICS_PORT, host: str = "0.0.0.0") -> Optional[asyncio.AbstractServer]:
+    global _SERVER
+    if not port or _SERVER is not None:
+        return _SERVER
+    _SERVER = await asyncio.start_server(_handle, host, port)
+    log.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return _SERVER
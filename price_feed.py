@@ -0,0 +1,144 @@
+# price_feed.py
+import asyncio
+import logging
+from typing import Dict, Iterable, Optional
+
+import clock
+from candle_buffer import tf_ms
+from incremental import EmaState, AtrState
+
+log = logging.getLogger("price_feed")
+
+
+class SymbolState:
+    """Инкрементальные EMA/ATR по закрытым барам и текущий формирующийся бар."""
+
+    def __init__(self, fast: int, slow: int, atr_len: int):
+        self.ema_fast = EmaState(fast)
+        self.ema_slow = EmaState(slow)
+        self.atr = AtrState(atr_len)
+        self.last_closed_ts: Optional[int] = None
+        self.closed_bars: list = []       # только новые закрытые бары с последнего опроса
+        self.forming: Optional[list] = None
+        self.last_price: Optional[float] = None
+
+    def push_closed(self, bar):
+        ts, o, h, l, c, v = bar
+        if self.last_closed_ts is not None and ts <= self.last_closed_ts:
+            return
+        self.ema_fast.update(c); self.ema_slow.update(c)
+        self.atr.update(h, l, c)
+        self.last_closed_ts = int(ts)
+        self.closed_bars.append(bar)
+
+    def take_closed(self) -> list:
+        bars, self.closed_bars = self.closed_bars, []
+        return bars
+
+
+class PriceFeed:
+    """Общий источник цен для сопровождения сделок.
+
+    REST: один fetch_tickers на все пары за тик и короткий fetch_ohlcv на пару
+    только после закрытия бара. WS (ccxt.pro): watch_ohlcv по каждой паре, без REST.
+    """
+
+    def __init__(self, exchange, timeframe: str, fast: int, slow: int, atr_len: int,
+                 seed_limit: int = 250, use_ws: bool = False):
+        self.exchange = exchange
+        self.timeframe = timeframe
+        self.tf_ms = tf_ms(timeframe)
+        self.params = (fast, slow, atr_len)
+        self.seed_limit = seed_limit
+        self.use_ws = use_ws
+        self.states: Dict[str, SymbolState] = {}
+        self._ws_exchange = None
+        self._ws_tasks: Dict[str, asyncio.Task] = {}
+
+    def _apply_bars(self, st: SymbolState, bars, now_ms: float):
+        for bar in bars:
+            if now_ms - bar[0] >= self.tf_ms:
+                st.push_closed(list(bar))
+            else:
+                st.forming = list(bar)
+                st.last_price = float(bar[4])
+
+    async def subscribe(self, symbol: str, history=None):
+        """Добавляет пару; history — уже имеющиеся бары (например, из кэша сканера)."""
+        if symbol in self.states:
+            return self.states[symbol]
+        st = SymbolState(*self.params)
+        if history is None or len(history) == 0:
+            history = await self.exchange.fetch_ohlcv(symbol, self.timeframe, limit=self.seed_limit)
+        self._apply_bars(st, history, clock.now() * 1000)
+        st.closed_bars = []
+        if st.forming is not None:
+            # экстремумы до подписки (до входа в сделку) в MFE не считаем
+            st.forming[2] = st.forming[3] = st.forming[4]
+        self.states[symbol] = st
+        if self.use_ws:
+            self._ws_tasks[symbol] = asyncio.create_task(self._ws_loop(symbol))
+        return st
+
+    def unsubscribe(self, symbol: str):
+        self.states.pop(symbol, None)
+        task = self._ws_tasks.pop(symbol, None)
+        if task:
+            task.cancel()
+
+    async def sync(self, symbols: Iterable[str]) -> Dict[str, SymbolState]:
+        """Обновляет цены/бары по всем парам. В REST-режиме — минимум запросов."""
+        symbols = [s for s in symbols if s in self.states]
+        if not symbols or self.use_ws:
+            return {s: self.states[s] for s in symbols}
+        now_ms = clock.now() * 1000
+        rolled = [s for s in symbols
+                  if self.states[s].last_closed_ts is None
+                  or now_ms - self.states[s].last_closed_ts >= 2 * self.tf_ms]
+
+        async def _delta(symbol):
+            try:
+                return symbol, await self.exchange.fetch_ohlcv(symbol, self.timeframe, limit=3)
+            except Exception as e:
+                log.warning(f"Delta OHLCV failed for {symbol}: {e}")
+                return symbol, None
+
+        for symbol, bars in await asyncio.gather(*[_delta(s) for s in rolled]):
+            if bars:
+                self._apply_bars(self.states[symbol], bars, clock.now() * 1000)
+        try:
+            tickers = await self.exchange.fetch_tickers(symbols)
+        except Exception as e:
+            log.warning(f"fetch_tickers failed: {e}")
+            tickers = {}
+        for s in symbols:
+            last = (tickers.get(s) or {}).get("last")
+            if last:
+                st = self.states[s]
+                st.last_price = float(last)
+                if st.forming is not None:
+                    st.forming[2] = max(st.forming[2], st.last_price)
+                    st.forming[3] = min(st.forming[3], st.last_price)
+        return {s: self.states[s] for s in symbols}
+
+    async def _ws_loop(self, symbol: str):
+        if self._ws_exchange is None:
+            import ccxt.pro as ccxtpro
+            self._ws_exchange = ccxtpro.mexc({'options': {'defaultType': 'swap'}})
+        while symbol in self.states:
+            try:
+                bars = await self._ws_exchange.watch_ohlcv(symbol, self.timeframe)
+                st = self.states.get(symbol)
+                if st is not None:
+                    self._apply_bars(st, bars, clock.now() * 1000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"watch_ohlcv {symbol} failed: {e}")
+                await clock.sleep(5)
+
+    async def close(self):
+        for s in list(self._ws_tasks):
+            self.unsubscribe(s)
+        if self._ws_exchange is not None:
+            await self._ws_exchange.close()
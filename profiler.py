@@ -0,0 +1,151 @@
+# profiler.py
+# Сэмплирующий профайлер по запросу (/profile): поток-таймер снимает стеки всех потоков процесса,
+# для потока event loop добавляет имя текущей asyncio-задачи. Результат — топ функций и collapsed stacks
+# (формат flamegraph.pl / speedscope).
+import asyncio
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_INTERVAL = 0.01
+MAX_SECONDS = 120
+IDLE_FILES = ("selectors.py", "threading.py", "queue.py")   # ожидание: select/poll, пустая очередь
+IDLE_FRAMES = {("thread.py", "_worker")}                    # поток пула ждёт задачу в C-очереди
+SKIP_THREADS = ("profiler", "loop-watchdog")
+
+
+def _label(code) -> str:
+    fn = code.co_filename
+    if fn.startswith(PROJECT_DIR):
+        mod = os.path.relpath(fn, PROJECT_DIR)
+    else:
+        mod = "/".join(fn.replace("\\", "/").split("/")[-2:])
+    if mod.endswith(".py"):
+        mod = mod[:-3]
+    return f"{mod}:{code.co_name}".replace(";", ",").replace(" ", "_")
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = DEFAULT_INTERVAL, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.interval = interval
+        self.loop = loop
+        self.loop_thread = threading.get_ident() if loop is not None else None
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.loop_samples = 0
+        self.loop_idle = 0
+        self.started_at = 0.0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._names: Dict[int, str] = {}
+
+    def start(self):
+        self.started_at = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.elapsed = time.perf_counter() - self.started_at
+
+    def _run(self):
+        me = threading.get_ident()
+        next_names = 0.0
+        while not self._stop.wait(self.interval):
+            now = time.perf_counter()
+            if now >= next_names:
+                self._names = {t.ident: t.name for t in threading.enumerate()}
+                next_names = now + 1.0
+            for tid, frame in sys._current_frames().items():
+                if tid != me:
+                    self._sample(tid, frame)
+            self.samples += 1
+
+    def _sample(self, tid: int, frame):
+        name = self._names.get(tid, str(tid))
+        if name in SKIP_THREADS:
+            return
+        is_loop = tid == self.loop_thread
+        code = frame.f_code
+        idle = code.co_filename.endswith(IDLE_FILES) or \
+            (os.path.basename(code.co_filename), code.co_name) in IDLE_FRAMES
+        if idle:
+            if is_loop:
+                self.loop_samples += 1
+                self.loop_idle += 1
+                self.stacks[f"{name};<idle>"] += 1
+            return
+        labels = []
+        f = frame
+        while f is not None:
+            labels.append(_label(f.f_code))
+            f = f.f_back
+        del frame, f
+        prefix = [name]
+        if is_loop:
+            self.loop_samples += 1
+            try:
+                task = asyncio.tasks._current_tasks.get(self.loop)
+                prefix.append(f"task:{task.get_name()}" if task is not None else "<callback>")
+            except Exception:
+                pass
+        self.stacks[";".join(prefix + labels[::-1])] += 1
+
+    # --- отчёты ---
+    def collapsed(self) -> str:
+        return "".join(f"{stack} {n}\n" for stack, n in self.stacks.most_common())
+
+    def top_functions(self, n: int = 20):
+        """[(функция, self, total)] по всем потокам, по убыванию self; total — сэмплы, где функция есть в стеке."""
+        own, total = Counter(), Counter()
+        for stack, cnt in self.stacks.items():
+            frames = [p for p in stack.split(";")[1:] if not p.startswith(("task:", "<"))]
+            if not frames:
+                continue
+            own[frames[-1]] += cnt
+            for fr in set(frames):
+                total[fr] += cnt
+        ranked = sorted(total, key=lambda fn: (own[fn], total[fn]), reverse=True)
+        return [(fn, own[fn], total[fn]) for fn in ranked[:n]]
+
+    def top_tasks(self, n: int = 10):
+        tasks = Counter()
+        for stack, cnt in self.stacks.items():
+            parts = stack.split(";")
+            if len(parts) > 1 and parts[1].startswith(("task:", "<")):
+                tasks[parts[1]] += cnt
+        return tasks.most_common(n)
+
+    def format_summary(self, n: int = 15) -> str:
+        busy = self.loop_samples - self.loop_idle
+        lines = [f"{self.elapsed:.1f}s, {self.samples} сэмплов по {self.interval * 1000:.0f} ms; "
+                 f"loop занят {busy / max(self.loop_samples, 1):.0%}"]
+        if self.loop_samples:
+            lines.append("")
+            lines.append("loop по задачам:")
+            for task, cnt in self.top_tasks():
+                lines.append(f"{cnt / self.loop_samples:6.1%}  {task}")
+        lines.append("")
+        lines.append(f"{'self':>6} {'total':>6}  функция")
+        denom = max(self.samples, 1)
+        for fn, own, total in self.top_functions(n):
+            lines.append(f"{own / denom:6.1%} {total / denom:6.1%}  {fn}")
+        return "\n".join(lines)
+
+
+async def profile_for(seconds: float, interval: float = DEFAULT_INTERVAL) -> SamplingProfiler:
+    """Профилирует процесс seconds секунд, не блокируя loop."""
+    prof = SamplingProfiler(interval, asyncio.get_running_loop())
+    prof.start()
+    try:
+        await asyncio.sleep(min(max(seconds, 0.1), MAX_SECONDS))
+    finally:
+        await asyncio.to_thread(prof.stop)
+    return prof
@@ -0,0 +1,436 @@
+# replay.py
+# Детерминированный прогон торговых циклов на записанных ответах биржи.
+#
+# Запись:  RECORD_EXCHANGE=rec/session.jsonl.gz python main.py
+# Прогон:  python replay.py rec/session.jsonl.gz --engine bmr [--hours 6] [--out result.json]
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import tempfile
+import time
+from bisect import bisect_right
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import clock
+from candle_buffer import CandleBuffer, tf_ms
+
+log = logging.getLogger("replay")
+
+RECORDED_METHODS = ("fetch_ohlcv", "fetch_tickers", "fetch_ticker", "fetch_funding_rate",
+                    "watch_ohlcv", "watch_tickers")
+
+
+# ---------------------------------------------------------------------------
+# Recording
+# ---------------------------------------------------------------------------
+class RecordingExchange:
+    """Обёртка над ccxt-биржей: пишет каждый ответ (и ошибку) в gzip JSONL с меткой времени."""
+
+    def __init__(self, exchange, path: str):
+        self._exchange = exchange
+        self._path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fh = gzip.open(path, "at", encoding="utf-8")
+        self._markets_written = False
+        self._since_flush = 0
+
+    def __getattr__(self, name):
+        attr = getattr(self._exchange, name)
+        if name in RECORDED_METHODS:
+            async def _recorded(*args, **kwargs):
+                self._write_markets()
+                try:
+                    result = await attr(*args, **kwargs)
+                except Exception as e:
+                    self._write({"t": clock.now(), "m": name, "a": list(args), "k": kwargs,
+                                 "e": f"{type(e).__name__}: {e}"})
+                    raise
+                self._write({"t": clock.now(), "m": name, "a": list(args), "k": kwargs, "r": result})
+                return result
+            return _recorded
+        return attr
+
+    async def load_markets(self, reload: bool = False, params=None):
+        markets = await self._exchange.load_markets(reload)
+        self._markets_written = False
+        self._write_markets()
+        return markets
+
+    def _write_markets(self):
+        if self._markets_written or not getattr(self._exchange, "markets", None):
+            return
+        self._write({"t": clock.now(), "m": "markets", "r": self._exchange.markets})
+        self._markets_written = True
+
+    def _write(self, rec: dict):
+        self._fh.write(json.dumps(rec, separators=(",", ":"), default=str) + "\n")
+        self._since_flush += 1
+        if self._since_flush >= 50:
+            self._fh.flush()
+            self._since_flush = 0
+
+    async def close(self):
+        try:
+            self._fh.close()
+        finally:
+            await self._exchange.close()
+
+
+def read_recording(path: str) -> List[dict]:
+    records = []
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                log.warning("Skipping truncated record at the end of %s", path)
+                break
+    records.sort(key=lambda r: r["t"])
+    return records
+
+
+# ---------------------------------------------------------------------------
+# Fake exchange
+# ---------------------------------------------------------------------------
+class _ChunkSeries:
+    """Записанные ответы fetch_ohlcv по (symbol, tf): видны только те, что получены к текущему времени."""
+
+    def __init__(self, timeframe: str):
+        self.times: List[float] = []
+        self.chunks: List[np.ndarray] = []
+        self.buf = CandleBuffer(timeframe, 10 ** 6)
+        self._pos = 0
+
+    def add(self, t: float, rows):
+        if rows:
+            self.times.append(t)
+            self.chunks.append(np.asarray(rows, dtype=np.float64).reshape(-1, 6))
+
+    def view(self, now: float) -> np.ndarray:
+        end = bisect_right(self.times, now)
+        while self._pos < end:
+            self.buf.merge(self.chunks[self._pos])
+            self._pos += 1
+        return self.buf.data
+
+
+class _BarSeries:
+    """Готовый ряд баров: бар становится виден после своего закрытия."""
+
+    def __init__(self, timeframe: str, bars):
+        self.bars = np.asarray(bars, dtype=np.float64).reshape(-1, 6)
+        self.reveal = (self.bars[:, 0] + tf_ms(timeframe)) / 1000.0
+
+    def view(self, now: float) -> np.ndarray:
+        return self.bars[:int(np.searchsorted(self.reveal, now, side="right"))]
+
+
+class FakeExchange:
+    """Минимальный ccxt-совместимый объект поверх записи или синтетических баров.
+
+    Время берётся из clock.now(); записанные ошибки не воспроизводятся.
+    """
+
+    id = "replay"
+
+    def __init__(self, markets: dict | None = None):
+        self.markets: dict = {}
+        self.currencies: dict = {}
+        self._markets_src = markets or {}
+        self._series: Dict[Tuple[str, str], object] = {}
+        self._tickers: List[Tuple[float, dict]] = []
+        self._ticker_pos = 0
+        self._ticker_state: dict = {}
+        self._funding: Dict[str, List[Tuple[float, dict]]] = {}
+        self.calls: Dict[str, int] = {}
+
+    # --- constructors ---
+    @classmethod
+    def from_records(cls, records: List[dict]) -> "FakeExchange":
+        ex = cls()
+        for rec in records:
+            m, t = rec["m"], rec["t"]
+            if "e" in rec:
+                continue
+            if m == "markets":
+                if not ex._markets_src:
+                    ex._markets_src = rec["r"]
+            elif m in ("fetch_ohlcv", "watch_ohlcv"):
+                args = rec.get("a") or []
+                kw = rec.get("k") or {}
+                symbol = args[0] if args else kw.get("symbol")
+                tf = args[1] if len(args) > 1 else kw.get("timeframe", "1m")
+                series = ex._series.get((symbol, tf))
+                if series is None:
+                    series = ex._series[(symbol, tf)] = _ChunkSeries(tf)
+                series.add(t, rec["r"])
+            elif m in ("fetch_tickers", "watch_tickers"):
+                ex._tickers.append((t, rec["r"] or {}))
+            elif m == "fetch_ticker":
+                r = rec["r"] or {}
+                if r.get("symbol"):
+                    ex._tickers.append((t, {r["symbol"]: r}))
+            elif m == "fetch_funding_rate":
+                args = rec.get("a") or []
+                if args:
+                    ex._funding.setdefault(args[0], []).append((t, rec["r"] or {}))
+        return ex
+
+    @classmethod
+    def from_bars(cls, markets: dict, bars: Dict[Tuple[str, str], np.ndarray]) -> "FakeExchange":
+        ex = cls(markets)
+        for (symbol, tf), arr in bars.items():
+            ex._series[(symbol, tf)] = _BarSeries(tf, arr)
+        return ex
+
+    def _count(self, name: str):
+        self.calls[name] = self.calls.get(name, 0) + 1
+
+    # --- markets ---
+    async def load_markets(self, reload: bool = False, params=None):
+        self._count("load_markets")
+        if reload or not self.markets:
+            self.set_markets(self._markets_src)
+        return self.markets
+
+    def set_markets(self, markets, currencies=None):
+        self.markets = dict(markets or {})
+        self.currencies = dict(currencies or {})
+        return self.markets
+
+    def market(self, symbol: str) -> dict:
+        return self.markets[symbol]
+
+    def price_to_precision(self, symbol: str, price: float) -> str:
+        import market_cache
+        tick = market_cache.price_tick(self.markets.get(symbol) or {})
+        decimals = max(0, -int(np.floor(np.log10(tick)))) if tick < 1 else 0
+        return f"{round(float(price) / tick) * tick:.{decimals}f}"
+
+    # --- market data ---
+    async def fetch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None, params=None):
+        self._count("fetch_ohlcv")
+        series = self._series.get((symbol, timeframe))
+        if series is None:
+            return []
+        data = series.view(clock.now())
+        data = data[data[:, 0] <= clock.now() * 1000]
+        if since is not None:
+            data = data[data[:, 0] >= since]
+            if limit:
+                data = data[:limit]
+        elif limit:
+            data = data[-limit:]
+        return data.tolist()
+
+    async def watch_ohlcv(self, symbol: str, timeframe: str = "1m", since=None, limit=None, params=None):
+        await clock.sleep(tf_ms(timeframe) / 1000.0 / 10)
+        return await self.fetch_ohlcv(symbol, timeframe, since, limit)
+
+    def _derived_tickers(self) -> dict:
+        out = {}
+        for (symbol, tf), series in self._series.items():
+            data = series.view(clock.now())
+            if not len(data) or symbol in out:
+                continue
+            day = data[data[:, 0] >= data[-1, 0] - 86_400_000]
+            out[symbol] = {"symbol": symbol, "last": float(data[-1, 4]), "close": float(data[-1, 4]),
+                           "quoteVolume": float(np.sum(day[:, 4] * day[:, 5]))}
+        return out
+
+    async def fetch_tickers(self, symbols=None, params=None):
+        self._count("fetch_tickers")
+        if self._tickers:
+            now = clock.now()
+            while self._ticker_pos < len(self._tickers) and self._tickers[self._ticker_pos][0] <= now:
+                self._ticker_state.update(self._tickers[self._ticker_pos][1])
+                self._ticker_pos += 1
+            merged = self._ticker_state
+        else:
+            merged = self._derived_tickers()
+        if symbols:
+            return {s: merged[s] for s in symbols if s in merged}
+        return merged
+
+    async def watch_tickers(self, symbols=None, params=None):
+        await clock.sleep(1.0)
+        return await self.fetch_tickers(symbols)
+
+    async def fetch_ticker(self, symbol: str, params=None):
+        return (await self.fetch_tickers([symbol])).get(symbol) or {"symbol": symbol}
+
+    async def fetch_funding_rate(self, symbol: str, params=None):
+        self._count("fetch_funding_rate")
+        hist = self._funding.get(symbol) or []
+        end = bisect_right([t for t, _ in hist], clock.now())
+        return hist[end - 1][1] if end else {"symbol": symbol, "fundingRate": 0.0}
+
+    async def close(self):
+        return None
+
+
+# ---------------------------------------------------------------------------
+# Sheets stand-in
+# ---------------------------------------------------------------------------
+class MemoryWorksheet:
+    """Лист в памяти с подмножеством API gspread.Worksheet, которое использует trade_executor."""
+
+    def __init__(self, title: str, rows: List[list] | None = None):
+        self.title = title
+        self.rows: List[list] = [list(r) for r in (rows or [])]
+
+    def get_all_values(self):
+        return [list(r) for r in self.rows]
+
+    def row_values(self, row: int):
+        return list(self.rows[row - 1]) if row <= len(self.rows) else []
+
+    def append_row(self, values, value_input_option=None):
+        self.rows.append(list(values))
+
+    def append_rows(self, values, value_input_option=None):
+        self.rows.extend(list(v) for v in values)
+
+    def update(self, range_name, values=None, **kwargs):
+        import gspread.utils
+        row, col = gspread.utils.a1_to_rowcol(range_name.split(":")[0])
+        for i, vals in enumerate(values or []):
+            r = row - 1 + i
+            while len(self.rows) <= r:
+                self.rows.append([])
+            line = self.rows[r]
+            if len(line) < col - 1 + len(vals):
+                line.extend([""] * (col - 1 + len(vals) - len(line)))
+            line[col - 1:col - 1 + len(vals)] = list(vals)
+
+    def update_title(self, title: str):
+        self.title = title
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+class ReplayApp:
+    """Заменитель telegram Application: циклам нужен только bot_data."""
+
+    def __init__(self, bot_data: dict | None = None):
+        self.bot_data = dict(bot_data or {})
+
+
+def _engine_module(engine: str):
+    if engine == "bmr":
+        import scanner_bmr_dca as module
+    elif engine == "swing":
+        import scanner_engine as module
+    else:
+        raise ValueError(f"Unknown engine: {engine}")
+    return module
+
+
+def _reset_state(module, workdir: str, worksheet: MemoryWorksheet):
+    import market_cache
+    import snapshot_utils
+    import trade_executor
+    import journal
+    market_cache.MARKET_CACHE_FILE = os.path.join(workdir, "markets_cache.json")
+    market_cache.INDEX_BY_EXCHANGE.pop(FakeExchange.id, None)
+    market_cache._LOADED_AT.pop(FakeExchange.id, None)
+    snapshot_utils.SNAPSHOT_FILE = os.path.join(workdir, "bmr_snapshot.pkl")
+    trade_executor.TRADE_LOG_WS = worksheet
+    trade_executor.clear_headers_cache()
+    del trade_executor.PENDING_TRADES[:]
+    journal.use(os.path.join(workdir, "journal"))
+    for name in ("OHLCV_CACHE", "LAST_EVAL_BAR"):
+        if hasattr(module, name):
+            getattr(module, name).clear()
+    if getattr(module, "ML_SCORER", None) is not None:
+        module.ML_SCORER.symbols.clear()
+    if hasattr(module, "CORR"):
+        module.CORR.reset()
+
+
+async def run_engine(exchange, engine: str = "bmr", start: float | None = None,
+                     until: float | None = None, bot_data: dict | None = None) -> dict:
+    """Гоняет scanner_main_loop выбранного движка на exchange в виртуальном времени."""
+    module = _engine_module(engine)
+    app = ReplayApp({"bot_on": True, **(bot_data or {})})
+    messages: List[Tuple[float, str]] = []
+
+    async def broadcast(_app, text):
+        messages.append((clock.now(), text))
+
+    def _stop():
+        app.bot_data["bot_on"] = False
+
+    vclock = clock.VirtualClock(start if start is not None else time.time(), until=until, on_deadline=_stop)
+    worksheet = MemoryWorksheet("BMR_DCA_Log" if engine == "bmr" else "Trading_Log_v2")
+    prev_clock, prev_factory = clock.CLOCK, module.EXCHANGE_FACTORY
+    t0 = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix="replay_") as workdir:
+        _reset_state(module, workdir, worksheet)
+        clock.set_clock(vclock)
+        module.EXCHANGE_FACTORY = lambda: exchange
+        try:
+            await module.scanner_main_loop(app, broadcast)
+        finally:
+            clock.set_clock(prev_clock)
+            module.EXCHANGE_FACTORY = prev_factory
+            import trade_executor
+            trade_executor.TRADE_LOG_WS = None
+            trade_executor.clear_headers_cache()
+            import journal
+            journal_stats = journal.journal().stats
+            journal.use(None)
+    return {
+        "engine": engine,
+        "virtual_start": start,
+        "virtual_end": vclock.time(),
+        "wall_sec": round(time.perf_counter() - t0, 3),
+        "calls": dict(getattr(exchange, "calls", {})),
+        "messages": messages,
+        "log_rows": worksheet.rows,
+        "journal": journal_stats,
+        "bot_data": {k: v for k, v in app.bot_data.items() if isinstance(v, (int, float, str, bool, type(None)))},
+    }
+
+
+async def replay_file(path: str, engine: str = "bmr", hours: float | None = None,
+                      bot_data: dict | None = None) -> dict:
+    records = read_recording(path)
+    if not records:
+        raise ValueError(f"Recording {path} is empty")
+    start, end = records[0]["t"], records[-1]["t"]
+    if hours is not None:
+        end = min(end, start + hours * 3600)
+    exchange = FakeExchange.from_records(records)
+    return await run_engine(exchange, engine, start=start, until=end, bot_data=bot_data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded exchange session through a scanner loop.")
+    parser.add_argument("recording")
+    parser.add_argument("--engine", choices=("bmr", "swing"), default="bmr")
+    parser.add_argument("--hours", type=float, default=None, help="stop after N virtual hours")
+    parser.add_argument("--out", default=None, help="write full result as JSON")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    result = asyncio.run(replay_file(args.recording, args.engine, args.hours))
+    span_h = (result["virtual_end"] - result["virtual_start"]) / 3600
+    print(f"{args.engine}: {span_h:.2f} virtual h in {result['wall_sec']:.1f}s, "
+          f"{len(result['messages'])} messages, {max(0, len(result['log_rows']) - 1)} log rows, calls={result['calls']}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, ensure_ascii=False, indent=1, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# risk_mc.py
+# Monte Carlo риска DCA-лесенки на момент входа: блочный бутстрап недавних 5m-баров (доходность
+# close-close вместе с high/low бара) -> матрицы цен (P путей, T баров). Правила движка — усреднения по
+# триггерам лесенки, заморозка усреднений на пробое коридора, TP от средней, стадии трейлинга с
+# chandelier, ликвидация по оценке лесенки — применяются ко всем путям сразу векторами (P,).
+# Внутри бара сначала неблагоприятный экстремум (SL, доборы, ликвидация), затем благоприятный (TP, трейлинг).
+# Не моделируются: добор-ретест после пробоя (нужно подтверждение индикаторами) и округление до тика.
+from __future__ import annotations
+
+import logging
+import time
+
+import numpy as np
+
+from candle_buffer import tf_ms
+from scanner_bmr_dca import CONFIG
+
+log = logging.getLogger("risk_mc")
+
+OUTCOMES = ("open", "tp", "sl", "liq")
+_OPEN, _TP, _SL, _LIQ = range(4)
+
+
+def bar_components(bars: np.ndarray, demean: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Лог-доходность close-close и high/low относительно предыдущего close для каждого бара.
+    demean убирает снос окна — оценка риска не должна продлевать вчерашний тренд."""
+    h, l, c = (bars[:, i].astype(np.float64) for i in (2, 3, 4))
+    prev = c[:-1]
+    r = np.log(c[1:] / prev)
+    hi = np.log(np.maximum(h[1:], c[1:]) / prev)
+    lo = np.log(np.minimum(l[1:], c[1:]) / prev)
+    if demean:
+        mu = r.mean()
+        r, hi, lo = r - mu, hi - mu, lo - mu
+    return r, hi, lo
+
+
+def bootstrap_paths(bars: np.ndarray, entry: float, paths: int, horizon: int, block: int,
+                    rng: np.random.Generator, demean: bool = True):
+    """Матрицы (paths, horizon): close, high, low. Блоки по block баров сохраняют кластеры волатильности."""
+    r, hi, lo = bar_components(bars, demean)
+    n = len(r)
+    block = max(1, min(block, n))
+    nblocks = -(-horizon // block)
+    starts = rng.integers(0, n - block + 1, size=(paths, nblocks))
+    idx = (starts[:, :, None] + np.arange(block)).reshape(paths, -1)[:, :horizon]
+    rr = r[idx]
+    cum = np.cumsum(rr, axis=1)
+    prev = entry * np.exp(cum - rr)
+    return entry * np.exp(cum), prev * np.exp(hi[idx]), prev * np.exp(lo[idx])
+
+
+def simulate(pos, bars: np.ndarray, entry: float, atr: float, bank: float, fee_entry: float, fee_exit: float,
+             paths: int | None = None, horizon: int | None = None, block: int | None = None,
+             seed: int | None = None) -> dict | None:
+    """Вероятности исходов только что открытой позиции pos (лесенка уже построена) за horizon баров."""
+    if pos.ladder is None or len(bars) < 3:
+        return None
+    t0 = time.perf_counter()
+    paths = paths or CONFIG.RISK_MC_PATHS
+    horizon = horizon or CONFIG.RISK_MC_HORIZON_BARS
+    block = block or CONFIG.RISK_MC_BLOCK_BARS
+    rng = np.random.default_rng(seed)
+    close, high, low = bootstrap_paths(bars, entry, paths, horizon, block, rng)
+    rep = run_rules(pos, close, high, low, atr, bank, fee_entry, fee_exit)
+    rep["elapsed_ms"] = (time.perf_counter() - t0) * 1000
+    return rep
+
+
+def run_rules(pos, close: np.ndarray, high: np.ndarray, low: np.ndarray, atr: float, bank: float,
+              fee_entry: float, fee_exit: float) -> dict:
+    """Правила движка на готовых матрицах (paths, horizon) close/high/low."""
+    ladder = pos.ladder
+    paths, horizon = close.shape
+    s = 1.0 if pos.side == "LONG" else -1.0
+    adv, fav = (low, high) if s > 0 else (high, low)
+    n_allow = max(1, min(pos.max_steps, len(ladder)))
+    avg = ladder["avg"].astype(np.float64)
+    tp = avg * (1 + s * pos.tp_pct)
+    liq = ladder["liq"].astype(np.float64)
+    lock = ladder["sl_lock"].reshape(len(ladder), -1).astype(np.float64)
+    cum_margin = ladder["cum_margin"].astype(np.float64)
+    cum_qty = ladder["cum_qty"].astype(np.float64)
+    trig_next = np.full(len(ladder), np.nan)
+    trig_next[:n_allow - 1] = ladder["trigger"][1:n_allow]
+    brk_up, brk_dn = pos.brk_up, pos.brk_dn
+    stages = CONFIG.TRAILING_STAGES
+
+    k = np.full(paths, max(0, pos.steps_filled - 1), dtype=np.int64)
+    alive = np.ones(paths, dtype=bool)
+    frozen = np.zeros(paths, dtype=bool)
+    exhausted = np.zeros(paths, dtype=bool)
+    sl = np.full(paths, np.nan)
+    stage = np.full(paths, -1, dtype=np.int64)
+    outcome = np.full(paths, _OPEN, dtype=np.int8)
+    exit_bar = np.full(paths, horizon, dtype=np.int64)
+    exit_px = close[:, -1].copy()
+
+    def close_out(m, code, price, t):
+        outcome[m] = code
+        exit_bar[m] = t + 1
+        exit_px[m] = price[m]
+        alive[m] = False
+
+    for t in range(horizon):
+        a, f = adv[:, t], fav[:, t]
+        # 1) трейлинг-SL, выставленный на прошлых барах
+        close_out(alive & (s * a <= s * sl), _SL, sl, t)
+        # 2) доборы по триггерам (за бар может сработать несколько ступеней)
+        for _ in range(n_allow - 1):
+            m = alive & ~frozen & (s * a <= s * trig_next[k])
+            if not m.any():
+                break
+            k[m] += 1
+        if n_allow > 1:
+            exhausted |= alive & (k == n_allow - 1)
+        # 3) ликвидация по оценке текущей ступени
+        liq_k = liq[k]
+        close_out(alive & (s * a <= s * liq_k), _LIQ, liq_k, t)
+        # 4) пробой коридора замораживает обычные доборы
+        if brk_up is not None and brk_dn is not None:
+            frozen |= alive & ((high[:, t] >= brk_up) | (low[:, t] <= brk_dn))
+        # 5) TP от средней текущей ступени
+        tp_k = tp[k]
+        close_out(alive & (s * f >= s * tp_k), _TP, tp_k, t)
+        # 6) стадии трейлинга по благоприятному экстремуму
+        avg_k = avg[k]
+        gain = np.maximum(0.0, (f / avg_k - 1.0) if s > 0 else (avg_k / f - 1.0)) / CONFIG.TP_PCT
+        chand = f - s * 3.0 * atr
+        for i, (arm, lk) in enumerate(stages):
+            armed = alive & (gain >= arm)
+            if not armed.any():
+                break
+            m = armed & (stage < i)
+            locked = lock[k, i] if i < lock.shape[1] else np.full(paths, np.nan)
+            locked = np.where(np.isfinite(locked), locked, avg_k * (1 + s * lk * CONFIG.TP_PCT))
+            new_sl = s * np.maximum(s * locked, s * chand)
+            better = m & (np.isnan(sl) | (s * new_sl > s * sl))
+            sl[better] = new_sl[better]
+            stage[better] = i
+        if not alive.any():
+            break
+
+    lev = pos.leverage
+    margin = cum_margin[k]
+    pnl = margin * lev * s * (exit_px / avg[k] - 1.0) - margin * lev * fee_entry - cum_qty[k] * exit_px * fee_exit
+    pnl = np.where(outcome == _LIQ, np.maximum(pnl, -bank), pnl)
+    bar_min = tf_ms(CONFIG.TF_ENTRY) / 60000
+    done = outcome != _OPEN
+    hold = exit_bar[done] * bar_min
+    counts = np.bincount(outcome, minlength=len(OUTCOMES))
+    return {
+        "paths": paths, "horizon_min": horizon * bar_min,
+        **{f"p_{name}": float(c) / paths for name, c in zip(OUTCOMES, counts)},
+        "p_exhaust": float(exhausted.mean()),
+        "hold_mean_min": float(hold.mean()) if len(hold) else float("nan"),
+        "hold_median_min": float(np.median(hold)) if len(hold) else float("nan"),
+        "pnl_mean": float(pnl.mean()),
+        "pnl_p05": float(np.percentile(pnl, 5)),
+    }
+
+
+def _pct(p: float) -> str:
+    return f"{p * 100:.0f}%" if p >= 0.01 or p == 0 else "<1%"
+
+
+def _hours(minutes: float) -> str:
+    return "—" if minutes != minutes else f"{minutes / 60:.1f} ч"
+
+
+def format_report(rep: dict | None) -> str:
+    if not rep:
+        return ""
+    return (f"🎲 Риск (MC {rep['paths']} путей, {rep['horizon_min'] / 60:.0f} ч): "
+            f"TP {_pct(rep['p_tp'])} | трейлинг-SL {_pct(rep['p_sl'])} | ликвидация {_pct(rep['p_liq'])} | "
+            f"открыта {_pct(rep['p_open'])}\n"
+            f"Лесенка исчерпана: {_pct(rep['p_exhaust'])} | удержание ср. {_hours(rep['hold_mean_min'])} "
+            f"(медиана {_hours(rep['hold_median_min'])}) | E[PnL] {rep['pnl_mean']:+.2f} USDT, "
+            f"5%-хвост {rep['pnl_p05']:+.2f}")
+
+
+def estimate_for_open(pos, buf5, now: float, px: float, atr: float, bank: float,
+                      fee_entry: float, fee_exit: float) -> str:
+    """Строка для сообщения OPEN (пусто, если истории мало или расчёт упал)."""
+    try:
+        bars = buf5.closed(now * 1000)[-CONFIG.RISK_MC_LOOKBACK_BARS:]
+        rep = simulate(pos, bars, px, atr, bank, fee_entry, fee_exit)
+    except Exception:
+        log.exception("Risk Monte Carlo failed")
+        return ""
+    if rep:
+        log.info(f"[RISK-MC] {pos.signal_id}: " + ", ".join(
+            f"{k}={v:.3f}" for k, v in rep.items() if isinstance(v, float)))
+    return format_report(rep)
@@ -1,7 +1,5 @@
 from __future__ import annotations
-import asyncio, time, logging, json, os, inspect, numbers
-# ИСПРАВЛЕНО: Возвращены недостающие импорты
-from datetime import datetime, timezone
+import asyncio, logging, json, os, inspect, numbers
 
 import numpy as np
 import pandas as pd
@@ -11,7 +9,15 @@ import ccxt as ccxt_sync
 from telegram.ext import Application
 import gspread
 
+import clock
+import startup
+import tick_math
 import trade_executor
+import journal
+import equity_curve
+import market_cache
+import snapshot_utils
+from candle_buffer import CandleBuffer, OHLCV_COLUMNS
 
 log = logging.getLogger("bmr_dca_engine")
 
@@ -49,6 +55,10 @@ class CONFIG:
     TP_PCT = 0.010
     TRAILING_STAGES = [(0.35, 0.25), (0.60, 0.50), (0.85, 0.75)]
     SCAN_INTERVAL_SEC = 3
+    POLL_MIN_SEC = 0.5
+    POLL_MAX_SEC = 30.0
+    POLL_NEAR_ATR = 0.5
+    POLL_FAR_ATR = 4.0
     REBUILD_RANGE_EVERY_MIN = 15
     REBUILD_TACTICAL_EVERY_MIN = 5
     SAFETY_BANK_USDT = 1500.0
@@ -61,6 +71,18 @@ class CONFIG:
     MAINT_MMR = 0.004
     LIQ_FEE_BUFFER = 1.0
     SL_NOTIFY_MIN_TICK_STEP = 1
+    ENTRY_BUF_BARS = 300
+    RANGE_BUF_BARS = 1500
+    SNAPSHOT_EVERY_SEC = 30
+    SNAPSHOT_MAX_AGE_SEC = 6 * 3600
+    SHEETS_INIT_TIMEOUT_SEC = 60     # дольше не держим первый тик: журнал Sheets догонит в фоне
+    SHADOW_ENABLED = os.getenv("BMR_SHADOW", "1") == "1"
+    # Monte Carlo риска лесенки в сообщении OPEN (risk_mc.py)
+    RISK_MC_ENABLED = os.getenv("BMR_RISK_MC", "1") == "1"
+    RISK_MC_PATHS = 2000
+    RISK_MC_HORIZON_BARS = 576        # 48 ч на 5m
+    RISK_MC_BLOCK_BARS = 12
+    RISK_MC_LOOKBACK_BARS = 300
     AUTO_ALLOC = {
         "thin_tac_vs_strat": 0.35,
         "low_vol_z": 0.5,
@@ -103,13 +125,16 @@ def _clean_payload(d: dict) -> dict:
     return {k: _clean(v) for k, v in d.items() if k in SAFE_LOG_KEYS}
 
 async def log_event_safely(payload: dict):
+    payload = _clean_payload(payload)
+    await asyncio.get_running_loop().run_in_executor(None, journal.record, payload)
     try:
-        await maybe_await(trade_executor.bmr_log_event, _clean_payload(payload))
+        await maybe_await(trade_executor.bmr_log_event, payload)
     except Exception:
         log.exception("[SHEETS] log_event_safely failed")
 
-def fmt(p: float) -> str:
+def fmt(p: float, tick: float | None = None) -> str:
     if p is None or pd.isna(p): return "N/A"
+    if tick: return tick_math.grid(tick).fmt(p)
     if p < 0.01: return f"{p:.6f}"
     if p < 1.0:  return f"{p:.5f}"
     return f"{p:.4f}"
@@ -154,7 +179,7 @@ async def fetch_ohlcv_safe(exchange, symbol, timeframe, limit, retries=3, timeou
             wait = 1.5 ** attempt
             log.warning(f"OHLCV timeout {symbol} {timeframe} lim={limit} "
                         f"try {attempt+1}/{retries}: {e}; retry in {wait:.1f}s")
-            await asyncio.sleep(wait)
+            await clock.sleep(wait)
     small = max(240, min(500, (limit or 500)//2))
     try:
         log.warning(f"Retries failed for limit={limit}. Falling back to limit={small}.")
@@ -170,6 +195,36 @@ def chandelier_stop(side: str, price: float, atr: float, mult: float = 3.0):
     if side == "LONG": return price - mult*atr
     else: return price + mult*atr
 
+def advance_trailing(pos, px: float, atr: float, tick: float) -> list[tuple[int, float]]:
+    """Стадии трейлинга на тике px: пройденные стадии пропускаются, на первой неармированной — стоп.
+    Обновляет pos.sl_price/trail_stage; возвращает (стадия, SL) для каждого улучшения."""
+    if pos.side == "LONG": gain_to_tp = max(0.0, (px / max(pos.avg,1e-9) - 1.0) / CONFIG.TP_PCT)
+    else: gain_to_tp = max(0.0, (pos.avg / max(px,1e-9) - 1.0) / CONFIG.TP_PCT)
+    g = tick_math.grid(tick)
+    moved = []
+    for stage_idx, (arm, lock) in enumerate(CONFIG.TRAILING_STAGES):
+        if pos.trail_stage >= stage_idx:
+            continue
+        if gain_to_tp < arm:
+            break
+        row = pos.current_row()
+        if row is not None and np.isfinite(row["sl_lock"][stage_idx]):
+            locked = float(row["sl_lock"][stage_idx])
+        else:
+            lock_pct = lock * CONFIG.TP_PCT
+            locked = pos.avg*(1+lock_pct) if pos.side=="LONG" else pos.avg*(1-lock_pct)
+        chand = chandelier_stop(pos.side, px, atr)
+        new_sl = max(locked, chand) if pos.side=="LONG" else min(locked, chand)
+        new_sl_t = g.to_ticks(new_sl)
+        improves = (pos.sl_price is None) or \
+                   (pos.side == "LONG"  and new_sl_t > g.to_ticks(pos.sl_price)) or \
+                   (pos.side == "SHORT" and new_sl_t < g.to_ticks(pos.sl_price))
+        if improves:
+            pos.sl_price = g.to_price(new_sl_t)
+            pos.trail_stage = stage_idx
+            moved.append((stage_idx, pos.sl_price))
+    return moved
+
 def break_levels(rng: dict) -> tuple[float, float]:
     up = rng["upper"] * (1.0 + CONFIG.BREAK_EPS)
     dn = rng["lower"] * (1.0 - CONFIG.BREAK_EPS)
@@ -185,35 +240,30 @@ def break_distance_pcts(px: float, up: float, dn: float) -> tuple[float, float]:
 def sl_moved_enough(prev: float|None, new: float, side: str, tick: float, min_steps: int) -> bool:
     if prev is None:
         return True
-    step = max(tick * max(1, min_steps), 1e-12)
-    return (new > prev + step) if side == "LONG" else (new < prev - step)
+    g = tick_math.grid(tick)
+    moved = g.to_ticks(new) - g.to_ticks(prev)
+    return (moved if side == "LONG" else -moved) > max(1, min_steps)
 
 def quantize_to_tick(x: float | None, tick: float) -> float | None:
-    if x is None or (isinstance(x, float) and np.isnan(x)):
-        return x
-    return round(round(x / tick) * tick, 10)
+    return tick_math.grid(tick).snap(x)
 
-def compute_pct_targets(entry: float, side: str, rng: dict, tick: float, pcts: list[float]) -> list[float]:
+def compute_pct_targets_ticks(entry: float, side: str, rng: dict, tick: float, pcts: list[float]) -> list[int]:
+    """Цели в целых тиках, по направлению от entry; соседние отстоят больше чем на тик."""
+    buf = max(tick, 0.05 * max(rng.get("atr1h", 0.0), 1e-9))
+    brk_up, brk_dn = break_levels(rng)
     if side == "SHORT":
-        cap = rng["upper"]
-        path = max(0.0, cap - entry)
-        raw = [entry + path * p for p in pcts]
-        brk_up, _ = break_levels(rng)
-        buf = max(tick, 0.05 * max(rng.get("atr1h", 0.0), 1e-9))
-        capped = [min(x, brk_up - buf) for x in raw]
+        path = max(0.0, rng["upper"] - entry)
+        cap = round((brk_up - buf) / tick)
+        q = [min(round((entry + path * p) / tick), cap) for p in pcts]
     else:
-        cap = rng["lower"]
-        path = max(0.0, entry - cap)
-        raw = [entry - path * p for p in pcts]
-        _, brk_dn = break_levels(rng)
-        buf = max(tick, 0.05 * max(rng.get("atr1h", 0.0), 1e-9))
-        capped = [max(x, brk_dn + buf) for x in raw]
-    out = []
-    for x in capped:
-        q = quantize_to_tick(x, tick)
-        if q is not None and (not out or (side == "SHORT" and q > out[-1] + tick) or (side == "LONG" and q < out[-1] - tick)):
-            out.append(q)
-    return out
+        path = max(0.0, entry - rng["lower"])
+        cap = round((brk_dn + buf) / tick)
+        q = [max(round((entry - path * p) / tick), cap) for p in pcts]
+    return [q[i] for i in tick_math.spaced(q, 1 if side == "SHORT" else -1)]
+
+def compute_pct_targets(entry: float, side: str, rng: dict, tick: float, pcts: list[float]) -> list[float]:
+    g = tick_math.grid(tick)
+    return [g.to_price(n) for n in compute_pct_targets_ticks(entry, side, rng, tick, pcts)]
 
 def compute_pct_targets_labeled(entry, side, rng, tick, pcts, label):
     prices = compute_pct_targets(entry, side, rng, tick, pcts)
@@ -224,19 +274,15 @@ def compute_pct_targets_labeled(entry, side, rng, tick, pcts, label):
     return out
 
 def merge_targets_sorted(side: str, tick: float, targets: list[dict]) -> list[dict]:
-    if side == "SHORT":
-        targets = sorted(targets, key=lambda t: t["price"])
-    else:
-        targets = sorted(targets, key=lambda t: t["price"], reverse=True)
-    dedup = []
-    for t in targets:
-        if not dedup:
-            dedup.append(t)
-        else:
-            if (side=="SHORT" and t["price"] > dedup[-1]["price"] + tick) or \
-               (side=="LONG"  and t["price"] < dedup[-1]["price"] - tick):
-                dedup.append(t)
-    return dedup
+    g = tick_math.grid(tick)
+    keyed = sorted(((g.to_ticks(t["price"]), t) for t in targets), key=lambda kt: kt[0], reverse=(side == "LONG"))
+    keep = tick_math.spaced([k for k, _ in keyed], 1 if side == "SHORT" else -1)
+    return [keyed[i][1] for i in keep]
+
+def merge_target_ticks(side: str, *parts: list[int]) -> list[int]:
+    """То же для целей в тиках без меток."""
+    q = sorted((n for part in parts for n in part), reverse=(side == "LONG"))
+    return [q[i] for i in tick_math.spaced(q, 1 if side == "SHORT" else -1)]
 
 def compute_mixed_targets(entry: float, side: str, rng_strat: dict, rng_tac: dict, tick: float) -> list[dict]:
     tacs = compute_pct_targets_labeled(entry, side, rng_tac,   tick, CONFIG.TACTICAL_PCTS,  "TAC")
@@ -260,7 +306,8 @@ def choose_growth(ind: dict, rng_strat: dict, rng_tac: dict) -> float:
 
 # ДОБАВЛЕНО: Хелпер для расчета чистого PnL
 def compute_net_pnl(pos, exit_p: float, fee_entry: float, fee_exit: float) -> tuple[float, float]:
-    sum_margin = sum(pos.step_margins[:pos.steps_filled]) or 1e-9
+    row = pos.current_row() if getattr(pos, "ladder", None) is not None else None
+    sum_margin = (float(row["cum_margin"]) if row is not None else sum(pos.step_margins[:pos.steps_filled])) or 1e-9
     raw_pnl = (exit_p / pos.avg - 1.0) * (1 if pos.side == "LONG" else -1)
     gross_usd = sum_margin * (raw_pnl * pos.leverage)
     entry_notional = sum_margin * pos.leverage
@@ -271,19 +318,27 @@ def compute_net_pnl(pos, exit_p: float, fee_entry: float, fee_exit: float) -> tu
     net_pct = (net_usd / sum_margin) * 100.0
     return net_usd, net_pct
 
+def mark_to_market(pos, px: float, now: float, bank: float, fee_entry: float, fee_exit: float) -> list[str]:
+    """Переоценка открытой позиции по рынку (выход тейкером); возвращает новые оповещения о риске."""
+    if pos.mtm is None:
+        pos.mtm = equity_curve.PositionEquity(pos.open_ts)
+    row = pos.current_row()
+    margin = float(row["cum_margin"]) if row is not None else sum(pos.step_margins[:pos.steps_filled])
+    upnl, _ = compute_net_pnl(pos, px, fee_entry, fee_exit)
+    dist = liq_distance_pct(pos.side, px, ladder_row_liq(row)) if row is not None else float('nan')
+    return pos.mtm.update(now, upnl, margin, margin / bank if bank else 0.0, dist, bank=bank)
+
 # ---------------------------------------------------------------------------
 # Core Logic Functions
 # ---------------------------------------------------------------------------
-async def build_range_for_days(exchange, symbol: str, lookback_days: int):
-    limit_h = min(int(lookback_days * 24), 1500)
-    ohlc = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_RANGE, limit_h)
-    if not ohlc: return None
+def range_from_ohlcv(ohlc) -> dict | None:
+    if ohlc is None or len(ohlc) == 0: return None
     df = pd.DataFrame(ohlc, columns=["ts","open","high","low","close","volume"])
     ema = ta.ema(df["close"], length=50)
     atr = ta.atr(df["high"], df["low"], df["close"], length=14)
     lower = float(np.quantile(df["close"].dropna(), CONFIG.Q_LOWER))
     upper = float(np.quantile(df["close"].dropna(), CONFIG.Q_UPPER))
-    if pd.notna(ema.iloc[-1]) and pd.notna(atr.iloc[-1]):
+    if ema is not None and atr is not None and pd.notna(ema.iloc[-1]) and pd.notna(atr.iloc[-1]):
         mid = float(ema.iloc[-1])
         atr1h = float(atr.iloc[-1])
         lower = min(lower, mid - CONFIG.RANGE_MIN_ATR_MULT*atr1h)
@@ -293,10 +348,27 @@ async def build_range_for_days(exchange, symbol: str, lookback_days: int):
         mid = float(df["close"].iloc[-1])
     return {"lower": lower, "upper": upper, "mid": mid, "atr1h": atr1h, "width": upper-lower}
 
-async def build_ranges(exchange, symbol: str):
-    strat = await build_range_for_days(exchange, symbol, CONFIG.STRATEGIC_LOOKBACK_DAYS)
-    tac   = await build_range_for_days(exchange, symbol, CONFIG.TACTICAL_LOOKBACK_DAYS)
-    return strat, tac
+async def build_range_for_days(exchange, symbol: str, lookback_days: int):
+    limit_h = min(int(lookback_days * 24), 1500)
+    ohlc = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_RANGE, limit_h)
+    if not ohlc: return None
+    return range_from_ohlcv(ohlc)
+
+async def build_ranges(exchange, symbol: str, buf1h: CandleBuffer | None = None):
+    if buf1h is None:
+        strat = await build_range_for_days(exchange, symbol, CONFIG.STRATEGIC_LOOKBACK_DAYS)
+        tac   = await build_range_for_days(exchange, symbol, CONFIG.TACTICAL_LOOKBACK_DAYS)
+        return strat, tac
+    # Один буфер 1h на оба диапазона: догружаем только недостающие бары
+    limit_strat = min(int(CONFIG.STRATEGIC_LOOKBACK_DAYS * 24), 1500)
+    limit_tac   = min(int(CONFIG.TACTICAL_LOOKBACK_DAYS * 24), 1500)
+    ohlc = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_RANGE,
+                                  buf1h.delta_limit(clock.now()*1000, limit_strat))
+    if ohlc:
+        buf1h.merge(ohlc)
+    if not len(buf1h):
+        return None, None
+    return range_from_ohlcv(buf1h.tail(limit_strat)), range_from_ohlcv(buf1h.tail(limit_tac))
 
 def compute_indicators_5m(df: pd.DataFrame) -> dict:
     atr5m = ta.atr(df["high"], df["low"], df["close"], length=14).iloc[-1]
@@ -337,7 +409,20 @@ def compute_indicators_5m(df: pd.DataFrame) -> dict:
 # ---------------------------------------------------------------------------
 # Position State Manager
 # ---------------------------------------------------------------------------
+def ladder_dtype(n_stages: int) -> np.dtype:
+    return np.dtype([
+        ("step", "i4"), ("trigger", "f8"), ("label", "U16"),
+        ("margin", "f8"), ("cum_margin", "f8"), ("cum_notional", "f8"), ("fee_est", "f8"),
+        ("cum_qty", "f8"), ("avg", "f8"), ("tp", "f8"),
+        ("sl_lock", "f8", (max(1, n_stages),)), ("liq", "f8"),
+    ])
+
 class Position:
+    ladder = None          # для позиций, сохранённых до появления таблицы лесенки
+    mtm = None             # equity_curve.PositionEquity, создаётся на первом тике переоценки
+    fill_log = ()
+    brk_up = brk_dn = None
+
     def __init__(self, side: str, signal_id: str, leverage: int | None=None):
         self.side = side
         self.signal_id = signal_id
@@ -348,19 +433,21 @@ class Position:
         self.tp_pct = CONFIG.TP_PCT
         self.tp_price = 0.0
         self.sl_price = None
-        self.open_ts = time.time()
+        self.open_ts = clock.now()
         self.leverage = leverage or CONFIG.LEVERAGE
         self.max_steps = CONFIG.DCA_LEVELS
         self.reserved_one = False
         self.last_sl_notified_price = None
         self.ordinary_targets: list[dict] = []
         self.trail_stage: int = -1
+        self.fill_log: list[tuple[float, str]] = []
+        self.ladder: np.ndarray | None = None
 
     def plan_margins(self, bank: float, growth: float):
         total_target = bank * CONFIG.CUM_DEPOSIT_FRAC_AT_FULL
         self.step_margins = plan_margins_bank_first(total_target, CONFIG.DCA_LEVELS, growth)
 
-    def add_step(self, price: float):
+    def add_step(self, price: float, label: str = ""):
         margin = self.step_margins[self.steps_filled]
         notional = margin * self.leverage
         new_qty = notional / max(price,1e-9)
@@ -368,32 +455,217 @@ class Position:
         self.qty += new_qty
         self.steps_filled += 1
         self.tp_price = self.avg*(1+self.tp_pct) if self.side=="LONG" else self.avg*(1-self.tp_pct)
+        if isinstance(self.fill_log, list):
+            self.fill_log.append((float(price), label))
         return margin, notional
 
+    def build_ladder(self, bank: float, fee_taker: float) -> np.ndarray:
+        """Строит неизменяемую таблицу лесенки: исполненные шаги по факту, остальные — по плану целей."""
+        stages = CONFIG.TRAILING_STAGES
+        sign = 1.0 if self.side == "LONG" else -1.0
+        n_plan = min(len(self.step_margins), 1 + len(self.ordinary_targets))
+        n = max(self.steps_filled, n_plan)
+        rows = np.zeros(n, dtype=ladder_dtype(len(stages)))
+        rows["trigger"] = np.nan
+        replay = len(self.fill_log) == self.steps_filled
+        qty, avg = (0.0, 0.0) if replay else (self.qty, self.avg)
+        cum_margin = 0.0
+        for i in range(n):
+            margin = self.step_margins[i] if i < len(self.step_margins) else 0.0
+            cum_margin += margin
+            if i < self.steps_filled:
+                price, label = self.fill_log[i] if replay else (float("nan"), "")
+                label = label or ("ENTRY" if i == 0 else f"STEP {i}")
+            else:
+                tgt = self.ordinary_targets[i-1]
+                price, label = float(tgt["price"]), tgt["label"]
+            if replay or i >= self.steps_filled:
+                new_qty = margin * self.leverage / max(price, 1e-9)
+                avg = (avg*qty + price*new_qty) / max(qty+new_qty, 1e-9) if qty > 0 else price
+                qty += new_qty
+            row_known = replay or i >= self.steps_filled - 1
+            cum_notional = cum_margin * self.leverage
+            fee_est = cum_notional * fee_taker
+            r = rows[i]
+            r["step"] = i
+            r["trigger"] = price
+            r["label"] = label
+            r["margin"] = margin
+            r["cum_margin"] = cum_margin
+            r["cum_notional"] = cum_notional
+            r["fee_est"] = fee_est
+            if not row_known:
+                r["cum_qty"] = r["avg"] = r["tp"] = r["liq"] = np.nan
+                r["sl_lock"] = np.nan
+                continue
+            r["cum_qty"] = qty
+            r["avg"] = avg
+            r["tp"] = avg * (1 + sign*self.tp_pct)
+            r["sl_lock"] = [avg * (1 + sign*lock*CONFIG.TP_PCT) for _, lock in stages] or [np.nan]
+            liq = approx_liq_price_cross(avg=avg, side=self.side, qty=qty, equity=bank,
+                                         mmr=CONFIG.MAINT_MMR, fees_paid=fee_est*CONFIG.LIQ_FEE_BUFFER)
+            r["liq"] = liq if np.isfinite(liq) and liq > 0 else np.nan
+        rows.flags.writeable = False
+        self.ladder = rows
+        return rows
+
+    def current_row(self):
+        if self.ladder is None or not (0 < self.steps_filled <= len(self.ladder)):
+            return None
+        return self.ladder[self.steps_filled - 1]
+
+    def next_row(self):
+        if self.ladder is None or self.steps_filled >= len(self.ladder):
+            return None
+        return self.ladder[self.steps_filled]
+
+    def remaining_ordinary(self) -> int:
+        ord_total = len(self.ordinary_targets)
+        return max(0, min(self.max_steps - self.steps_filled, ord_total - (self.steps_filled - 1)))
+
+def ladder_row_liq(row) -> float | None:
+    if row is None: return None
+    liq = float(row["liq"])
+    return liq if np.isfinite(liq) else None
+
+def format_ladder(pos) -> str:
+    """Таблица лесенки для /status (моноширинный блок)."""
+    ladder = getattr(pos, "ladder", None)
+    if ladder is None or not len(ladder):
+        return ""
+    lines = [f"{'#':>2} {'триггер':>10} {'метка':<10} {'маржа':>8} {'средняя':>10} {'TP':>10} {'ликв.':>10}"]
+    for r in ladder:
+        mark = "✓" if r["step"] < pos.steps_filled else " "
+        lines.append(
+            f"{int(r['step']):>2}{mark}{fmt(float(r['trigger'])):>10} {str(r['label'])[:10]:<10} "
+            f"{float(r['margin']):>8.2f} {fmt(float(r['avg'])):>10} {fmt(float(r['tp'])):>10} "
+            f"{fmt(ladder_row_liq(r)):>10}"
+        )
+    return "\n".join(lines)
+
 # ---------------------------------------------------------------------------
-# Main Loop
+# Command channel
 # ---------------------------------------------------------------------------
-async def scanner_main_loop(app: Application, broadcast):
-    log.info("BMR-DCA loop starting…")
-    app.bot_data.setdefault("position", None)
-    
+def command_queue(app: Application) -> asyncio.Queue:
+    # Держим на объекте приложения, а не в bot_data: очередь не сериализуется
+    q = getattr(app, "_bmr_cmd_queue", None)
+    if q is None:
+        q = asyncio.Queue()
+        setattr(app, "_bmr_cmd_queue", q)
+    return q
+
+def post_command(app: Application, cmd: str):
+    """Будит цикл немедленно: 'close' / 'open' / 'stop'."""
+    command_queue(app).put_nowait(cmd)
+
+def drain_commands(app: Application) -> list[str]:
+    """Выбрасывает накопившиеся команды: после /stop они не должны сработать при следующем /run."""
+    q = command_queue(app)
+    dropped = []
+    while not q.empty():
+        dropped.append(q.get_nowait())
+    return dropped
+
+def shadow_book(app: Application):
+    """Книга теневых вариантов (shadow.ShadowBook) или None, если режим выключен."""
+    return getattr(app, "_bmr_shadow", None)
+
+async def wait_command(app: Application, timeout: float) -> str | None:
     try:
-        creds_json = os.environ.get("GOOGLE_CREDENTIALS")
-        sheet_key  = os.environ.get("SHEET_ID")
-        if creds_json and sheet_key:
-            gc = gspread.service_account_from_dict(json.loads(creds_json))
-            sheet = gc.open_by_key(sheet_key)
-            await maybe_await(trade_executor.ensure_bmr_log_sheet, sheet, title="BMR_DCA_Log")
-    except Exception as e:
-        log.error(f"Sheets init error: {e}", exc_info=True)
+        return await clock.wait_for(command_queue(app).get(), max(0.0, timeout))
+    except asyncio.TimeoutError:
+        return None
+
+# ---------------------------------------------------------------------------
+# Adaptive polling
+# ---------------------------------------------------------------------------
+def trigger_levels(pos, px: float, rng_strat: dict, rng_tac: dict, entries_allowed: bool) -> list[float]:
+    """Цены, пересечение которых в этом цикле может что-то сработать."""
+    if pos is None:
+        if not entries_allowed:
+            return []
+        return [rng_tac["lower"] + 0.30 * rng_tac["width"], rng_tac["lower"] + 0.70 * rng_tac["width"]]
+    sign = 1.0 if pos.side == "LONG" else -1.0
+    levels = [pos.tp_price]
+    if pos.sl_price:
+        levels.append(pos.sl_price)
+    if not pos.reserved_one:
+        if pos.brk_up is not None:
+            levels += [pos.brk_up, pos.brk_dn]
+        nxt = pos.next_row() if pos.steps_filled < pos.max_steps else None
+        if nxt is not None:
+            levels.append(float(nxt["trigger"]))
+    elif pos.steps_filled < pos.max_steps:
+        levels.append(rng_strat["upper"] * (1 - CONFIG.REENTRY_BAND) if pos.side == "SHORT"
+                      else rng_strat["lower"] * (1 + CONFIG.REENTRY_BAND))
+    for stage_idx, (arm, _) in enumerate(CONFIG.TRAILING_STAGES):
+        if pos.trail_stage < stage_idx:
+            levels.append(pos.avg * (1 + sign * arm * CONFIG.TP_PCT))
+            break
+    return [x for x in levels if x is not None and np.isfinite(x)]
+
+def next_poll_delay(px: float, atr: float, levels: list[float]) -> tuple[float, float]:
+    """Пауза до следующего опроса по расстоянию до ближайшего триггера (в ATR 5m)."""
+    if not levels or not atr or not np.isfinite(atr) or atr <= 0:
+        return (CONFIG.POLL_MAX_SEC if not levels else CONFIG.SCAN_INTERVAL_SEC), float("inf")
+    dist_atr = min(abs(px - x) for x in levels) / atr
+    if dist_atr <= CONFIG.POLL_NEAR_ATR:
+        return CONFIG.POLL_MIN_SEC, dist_atr
+    if dist_atr >= CONFIG.POLL_FAR_ATR:
+        return CONFIG.POLL_MAX_SEC, dist_atr
+    frac = (dist_atr - CONFIG.POLL_NEAR_ATR) / (CONFIG.POLL_FAR_ATR - CONFIG.POLL_NEAR_ATR)
+    return CONFIG.POLL_MIN_SEC + frac * (CONFIG.POLL_MAX_SEC - CONFIG.POLL_MIN_SEC), dist_atr
+
+# ---------------------------------------------------------------------------
+# Main Loop
+# ---------------------------------------------------------------------------
+# Подмена биржи для replay/бенчмарков: callable без аргументов -> объект с API ccxt.
+EXCHANGE_FACTORY = None
 
+def make_exchange():
+    if EXCHANGE_FACTORY is not None:
+        return EXCHANGE_FACTORY()
     exchange = ccxt.mexc({
         'options': {'defaultType': 'swap'},
         'enableRateLimit': True,
         'rateLimit': 150,
         'timeout': 20000,
     })
-    await exchange.load_markets(True)
+    record_path = os.getenv("RECORD_EXCHANGE")
+    if record_path:
+        import replay
+        exchange = replay.RecordingExchange(exchange, record_path)
+    return exchange
+
+async def scanner_main_loop(app: Application, broadcast):
+    log.info("BMR-DCA loop starting…")
+    app.bot_data.setdefault("position", None)
+    timer = startup.loop_timer()
+
+    async def init_sheets():
+        # авторизация и open_by_key — сетевые и синхронные: в поток, параллельно с загрузкой рынков
+        try:
+            creds_json = os.environ.get("GOOGLE_CREDENTIALS")
+            sheet_key  = os.environ.get("SHEET_ID")
+            if creds_json and sheet_key:
+                with timer.phase("sheets"):
+                    gc = await asyncio.to_thread(gspread.service_account_from_dict, json.loads(creds_json))
+                    sheet = await asyncio.to_thread(gc.open_by_key, sheet_key)
+                    await maybe_await(trade_executor.ensure_bmr_log_sheet, sheet, title="BMR_DCA_Log")
+        except Exception as e:
+            log.error(f"Sheets init error: {e}", exc_info=True)
+
+    sheets_task = asyncio.create_task(init_sheets(), name="sheets_init")
+
+    exchange = make_exchange()
+    try:
+        with timer.phase("markets"):
+            market_index = await market_cache.load_markets_cached(exchange)
+    except Exception as e:
+        log.critical(f"Could not load markets: {e}", exc_info=True)
+        sheets_task.cancel()
+        await exchange.close()
+        return
     
     candidates = [CONFIG.SYMBOL, "EUR/USDT:USDT", "EUR/USDT", "EURC/USDT", "EURUSDT"]
     symbol = None
@@ -408,74 +680,146 @@ async def scanner_main_loop(app: Application, broadcast):
 
     if not symbol:
         log.critical(f"None of the candidate symbols were found on the exchange: {candidates}")
+        sheets_task.cancel()
         await exchange.close()
         return
 
-    market = exchange.markets[symbol]
-    tick = None
-    p_prec = market.get("precision", {}).get("price")
-    if isinstance(p_prec, (int, float)):
-        if 0 < float(p_prec) < 1:
-            tick = float(p_prec)
-        elif int(p_prec) >= 0:
-            tick = 10 ** (-int(p_prec))
-    if not tick:
-        tick = market.get("limits", {}).get("price", {}).get("min")
-    if not tick or tick <= 0:
-        tick = 1e-4
+    tick = market_index["tick"].get(symbol) or market_cache.price_tick(exchange.markets[symbol])
     app.bot_data["price_tick"] = float(tick)
 
     rng_strat, rng_tac = None, None
     last_flush = 0
     last_build_strat = 0.0
     last_build_tac = 0.0
+    entry_limit = max(60, CONFIG.VOL_WIN+CONFIG.ADX_LEN+20)
+    buf5 = CandleBuffer(CONFIG.TF_ENTRY, max(CONFIG.ENTRY_BUF_BARS, entry_limit))
+    buf1h = CandleBuffer(CONFIG.TF_RANGE, CONFIG.RANGE_BUF_BARS)
+    loop_started = clock.now()
+    first_tick_pending = True
+
+    loop = asyncio.get_running_loop()
+    with timer.phase("snapshot"):
+        snap = await loop.run_in_executor(None, snapshot_utils.load_snapshot, symbol, CONFIG.SNAPSHOT_MAX_AGE_SEC)
+    if snap:
+        buf5 = snap.get("buf5") or buf5
+        buf1h = snap.get("buf1h") or buf1h
+        rng_strat, rng_tac = snap.get("rng_strat"), snap.get("rng_tac")
+        last_build_strat = snap.get("last_build_strat", 0.0)
+        last_build_tac = snap.get("last_build_tac", 0.0)
+        if app.bot_data.get("position") is None and snap.get("position") is not None:
+            app.bot_data["position"] = snap["position"]
+            log.info(f"Position {snap['position'].signal_id} restored from snapshot.")
+        log.info(f"Warm restart: snapshot age {clock.now() - snap['saved_at']:.0f}s, "
+                 f"5m bars={len(buf5)}, 1h bars={len(buf1h)}.")
+    book = None
+    if CONFIG.SHADOW_ENABLED:
+        import shadow
+        variants = shadow.default_grid()
+        book = snap.get("shadow") if snap else None
+        if book is None or getattr(book, "signature", None) != tuple(map(shadow.variant_name, variants)):
+            book = shadow.ShadowBook(variants)
+        log.info(f"Shadow mode: {len(book)} variants.")
+    setattr(app, "_bmr_shadow", book)
+    last_snap = 0.0
+    last_snap_sig = None
+    ind, px = None, None
+    ind_ts = None
+    fast_path = False
+
+    async def save_snap(pos) -> bool:
+        try:
+            await loop.run_in_executor(None, snapshot_utils.save_snapshot, {
+                "symbol": symbol, "tick": tick, "buf5": buf5, "buf1h": buf1h,
+                "rng_strat": rng_strat, "rng_tac": rng_tac,
+                "last_build_strat": last_build_strat, "last_build_tac": last_build_tac,
+                "ind": ind, "px": px, "position": pos, "shadow": book,
+            })
+            return True
+        except Exception:
+            log.exception("save_snapshot failed")
+            return False
+
+    stale = drain_commands(app)
+    if stale:
+        log.info(f"Dropped stale commands: {stale}.")
 
     while app.bot_data.get("bot_on", False):
         try:
+            market_cache.refresh_if_stale(exchange)
             bank = float(app.bot_data.get("safety_bank_usdt", CONFIG.SAFETY_BANK_USDT))
             fee_maker = float(app.bot_data.get("fee_maker", CONFIG.FEE_MAKER))
             fee_taker = float(app.bot_data.get("fee_taker", CONFIG.FEE_TAKER))
             
-            now = time.time()
+            now = clock.now()
             manage_only = app.bot_data.get("scan_paused", False)
             pos: Position | None = app.bot_data.get("position")
 
-            need_build_strat = (rng_strat is None) or ((now - last_build_strat > CONFIG.REBUILD_RANGE_EVERY_MIN*60) and (pos is None))
-            need_build_tac   = (rng_tac is None) or ((now - last_build_tac > CONFIG.REBUILD_TACTICAL_EVERY_MIN*60) and (pos is None))
-            if need_build_strat or need_build_tac:
-                s, t = await build_ranges(exchange, symbol)
-                if need_build_strat and s:
-                    rng_strat = s
-                    last_build_strat = now
-                    app.bot_data["intro_done"] = False
-                    log.info(f"[RANGE-STRAT] lower={fmt(rng_strat['lower'])} upper={fmt(rng_strat['upper'])} width={fmt(rng_strat['width'])}")
-                if need_build_tac and t:
-                    rng_tac = t
-                    last_build_tac = now
-                    app.bot_data["intro_done"] = False
-                    log.info(f"[RANGE-TAC]   lower={fmt(rng_tac['lower'])} upper={fmt(rng_tac['upper'])} width={fmt(rng_tac['width'])}")
+            fast = fast_path and px is not None and ind is not None and bool(rng_strat and rng_tac)
+            fast_path = False
+            if fast:
+                # команда могла пролежать в очереди до тика — цену перечитываем, индикаторы берём из кэша
+                ohlc5 = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_ENTRY,
+                                               limit=buf5.delta_limit(now*1000, entry_limit))
+                if ohlc5:
+                    buf5.merge(ohlc5)
+                closed5 = buf5.closed(now*1000)
+                if ohlc5 and len(closed5) and int(closed5[-1, 0]) == ind_ts:
+                    px = float(buf5.data[-1, 4])
+                    log.info(f"Command fast path: fresh price {fmt(px)}.")
+                else:
+                    fast = False   # цена не пришла или закрылся новый бар — полный цикл
+            if not fast:
+                need_build_strat = (rng_strat is None) or ((now - last_build_strat > CONFIG.REBUILD_RANGE_EVERY_MIN*60) and (pos is None))
+                need_build_tac   = (rng_tac is None) or ((now - last_build_tac > CONFIG.REBUILD_TACTICAL_EVERY_MIN*60) and (pos is None))
+                if need_build_strat or need_build_tac:
+                    with timer.phase("ranges"):
+                        s, t = await build_ranges(exchange, symbol, buf1h)
+                    if need_build_strat and s:
+                        rng_strat = s
+                        last_build_strat = now
+                        app.bot_data["intro_done"] = False
+                        log.info(f"[RANGE-STRAT] lower={fmt(rng_strat['lower'])} upper={fmt(rng_strat['upper'])} width={fmt(rng_strat['width'])}")
+                    if need_build_tac and t:
+                        rng_tac = t
+                        last_build_tac = now
+                        app.bot_data["intro_done"] = False
+                        log.info(f"[RANGE-TAC]   lower={fmt(rng_tac['lower'])} upper={fmt(rng_tac['upper'])} width={fmt(rng_tac['width'])}")
             
-            if not (rng_strat and rng_tac):
-                log.error("Range is not available. Cannot proceed.")
-                await asyncio.sleep(10)
-                continue
-
-            ohlc5 = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_ENTRY,
-                                           limit=max(60, CONFIG.VOL_WIN+CONFIG.ADX_LEN+20))
-            if not ohlc5:
-                log.warning("Could not fetch 5m OHLCV data. Skipping this cycle.")
-                await asyncio.sleep(2)
-                continue
+                if not (rng_strat and rng_tac):
+                    log.error("Range is not available. Cannot proceed.")
+                    await clock.sleep(10)
+                    continue
+
+                ohlc5 = await fetch_ohlcv_safe(exchange, symbol, CONFIG.TF_ENTRY,
+                                               limit=buf5.delta_limit(now*1000, entry_limit))
+                if not ohlc5:
+                    log.warning("Could not fetch 5m OHLCV data. Skipping this cycle.")
+                    await clock.sleep(2)
+                    continue
+                buf5.merge(ohlc5)
             
-            df5 = pd.DataFrame(ohlc5, columns=["ts","open","high","low","close","volume"])
-            try:
-                ind = compute_indicators_5m(df5)
-            except ValueError as e:
-                log.warning(f"Indicator calculation failed: {e}. Skipping cycle.")
-                await asyncio.sleep(2)
-                continue
+                # индикаторы — по закрытым барам, пересчёт только на новом 5m-баре
+                closed5 = buf5.closed(now*1000)
+                bar_ts = int(closed5[-1, 0]) if len(closed5) else None
+                if ind is None or bar_ts != ind_ts:
+                    try:
+                        ind = compute_indicators_5m(pd.DataFrame(closed5[-entry_limit:], columns=OHLCV_COLUMNS))
+                    except (ValueError, IndexError) as e:
+                        log.warning(f"Indicator calculation failed: {e}. Skipping cycle.")
+                        ind = None
+                        await clock.sleep(2)
+                        continue
+                    ind_ts = bar_ts
 
-            px = float(df5["close"].iloc[-1])
+                px = float(buf5.data[-1, 4])
+
+            if not timer.finished:
+                # до первой сделки журнал в Sheets должен быть готов (но не ценой зависшего цикла)
+                try:
+                    await asyncio.wait_for(asyncio.shield(sheets_task), CONFIG.SHEETS_INIT_TIMEOUT_SEC)
+                except asyncio.TimeoutError:
+                    log.warning(f"Sheets init is taking over {CONFIG.SHEETS_INIT_TIMEOUT_SEC}s; continuing without waiting.")
+                timer.finish()
 
             if (not app.bot_data.get("intro_done")) and (pos is None):
                 p30_t = rng_tac["lower"] + 0.30 * rng_tac["width"]
@@ -499,11 +843,18 @@ async def scanner_main_loop(app: Application, broadcast):
                     await broadcast(app, msg)
                 app.bot_data["intro_done"] = True
 
+            if book is not None and not fast:
+                try:
+                    book.on_tick(px, ind, rng_strat, rng_tac, tick, bank, fee_taker, fee_maker,
+                                 entries_allowed=not manage_only, now=now)
+                except Exception:
+                    log.exception("Shadow tick failed")
+
             pos = app.bot_data.get("position")
             
             if pos and app.bot_data.get("force_close"):
                 exit_p = px
-                time_min = (time.time()-pos.open_ts)/60.0
+                time_min = (clock.now()-pos.open_ts)/60.0
                 net_usd, net_pct = compute_net_pnl(pos, exit_p, fee_taker, fee_maker)
 
                 if broadcast:
@@ -513,7 +864,7 @@ async def scanner_main_loop(app: Application, broadcast):
                                           f"Время в сделке: {time_min:.1f} мин")
                 await log_event_safely({
                     "Event_ID": f"MANUAL_CLOSE_{pos.signal_id}", "Signal_ID": pos.signal_id,
-                    "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                    "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                     "Pair": symbol, "Side": pos.side, "Event": "MANUAL_CLOSE",
                     "PNL_Realized_USDT": net_usd, "PNL_Realized_Pct": net_pct,
                     "Time_In_Trade_min": time_min
@@ -521,10 +872,18 @@ async def scanner_main_loop(app: Application, broadcast):
                 app.bot_data["force_close"] = False
                 pos.last_sl_notified_price = None
                 app.bot_data["position"] = None
+                # сразу, а не по таймеру: рестарт не должен поднять закрытую позицию из снапшота
+                if await save_snap(None):
+                    last_snap_sig = None
+                last_snap = clock.now()
                 continue
 
             if pos:
-                brk_up, brk_dn = break_levels(rng_strat)
+                if pos.brk_up is None:
+                    pos.brk_up, pos.brk_dn = break_levels(rng_strat)
+                if pos.ladder is None:
+                    pos.build_ladder(bank, fee_taker)
+                brk_up, brk_dn = pos.brk_up, pos.brk_dn
                 if px >= brk_up or px <= brk_dn:
                     if not pos.reserved_one:
                         pos.max_steps = min(pos.steps_filled + 1, CONFIG.DCA_LEVELS)
@@ -559,17 +918,16 @@ async def scanner_main_loop(app: Application, broadcast):
                     pos.ordinary_targets = compute_mixed_targets(entry=px, side=pos.side, rng_strat=rng_strat, rng_tac=rng_tac, tick=tick)
                     pos.reserved_one = False
 
-                    margin, _ = pos.add_step(px)
+                    pos.brk_up, pos.brk_dn = break_levels(rng_strat)
+
+                    margin, _ = pos.add_step(px, "MANUAL" if manual else "ENTRY")
+                    pos.build_ladder(bank, fee_taker)
                     app.bot_data["position"] = pos
                     
-                    cum_margin = sum(pos.step_margins[:pos.steps_filled])
-                    cum_notional = cum_margin * pos.leverage
-                    fees_paid_est = cum_notional * fee_taker * CONFIG.LIQ_FEE_BUFFER
-                    liq = approx_liq_price_cross(
-                        avg=pos.avg, side=pos.side, qty=pos.qty,
-                        equity=bank, mmr=CONFIG.MAINT_MMR, fees_paid=fees_paid_est
-                    )
-                    if not np.isfinite(liq) or liq <= 0: liq = None
+                    row = pos.current_row()
+                    cum_margin = float(row["cum_margin"])
+                    fee_est = float(row["fee_est"])
+                    liq = ladder_row_liq(row)
                     dist_to_liq_pct = liq_distance_pct(pos.side, px, liq)
                     dist_txt = "N/A" if np.isnan(dist_to_liq_pct) else f"{dist_to_liq_pct:.2f}%"
                     liq_arrow = "↓" if pos.side == "LONG" else "↑"
@@ -578,18 +936,22 @@ async def scanner_main_loop(app: Application, broadcast):
                     nxt_txt = "N/A" if nxt is None else f"{fmt(nxt['price'])} ({nxt['label']})"
                     
                     ord_total = len(pos.ordinary_targets)
-                    remaining = min(pos.max_steps - pos.steps_filled, ord_total - (pos.steps_filled - 1))
-                    remaining = max(0, remaining)
+                    remaining = pos.remaining_ordinary()
                     
-                    nxt_margin = pos.step_margins[pos.steps_filled] if pos.steps_filled < pos.max_steps else None
-                    nxt_dep_txt = f"{nxt_margin:.2f} USDT" if nxt_margin is not None else "N/A"
+                    nxt_row = pos.next_row() if pos.steps_filled < pos.max_steps else None
+                    nxt_dep_txt = f"{float(nxt_row['margin']):.2f} USDT" if nxt_row is not None else "N/A"
 
-                    brk_up, brk_dn = break_levels(rng_strat)
+                    brk_up, brk_dn = pos.brk_up, pos.brk_dn
                     brk_up_pct, brk_dn_pct = break_distance_pcts(px, brk_up, brk_dn)
                     brk_line = (f"Пробой: ↑<code>{fmt(brk_up)}</code> ({brk_up_pct:.2f}%) | "
                                 f"↓<code>{fmt(brk_dn)}</code> ({brk_dn_pct:.2f}%)")
 
                     hdr = f"BMR-DCA {pos.side} ({symbol.split('/')[0]})" + (" [MANUAL]" if manual else "")
+                    risk_txt = ""
+                    if CONFIG.RISK_MC_ENABLED and broadcast:
+                        import risk_mc
+                        risk_txt = await loop.run_in_executor(None, risk_mc.estimate_for_open, pos, buf5, now, px,
+                                                              ind["atr5m"], bank, fee_taker, fee_maker)
                     if broadcast:
                         await broadcast(app,
                             f"⚡ <b>{hdr}</b>\n"
@@ -599,10 +961,11 @@ async def scanner_main_loop(app: Application, broadcast):
                             f"Ликвидация: {liq_arrow}<code>{fmt(liq)}</code> (до лик.: {dist_txt})\n"
                             f"{brk_line}\n"
                             f"След. усреднение: <code>{nxt_txt}</code> | Плановый добор: <b>{nxt_dep_txt}</b> (осталось: {remaining} из {ord_total})"
+                            + (f"\n{risk_txt}" if risk_txt else "")
                         )
                     await log_event_safely({
                         "Event_ID": f"OPEN_{pos.signal_id}", "Signal_ID": pos.signal_id, "Leverage": pos.leverage,
-                        "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                        "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                         "Pair": symbol, "Side": pos.side, "Event": "OPEN",
                         "Step_No": pos.steps_filled, "Step_Margin_USDT": margin,
                         "Cum_Margin_USDT": cum_margin, "Entry_Price": px, "Avg_Price": pos.avg,
@@ -610,7 +973,7 @@ async def scanner_main_loop(app: Application, broadcast):
                         "Next_DCA_Price": (nxt and nxt["price"]) or "", "Next_DCA_Label": (nxt and nxt["label"]) or "",
                         "Triggered_Label": ("MANUAL" if manual else ""),
                         "Fee_Rate_Maker": fee_maker, "Fee_Rate_Taker": fee_taker,
-                        "Fee_Est_USDT": fees_paid_est / CONFIG.LIQ_FEE_BUFFER, "ATR_5m": ind["atr5m"], "ATR_1h": rng_strat["atr1h"],
+                        "Fee_Est_USDT": fee_est, "ATR_5m": ind["atr5m"], "ATR_1h": rng_strat["atr1h"],
                         "RSI_5m": ind["rsi"], "ADX_5m": ind["adx"], "Supertrend": ind["supertrend"], "Vol_z": ind["vol_z"],
                         "Range_Lower": rng_strat["lower"], "Range_Upper": rng_strat["upper"], "Range_Width": rng_strat["width"]
                     })
@@ -623,21 +986,17 @@ async def scanner_main_loop(app: Application, broadcast):
                                       (pos.side=="LONG"  and px >= rng_strat["lower"] * (1 + CONFIG.REENTRY_BAND))
                         can_add = pos.steps_filled < pos.max_steps
                         if need_retest and can_add and trend_reversal_confirmed(pos.side, ind):
-                            margin, _ = pos.add_step(px)
+                            margin, _ = pos.add_step(px, "RETEST")
                             pos.max_steps = pos.steps_filled
-                            cum_margin = sum(pos.step_margins[:pos.steps_filled])
-                            cum_notional = cum_margin * pos.leverage
-                            fees_paid_est = cum_notional * fee_taker * CONFIG.LIQ_FEE_BUFFER
-                            liq = approx_liq_price_cross(
-                                avg=pos.avg, side=pos.side, qty=pos.qty,
-                                equity=bank, mmr=CONFIG.MAINT_MMR, fees_paid=fees_paid_est
-                            )
-                            if not np.isfinite(liq) or liq <= 0: liq = None
+                            pos.build_ladder(bank, fee_taker)
+                            row = pos.current_row()
+                            cum_margin = float(row["cum_margin"])
+                            liq = ladder_row_liq(row)
                             dist_to_liq_pct = liq_distance_pct(pos.side, px, liq)
                             dist_txt = "N/A" if np.isnan(dist_to_liq_pct) else f"{dist_to_liq_pct:.2f}%"
                             liq_arrow = "↓" if pos.side == "LONG" else "↑"
                             
-                            brk_up, brk_dn = break_levels(rng_strat)
+                            brk_up, brk_dn = pos.brk_up, pos.brk_dn
                             brk_up_pct, brk_dn_pct = break_distance_pcts(px, brk_up, brk_dn)
                             brk_line = (f"Пробой: ↑<code>{fmt(brk_up)}</code> ({brk_up_pct:.2f}%) | "
                                         f"↓<code>{fmt(brk_dn)}</code> ({brk_dn_pct:.2f}%)")
@@ -652,24 +1011,21 @@ async def scanner_main_loop(app: Application, broadcast):
                                     f"{brk_line}")
                             await log_event_safely({
                                 "Event_ID": f"RETEST_ADD_{pos.signal_id}_{pos.steps_filled}", "Signal_ID": pos.signal_id,
-                                "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                                "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                                 "Pair": symbol, "Side": pos.side, "Event": "RETEST_ADD",
                                 "Step_No": pos.steps_filled, "Step_Margin_USDT": margin,
                                 "Entry_Price": px, "Avg_Price": pos.avg
                             })
                     else:
-                        nxt = next_pct_target(pos)
-                        trigger = (nxt is not None) and ((pos.side=="LONG" and px <= nxt["price"]) or (pos.side=="SHORT" and px >= nxt["price"]))
+                        nxt_row = pos.next_row()
+                        trigger = (nxt_row is not None) and ((pos.side=="LONG" and px <= nxt_row["trigger"]) or (pos.side=="SHORT" and px >= nxt_row["trigger"]))
                         if trigger and pos.steps_filled < pos.max_steps:
-                            margin, _ = pos.add_step(px)
-                            cum_margin = sum(pos.step_margins[:pos.steps_filled])
-                            cum_notional = cum_margin * pos.leverage
-                            fees_paid_est = cum_notional * fee_taker * CONFIG.LIQ_FEE_BUFFER
-                            liq = approx_liq_price_cross(
-                                avg=pos.avg, side=pos.side, qty=pos.qty,
-                                equity=bank, mmr=CONFIG.MAINT_MMR, fees_paid=fees_paid_est
-                            )
-                            if not np.isfinite(liq) or liq <= 0: liq = None
+                            margin, _ = pos.add_step(px, str(nxt_row["label"]))
+                            pos.build_ladder(bank, fee_taker)
+                            row = pos.current_row()
+                            cum_margin = float(row["cum_margin"])
+                            fee_est = float(row["fee_est"])
+                            liq = ladder_row_liq(row)
                             dist_to_liq_pct = liq_distance_pct(pos.side, px, liq)
                             dist_txt = "N/A" if np.isnan(dist_to_liq_pct) else f"{dist_to_liq_pct:.2f}%"
                             liq_arrow = "↓" if pos.side == "LONG" else "↑"
@@ -678,15 +1034,14 @@ async def scanner_main_loop(app: Application, broadcast):
                             nxt2_txt = "N/A" if nxt2 is None else f"{fmt(nxt2['price'])} ({nxt2['label']})"
                             
                             ord_total = len(pos.ordinary_targets)
-                            remaining = min(pos.max_steps - pos.steps_filled, ord_total - (pos.steps_filled - 1))
-                            remaining = max(0, remaining)
+                            remaining = pos.remaining_ordinary()
                             
-                            curr_label = pos.ordinary_targets[pos.steps_filled-2]["label"] if pos.steps_filled >= 2 else ""
+                            curr_label = str(row["label"])
                             
-                            nxt2_margin = pos.step_margins[pos.steps_filled] if pos.steps_filled < pos.max_steps else None
-                            nxt2_dep_txt = "N/A" if nxt2_margin is None else f"{nxt2_margin:.2f} USDT"
+                            nxt2_row = pos.next_row() if pos.steps_filled < pos.max_steps else None
+                            nxt2_dep_txt = "N/A" if nxt2_row is None else f"{float(nxt2_row['margin']):.2f} USDT"
 
-                            brk_up, brk_dn = break_levels(rng_strat)
+                            brk_up, brk_dn = pos.brk_up, pos.brk_dn
                             brk_up_pct, brk_dn_pct = break_distance_pcts(px, brk_up, brk_dn)
                             brk_line = (f"Пробой: ↑<code>{fmt(brk_up)}</code> ({brk_up_pct:.2f}%) | "
                                         f"↓<code>{fmt(brk_dn)}</code> ({brk_dn_pct:.2f}%)")
@@ -702,51 +1057,30 @@ async def scanner_main_loop(app: Application, broadcast):
                                     f"След. усреднение: <code>{nxt2_txt}</code> | Плановый добор: <b>{nxt2_dep_txt}</b> (осталось: {remaining} из {ord_total})")
                             await log_event_safely({
                                 "Event_ID": f"ADD_{pos.signal_id}_{pos.steps_filled}", "Signal_ID": pos.signal_id,
-                                "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                                "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                                 "Pair": symbol, "Side": pos.side, "Event": "ADD",
                                 "Step_No": pos.steps_filled, "Step_Margin_USDT": margin,
                                 "Cum_Margin_USDT": cum_margin, "Entry_Price": px, "Avg_Price": pos.avg,
                                 "TP_Price": pos.tp_price, "SL_Price": pos.sl_price or "",
                                 "Liq_Est_Price": liq, "Next_DCA_Price": (nxt2 and nxt2["price"]) or "", "Next_DCA_Label": (nxt2 and nxt2["label"]) or "", "Triggered_Label": curr_label,
                                 "Fee_Rate_Maker": fee_maker, "Fee_Rate_Taker": fee_taker,
-                                "Fee_Est_USDT": fees_paid_est / CONFIG.LIQ_FEE_BUFFER, "ATR_5m": ind["atr5m"], "ATR_1h": rng_strat["atr1h"],
+                                "Fee_Est_USDT": fee_est, "ATR_5m": ind["atr5m"], "ATR_1h": rng_strat["atr1h"],
                                 "RSI_5m": ind["rsi"], "ADX_5m": ind["adx"], "Supertrend": ind["supertrend"], "Vol_z": ind["vol_z"],
                                 "Range_Lower": rng_strat["lower"], "Range_Upper": rng_strat["upper"], "Range_Width": rng_strat["width"]
                             })
 
-                if pos.side == "LONG": gain_to_tp = max(0.0, (px / max(pos.avg,1e-9) - 1.0) / CONFIG.TP_PCT)
-                else: gain_to_tp = max(0.0, (pos.avg / max(px,1e-9) - 1.0) / CONFIG.TP_PCT)
-
-                for stage_idx, (arm, lock) in enumerate(CONFIG.TRAILING_STAGES):
-                    if pos.trail_stage >= stage_idx:
-                        continue
-                    if gain_to_tp < arm:
-                        break
-                    lock_pct = lock * CONFIG.TP_PCT
-                    locked = pos.avg*(1+lock_pct) if pos.side=="LONG" else pos.avg*(1-lock_pct)
-                    chand = chandelier_stop(pos.side, px, ind["atr5m"])
-                    new_sl = max(locked, chand) if pos.side=="LONG" else min(locked, chand)
-                    
-                    tick = app.bot_data.get("price_tick", 1e-4)
-                    new_sl_q  = quantize_to_tick(new_sl, tick)
-                    curr_sl_q = quantize_to_tick(pos.sl_price, tick)
-                    last_notif_q = quantize_to_tick(pos.last_sl_notified_price, tick)
-                    improves = (curr_sl_q is None) or \
-                               (pos.side == "LONG"  and new_sl_q > curr_sl_q) or \
-                               (pos.side == "SHORT" and new_sl_q < curr_sl_q)
-                    if improves:
-                        pos.sl_price = new_sl_q
-                        pos.trail_stage = stage_idx
-                        if sl_moved_enough(last_notif_q, pos.sl_price, pos.side, tick, CONFIG.SL_NOTIFY_MIN_TICK_STEP):
-                            if broadcast:
-                                await broadcast(app, f"🛡️ Трейлинг-SL (стадия {stage_idx+1}) → <code>{fmt(pos.sl_price)}</code>")
-                            pos.last_sl_notified_price = pos.sl_price
-                            await log_event_safely({
-                                "Event_ID": f"TRAIL_SET_{pos.signal_id}_{int(now)}", "Signal_ID": pos.signal_id,
-                                "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
-                                "Pair": symbol, "Side": pos.side, "Event": "TRAIL_SET",
-                                "SL_Price": pos.sl_price, "Avg_Price": pos.avg, "Trail_Stage": stage_idx+1
-                            })
+                tick = app.bot_data.get("price_tick", 1e-4)
+                for stage_idx, new_sl in advance_trailing(pos, px, ind["atr5m"], tick):
+                    if sl_moved_enough(pos.last_sl_notified_price, new_sl, pos.side, tick, CONFIG.SL_NOTIFY_MIN_TICK_STEP):
+                        if broadcast:
+                            await broadcast(app, f"🛡️ Трейлинг-SL (стадия {stage_idx+1}) → <code>{fmt(new_sl, tick)}</code>")
+                        pos.last_sl_notified_price = new_sl
+                        await log_event_safely({
+                            "Event_ID": f"TRAIL_SET_{pos.signal_id}_{int(now)}", "Signal_ID": pos.signal_id,
+                            "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
+                            "Pair": symbol, "Side": pos.side, "Event": "TRAIL_SET",
+                            "SL_Price": new_sl, "Avg_Price": pos.avg, "Trail_Stage": stage_idx+1
+                        })
 
                 tp_hit = (pos.side=="LONG" and px>=pos.tp_price) or (pos.side=="SHORT" and px<=pos.tp_price)
                 sl_hit = pos.sl_price and ((pos.side=="LONG" and px<=pos.sl_price) or (pos.side=="SHORT" and px>=pos.sl_price))
@@ -754,7 +1088,7 @@ async def scanner_main_loop(app: Application, broadcast):
                 if tp_hit or sl_hit:
                     reason = "TP_HIT" if tp_hit else "SL_HIT"
                     exit_p = pos.tp_price if tp_hit else pos.sl_price
-                    time_min = (time.time()-pos.open_ts)/60.0
+                    time_min = (clock.now()-pos.open_ts)/60.0
                     net_usd, net_pct = compute_net_pnl(pos, exit_p, fee_taker, fee_maker)
                     atr_now = ind["atr5m"]
                     if broadcast:
@@ -765,7 +1099,7 @@ async def scanner_main_loop(app: Application, broadcast):
                                       f"Время в сделке: {time_min:.1f} мин")
                     await log_event_safely({
                         "Event_ID": f"{reason}_{pos.signal_id}", "Signal_ID": pos.signal_id,
-                        "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+                        "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
                         "Pair": symbol, "Side": pos.side, "Event": reason,
                         "PNL_Realized_USDT": net_usd, "PNL_Realized_Pct": net_pct,
                         "Time_In_Trade_min": time_min,
@@ -774,17 +1108,46 @@ async def scanner_main_loop(app: Application, broadcast):
                     pos.last_sl_notified_price = None
                     app.bot_data["position"] = None
 
-            if (time.time() - last_flush) >= 10:
+            pos = app.bot_data.get("position")
+            if pos and pos.steps_filled and px is not None:
+                alerts = mark_to_market(pos, px, now, bank, fee_taker, fee_taker)
+                if broadcast:
+                    for text in alerts:
+                        await broadcast(app, f"{text}\n{pos.side} {symbol}, средняя <code>{fmt(pos.avg)}</code>, "
+                                             f"цена <code>{fmt(px)}</code>")
+            if first_tick_pending and pos:
+                first_tick_pending = False
+                log.info(f"First managed tick for {pos.signal_id} {clock.now() - loop_started:.2f}s after start.")
+            snap_sig = (pos.signal_id, pos.steps_filled, pos.sl_price, pos.max_steps) if pos else None
+            if snap_sig != last_snap_sig or (clock.now() - last_snap) >= CONFIG.SNAPSHOT_EVERY_SEC:
+                if await save_snap(pos):
+                    last_snap_sig = snap_sig
+                last_snap = clock.now()
+
+            if (clock.now() - last_flush) >= 10:
                 try:
                     await maybe_await(trade_executor.flush_log_buffers)
                 except Exception:
                     log.exception("flush_log_buffers failed")
-                last_flush = time.time()
+                last_flush = clock.now()
             
-            await asyncio.sleep(CONFIG.SCAN_INTERVAL_SEC)
+            pos = app.bot_data.get("position")
+            levels = trigger_levels(pos, px, rng_strat, rng_tac, entries_allowed=not manage_only)
+            delay, dist_atr = next_poll_delay(px, ind["atr5m"], levels)
+            if pos is None:
+                # диапазоны без позиции перестраиваются по таймеру — не проспать пересборку
+                next_rebuild = min(last_build_strat + CONFIG.REBUILD_RANGE_EVERY_MIN*60,
+                                   last_build_tac + CONFIG.REBUILD_TACTICAL_EVERY_MIN*60)
+                delay = max(CONFIG.POLL_MIN_SEC, min(delay, next_rebuild - clock.now()))
+            log.debug(f"Next poll in {delay:.2f}s (nearest trigger {dist_atr:.2f} ATR)")
+            cmd = await wait_command(app, delay)
+            if cmd in ("close", "open"):
+                fast_path = True
         except Exception:
             log.exception("BMR-DCA loop error")
-            await asyncio.sleep(5)
+            await clock.sleep(5)
 
+    drain_commands(app)
+    sheets_task.cancel()
     await exchange.close()
     log.info("BMR-DCA loop gracefully stopped.")
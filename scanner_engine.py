@@ -1,13 +1,12 @@
 # scanner_engine.py
 
 import asyncio
-import time
 import logging
 import numpy as np
 import os
 import json
 from datetime import datetime, timezone
-from typing import List, Dict, Optional, Tuple
+from typing import Collection, List, Dict, Optional, Tuple
 
 import pandas as pd
 import pandas_ta as ta
@@ -15,7 +14,14 @@ import ccxt.async_support as ccxt
 from telegram.ext import Application
 import gspread
 
+import clock
+import correlation
+import inference
 import trade_executor
+import market_cache
+import shard
+from candle_buffer import CandleBuffer
+from price_feed import PriceFeed
 
 log = logging.getLogger("swing_bot_engine")
 
@@ -69,13 +75,31 @@ class CONFIG:
     TIME_STOP_MFE_THRESHOLD = 0.3   # Порог MFE. Если цена не прошла 30% пути к TP, сделка закроется по тайм-стопу
 
     # --- Системные параметры ---
-    SCANNER_INTERVAL_SECONDS = 300
+    SCAN_BAR_CLOSE_DELAY_SEC = 3     # сканируем сразу после закрытия бара TIMEFRAME
+    SCAN_RETRY_SEC = 10              # повтор для пар, у которых биржа ещё не отдала закрытый бар
+    SCAN_RETRY_WINDOW_SEC = 90
     TICK_MONITOR_INTERVAL_SECONDS = 15
     OHLCV_LIMIT = 250
+    PRICE_FEED_WS = os.getenv("PRICE_FEED_WS", "0") == "1"
     CONCURRENCY_SEMAPHORE = 8
     MAX_FUNDING_RATE_PCT = 0.075
     NOTIFY_EMPTY_SCAN = False
 
+    # --- ML-модель (trading_model.json) ---
+    ML_MODEL_FILE = os.getenv("ML_MODEL_FILE", "")   # пусто — скоринг выключен
+    ML_MIN_PROB = float(os.getenv("ML_MIN_PROB", "0"))  # мин. вероятность класса стороны для входа
+    ML_SCORE_WEIGHT = 1.0           # вклад вероятности в score кандидата
+
+    # --- Корреляционный фильтр (несколько коррелированных альтов в одну сторону — одна ставка) ---
+    CORR_FILTER = True
+    CORR_WINDOW_BARS = 96           # окно доходностей, баров TIMEFRAME (96 × 15m = сутки)
+    CORR_MIN_OBS = 48               # меньше общих баров — корреляция неизвестна, пара не режется
+    CORR_MAX = 0.8                  # макс. корреляция (с учётом стороны) с открытыми/выбранными
+
+    # --- Шардированный скан (shard.py): пары делятся между K воркерами по crc32(symbol) % K ---
+    SCAN_SHARDS = int(os.getenv("SCAN_SHARDS", "1"))              # 1 — скан в этом процессе, как раньше
+    SCAN_LOCAL_WORKERS = os.getenv("SCAN_LOCAL_WORKERS", "1") == "1"  # 0 — воркеры запущены отдельно (контейнеры)
+
 # ===========================================================================
 # HELPERS
 # ===========================================================================
@@ -129,7 +153,7 @@ def format_price(price: float) -> str:
     else: return f"{price:.4f}"
 async def get_market_regime(exchange: ccxt.Exchange, app: Application) -> Optional[bool]:
     bot_data = app.bot_data
-    now = time.time()
+    now = clock.now()
     cache = bot_data.get("market_regime_cache")
     if cache and (now - cache.get('timestamp', 0) < CONFIG.MARKET_REGIME_CACHE_TTL_SECONDS):
         return cache.get('regime')
@@ -158,6 +182,16 @@ def tf_seconds(tf: str) -> int:
     if unit == "h": return n * 3600
     if unit == "d": return n * 86400
     return 0
+def next_bar_close_time(now: float) -> float:
+    tfs = tf_seconds(CONFIG.TIMEFRAME)
+    return (now // tfs + 1) * tfs + CONFIG.SCAN_BAR_CLOSE_DELAY_SEC
+
+# Свечи и id последнего оценённого закрытого бара по каждой паре (живут в процессе)
+OHLCV_CACHE: Dict[str, CandleBuffer] = {}
+LAST_EVAL_BAR: Dict[str, int] = {}
+ML_SCORER: Optional[inference.ModelScorer] = None
+CORR = correlation.CorrelationEngine(CONFIG.CORR_WINDOW_BARS, CONFIG.CORR_MIN_OBS)
+
 def fixed_percentage_levels(symbol: str, entry: float, side: str, exchange: ccxt.Exchange) -> tuple[float, float]:
     """Calculates SL/TP and rounds them to the exchange's price precision."""
     if side == "LONG":
@@ -203,42 +237,90 @@ def check_entry_conditions(df: pd.DataFrame) -> Optional[str]:
 # ===========================================================================
 # MARKET SCANNER & TRADE MANAGER
 # ===========================================================================
-async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
-    bot_data = app.bot_data
-    if len(bot_data.get("active_trades", [])) >= CONFIG.MAX_CONCURRENT_POSITIONS:
-        log.info("Position limit reached. Skipping scan."); return
-    market_is_bull = None
-    if CONFIG.MARKET_REGIME_FILTER:
-        market_is_bull = await get_market_regime(exchange, app)
-        if market_is_bull is True: log.info("Market Regime: BULL. Longs only.")
-        elif market_is_bull is False: log.info("Market Regime: BEAR. Penalizing LONG signals.")
-        else: log.info("Market Regime: NEUTRAL/FLAT. All signals allowed.")
+async def fetch_ml_history(exchange, symbol: str, first_ts: int) -> Optional[np.ndarray]:
+    """Бары до first_ts для прогрева фичей модели (inference.WARMUP_BARS): data lake, если он покрывает
+    окно без разрыва, иначе одна длинная загрузка с биржи."""
+    step = tf_seconds(CONFIG.TIMEFRAME) * 1000
+    since = first_ts - inference.WARMUP_BARS * step
     try:
-        tickers = await exchange.fetch_tickers()
-        liquid_pairs = [s for s, t in tickers.items() if (t.get('quoteVolume') or 0) > CONFIG.MIN_VOL_USD and exchange.market(s).get('type') == 'swap' and s.endswith("USDT:USDT")]
-        log.info(f"Found {len(liquid_pairs)} liquid pairs.")
+        import data_lake
+        hist = await asyncio.to_thread(data_lake.read_ohlcv, exchange.id, CONFIG.TIMEFRAME, symbol, since, first_ts)
+        if len(hist) >= inference.WARMUP_BARS - 1 and int(hist[-1, 0]) == first_ts - step:
+            return hist
     except Exception as e:
-        log.error(f"Could not fetch tickers or filter by volume: {e}"); return
-    if not liquid_pairs: return
-    
+        log.debug(f"{symbol}: data lake history unavailable: {e}")
+    try:
+        rows = await exchange.fetch_ohlcv(symbol, CONFIG.TIMEFRAME, since=since, limit=inference.WARMUP_BARS)
+    except Exception as e:
+        log.warning(f"{symbol}: could not fetch ML warm-up history: {e}")
+        return None
+    rows = np.asarray(rows or [], dtype=np.float64).reshape(-1, 6)
+    return rows[rows[:, 0] < first_ts]
+
+
+def prune_state(keep: set):
+    """Забывает свечи, id баров, признаки модели и колонки CORR пар вне keep."""
+    for s in [s for s in OHLCV_CACHE if s not in keep]:
+        OHLCV_CACHE.pop(s, None)
+    for s in [s for s in LAST_EVAL_BAR if s not in keep]:
+        LAST_EVAL_BAR.pop(s, None)
+    if ML_SCORER is not None:
+        for s in [s for s in ML_SCORER.symbols if s not in keep]:
+            ML_SCORER.forget(s)
+    for s in [s for s in CORR.index if s not in keep]:
+        CORR.forget(s)
+
+async def evaluate_pairs(exchange: ccxt.Exchange, symbols: List[str], expected_bar: int,
+                         entries: bool = True, seed: Collection[str] = ()) -> dict:
+    """Загрузка свечей и проверка условий входа по парам с новым закрытым баром.
+    Результат сериализуем (его же возвращают воркеры шардированного скана):
+    candidates — [{symbol, side, entry_price, atr, ml_prob}], pending — пары без закрытого бара,
+    returns — закрытые бары по каждой оценённой паре для CORR: для пар из seed (их ещё нет в CORR
+    координатора) — окно CORR_WINDOW_BARS (засев истории), для остальных — два последних.
+    entries=False — только returns (пары с позицией и на кулдауне): без условий входа и модели."""
+    to_eval = [s for s in symbols if LAST_EVAL_BAR.get(s, -1) < expected_bar]
+    if entries: log.info(f"{len(to_eval)}/{len(symbols)} pairs have a new closed bar to evaluate.")
+
     sem = asyncio.Semaphore(CONFIG.CONCURRENCY_SEMAPHORE)
+    ml_history = {}
     async def safe_fetch_ohlcv(symbol):
+        buf = OHLCV_CACHE.get(symbol) or CandleBuffer(CONFIG.TIMEFRAME, CONFIG.OHLCV_LIMIT)
         async with sem:
-            try: return await exchange.fetch_ohlcv(symbol, CONFIG.TIMEFRAME, limit=CONFIG.OHLCV_LIMIT)
+            try:
+                ohlcv = await exchange.fetch_ohlcv(symbol, CONFIG.TIMEFRAME,
+                                                   limit=buf.delta_limit(clock.now() * 1000, CONFIG.OHLCV_LIMIT))
             except Exception: return None
+            buf.merge(ohlcv)
+            if entries and ML_SCORER is not None and len(buf) and ML_SCORER.needs_history(symbol, buf.data):
+                ml_history[symbol] = await fetch_ml_history(exchange, symbol, int(buf.data[0, 0]))
+        OHLCV_CACHE[symbol] = buf
+        return buf
     
-    tasks = [safe_fetch_ohlcv(symbol) for symbol in liquid_pairs]
+    tasks = [safe_fetch_ohlcv(symbol) for symbol in to_eval]
     ohlcv_results = await asyncio.gather(*tasks)
     
-    pre_long_candidates, pre_short_candidates = [], []
-    for i, ohlcv in enumerate(ohlcv_results):
-        symbol = liquid_pairs[i]
+    pending = 0
+    candidates, returns = [], {}
+    ml_symbols = []
+    for i, buf in enumerate(ohlcv_results):
+        symbol = to_eval[i]
         try:
-            if time.time() - bot_data.get("trade_cooldown", {}).get(symbol, 0) < tf_seconds(CONFIG.TIMEFRAME) * 2: continue
-            if not ohlcv or len(ohlcv) < CONFIG.EMA_TREND_PERIOD: continue
-            if any(t["Pair"] == symbol for t in bot_data.get("active_trades", [])): continue
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            if time.time() * 1000 - df['timestamp'].iloc[-1] < tf_seconds(CONFIG.TIMEFRAME) * 1000: df = df.iloc[:-1]
+            if buf is None: continue
+            if entries and len(buf) < CONFIG.EMA_TREND_PERIOD:
+                LAST_EVAL_BAR[symbol] = expected_bar
+                continue
+            closed = buf.closed(clock.now() * 1000)
+            if not len(closed): continue
+            bar_id = int(closed[-1, 0])
+            if bar_id <= LAST_EVAL_BAR.get(symbol, -1):
+                pending += 1
+                continue
+            LAST_EVAL_BAR[symbol] = bar_id
+            returns[symbol] = closed[-(CONFIG.CORR_WINDOW_BARS + 2 if symbol in seed else 2):].tolist()
+            if not entries: continue
+            if ML_SCORER is not None and ML_SCORER.observe(symbol, closed, ml_history.get(symbol)):
+                ml_symbols.append(symbol)
+            df = pd.DataFrame(closed, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
             if df.empty or df.iloc[-1]['close'] < CONFIG.MIN_PRICE: continue
             df.ta.ema(length=CONFIG.EMA_FAST_PERIOD, append=True); df.ta.ema(length=CONFIG.EMA_SLOW_PERIOD, append=True)
             df.ta.ema(length=CONFIG.EMA_TREND_PERIOD, append=True)
@@ -255,16 +337,83 @@ async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
 
             side = check_entry_conditions(df.copy())
             if side:
-                candidate_data = {'symbol': symbol, 'side': side, 'df': df}
-                if side == "LONG":
-                    if market_is_bull is True:
-                        pre_long_candidates.append(candidate_data)
-                else: # SHORT
-                    if market_is_bull is not True: 
-                        pre_short_candidates.append(candidate_data)
+                candidates.append({'symbol': symbol, 'side': side, 'entry_price': float(last_candle['close']),
+                                   'atr': 0.0 if pd.isna(atr) else float(atr), 'ml_prob': None})
         except Exception as e:
             log.error(f"Error pre-processing symbol {symbol}: {e}")
 
+    if ML_SCORER is not None and ml_symbols:
+        ml_probs = ML_SCORER.predict(ml_symbols)
+        st = ML_SCORER.stats()
+        log.info(f"ML: scored {st['last_batch']} pairs in {st['last_ms']:.2f} ms (p95 {st['p95_ms']:.2f} ms)")
+        for cand in candidates:
+            cand['ml_prob'] = inference.side_prob(ml_probs.get(cand['symbol']), cand['side'])
+    return {"candidates": candidates, "pending": pending, "returns": returns}
+
+async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> int:
+    """Оценивает только пары с новым закрытым баром. Возвращает число пар, чей бар биржа ещё не отдала."""
+    bot_data = app.bot_data
+    if len(bot_data.get("active_trades", [])) >= CONFIG.MAX_CONCURRENT_POSITIONS:
+        log.info("Position limit reached. Skipping scan."); return 0
+    market_is_bull = None
+    if CONFIG.MARKET_REGIME_FILTER:
+        market_is_bull = await get_market_regime(exchange, app)
+        if market_is_bull is True: log.info("Market Regime: BULL. Longs only.")
+        elif market_is_bull is False: log.info("Market Regime: BEAR. Penalizing LONG signals.")
+        else: log.info("Market Regime: NEUTRAL/FLAT. All signals allowed.")
+    try:
+        tickers = await exchange.fetch_tickers()
+        swap_usdt = market_cache.get_index(exchange)["swap_usdt"]
+        liquid_pairs = [s for s, t in tickers.items() if (t.get('quoteVolume') or 0) > CONFIG.MIN_VOL_USD and s in swap_usdt]
+        log.info(f"Found {len(liquid_pairs)} liquid pairs.")
+    except Exception as e:
+        log.error(f"Could not fetch tickers or filter by volume: {e}"); return 0
+    if not liquid_pairs: return 0
+
+    active_pairs = {t["Pair"] for t in bot_data.get("active_trades", [])}
+    # по CORR, а не по своему OHLCV_CACHE: в шардированном скане свечи грузят воркеры
+    prune_state(set(liquid_pairs) | active_pairs)
+
+    tf_ms_ = tf_seconds(CONFIG.TIMEFRAME) * 1000
+    now_ms = clock.now() * 1000
+    expected_bar = int(now_ms // tf_ms_) * tf_ms_ - tf_ms_
+    cooldown = bot_data.get("trade_cooldown", {})
+    universe = [s for s in liquid_pairs
+                if s not in active_pairs
+                and clock.now() - cooldown.get(s, 0) >= tf_seconds(CONFIG.TIMEFRAME) * 2]
+
+    # входа по ним не ищем, но доходности нужны CORR: без них через окно корреляция с позицией — NaN
+    watch = sorted((active_pairs | set(liquid_pairs)) - set(universe)) if CONFIG.CORR_FILTER else []
+    # засев решает координатор: воркер мог не видеть пару, а мог видеть её до того, как CORR её забыл
+    seed = {s for s in universe + watch if s not in CORR.index}
+
+    if CONFIG.SCAN_SHARDS > 1:
+        scanning = shard.scan(lambda syms, sd: evaluate_pairs(exchange, syms, expected_bar, seed=sd),
+                              universe, CONFIG.SCAN_SHARDS, expected_bar, seed)
+    else:
+        scanning = evaluate_pairs(exchange, universe, expected_bar, seed=seed)
+    evaluated, watched = await asyncio.gather(
+        scanning, evaluate_pairs(exchange, watch, expected_bar, entries=False, seed=seed))
+    pending = evaluated["pending"]
+    for symbol, last2 in {**evaluated["returns"], **watched["returns"]}.items():
+        CORR.observe(symbol, np.asarray(last2, dtype=float))
+
+    pre_long_candidates, pre_short_candidates = [], []
+    for cand in evaluated["candidates"]:
+        if cand['side'] == "LONG":
+            if market_is_bull is True:
+                pre_long_candidates.append(cand)
+        else: # SHORT
+            if market_is_bull is not True:
+                pre_short_candidates.append(cand)
+
+    def ml_ok(c):
+        if c.get('ml_prob') is None or c['ml_prob'] >= CONFIG.ML_MIN_PROB: return True
+        log.info(f"Skip {c['side']} {c['symbol']}: model prob {c['ml_prob']:.2f} < {CONFIG.ML_MIN_PROB}")
+        return False
+    pre_long_candidates = [c for c in pre_long_candidates if ml_ok(c)]
+    pre_short_candidates = [c for c in pre_short_candidates if ml_ok(c)]
+
     final_long_candidates = []
     for cand in pre_long_candidates:
         try:
@@ -289,11 +438,8 @@ async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
     all_candidates = []
     for cand in final_long_candidates + final_short_candidates:
         try:
-            df = cand['df']
-            entry_price = df.iloc[-1]['close']
-            atr_col = next((c for c in df.columns if c.startswith("ATR")), None)
-            atr = df[atr_col].iloc[-1] if atr_col and not pd.isna(df[atr_col].iloc[-1]) else 0
-            
+            entry_price, atr = cand['entry_price'], cand['atr']
+
             risk_usd_raw = (CONFIG.SL_FIXED_PCT / 100) * CONFIG.POSITION_SIZE_USDT * CONFIG.LEVERAGE
             risk_norm = np.tanh(risk_usd_raw / CONFIG.RISK_SCALE)
             quote_volume = tickers.get(cand['symbol'], {}).get('quoteVolume') or CONFIG.MIN_VOL_USD
@@ -302,6 +448,8 @@ async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
             edge = max(tp_move / atr, 1.0) if atr > 0 else 1.0
             
             score = (0.35 * np.log10(quote_volume) - 0.25 * risk_norm + 0.30 * edge)
+            if cand.get('ml_prob') is not None:
+                score += CONFIG.ML_SCORE_WEIGHT * cand['ml_prob']
             all_candidates.append({'symbol': cand['symbol'], 'side': cand['side'], 'entry_price': entry_price, 'atr': atr, 'score': score})
         except Exception as e:
             log.error(f"Error scoring candidate {cand['symbol']}: {e}")
@@ -309,13 +457,22 @@ async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
     long_cand_sorted = sorted([c for c in all_candidates if c['side'] == 'LONG'], key=lambda x: x['score'], reverse=True)
     short_cand_sorted = sorted([c for c in all_candidates if c['side'] == 'SHORT'], key=lambda x: x['score'], reverse=True)
     
+    held = [(t["Pair"], t["Side"]) for t in bot_data.get("active_trades", [])]
+    def take(pool, k, chosen):
+        if not CONFIG.CORR_FILTER:
+            return pool[:k]
+        picked = CORR.select([(c['symbol'], c['side']) for c in pool],
+                             held + [(c['symbol'], c['side']) for c in chosen], k, CONFIG.CORR_MAX)
+        return [pool[i] for i in picked]
+
     n_long = min(len(long_cand_sorted), CONFIG.MAX_TRADES_PER_SCAN // 2 if CONFIG.MAX_TRADES_PER_SCAN > 1 else 1)
     n_short = min(len(short_cand_sorted), CONFIG.MAX_TRADES_PER_SCAN - n_long)
-    selected_candidates = long_cand_sorted[:n_long] + short_cand_sorted[:n_short]
+    selected_candidates = take(long_cand_sorted, n_long, [])
+    selected_candidates += take(short_cand_sorted, n_short, selected_candidates)
     remaining_slots = CONFIG.MAX_TRADES_PER_SCAN - len(selected_candidates)
     if remaining_slots > 0:
-        remaining_pool = sorted(long_cand_sorted[n_long:] + short_cand_sorted[n_short:], key=lambda x: x['score'], reverse=True)
-        selected_candidates.extend(remaining_pool[:remaining_slots])
+        remaining_pool = sorted([c for c in all_candidates if c not in selected_candidates], key=lambda x: x['score'], reverse=True)
+        selected_candidates += take(remaining_pool, remaining_slots, selected_candidates)
         
     opened_long, opened_short = 0, 0
     trades_left_to_open = CONFIG.MAX_CONCURRENT_POSITIONS - len(bot_data.get("active_trades", []))
@@ -333,14 +490,15 @@ async def find_trade_signals(exchange: ccxt.Exchange, app: Application) -> None:
                f"Открыто (лучшие по score): LONG-<b>{opened_long}</b> | SHORT-<b>{opened_short}</b>")
         if broadcast := app.bot_data.get('broadcast_func'):
             await broadcast(app, msg)
+    return pending
 
 async def open_new_trade(symbol: str, side: str, entry_price: float, exchange: ccxt.Exchange, app: Application, atr_entry: float):
     bot_data = app.bot_data
     sl_price, tp_price = fixed_percentage_levels(symbol, entry_price, side, exchange)
     trade = {
-        "Signal_ID": f"{symbol}_{int(time.time())}", "Pair": symbol, "Side": side,
+        "Signal_ID": f"{symbol}_{int(clock.now())}", "Pair": symbol, "Side": side,
         "Entry_Price": entry_price, "SL_Price": sl_price, "TP_Price": tp_price,
-        "Status": "ACTIVE", "Timestamp_UTC": datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S"),
+        "Status": "ACTIVE", "Timestamp_UTC": clock.utcnow().strftime("%Y-%m-%d %H:%M:%S"),
         "sl_pct": CONFIG.SL_FIXED_PCT, 
         "tp_pct": CONFIG.TP_FIXED_PCT,
         "ATR_Entry": atr_entry,
@@ -362,36 +520,44 @@ async def open_new_trade(symbol: str, side: str, entry_price: float, exchange: c
         
     await trade_executor.log_open_trade(trade)
 
-async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
+def make_price_feed(exchange: ccxt.Exchange) -> PriceFeed:
+    return PriceFeed(exchange, CONFIG.TIMEFRAME, CONFIG.EMA_FAST_PERIOD, CONFIG.EMA_SLOW_PERIOD,
+                     CONFIG.ATR_PERIOD, seed_limit=CONFIG.OHLCV_LIMIT, use_ws=CONFIG.PRICE_FEED_WS)
+
+async def monitor_active_trades(exchange: ccxt.Exchange, app: Application, feed: PriceFeed):
     bot_data = app.bot_data
     active_trades = bot_data.get("active_trades", [])
+    symbols = {t['Pair'] for t in active_trades}
+    for s in list(feed.states):
+        if s not in symbols: feed.unsubscribe(s)
     if not active_trades: return
     
     trades_to_close = []
-    symbols = [t['Pair'] for t in active_trades]
-    sem = asyncio.Semaphore(CONFIG.CONCURRENCY_SEMAPHORE)
-    
-    async def safe_fetch_ohlcv(symbol):
-        async with sem:
-            try: return await exchange.fetch_ohlcv(symbol, CONFIG.TIMEFRAME, limit=CONFIG.OHLCV_LIMIT)
-            except Exception: return None
-            
-    tasks = [safe_fetch_ohlcv(s) for s in symbols]
-    ohlcv_results = await asyncio.gather(*tasks)
+    for s in symbols:
+        if s in feed.states: continue
+        try:
+            cached = OHLCV_CACHE.get(s)
+            history = cached.data if cached is not None and len(cached) >= CONFIG.EMA_TREND_PERIOD else None
+            await feed.subscribe(s, history=history)
+        except Exception as e:
+            log.warning(f"Could not subscribe {s} to price feed: {e}")
+    states = await feed.sync(symbols)
     broadcast = app.bot_data.get('broadcast_func')
     
-    for i, trade in enumerate(active_trades):
+    for trade in active_trades:
         try:
-            ohlcv = ohlcv_results[i]
-            if not ohlcv: continue
-            
-            df = pd.DataFrame(ohlcv, columns=['timestamp', 'open', 'high', 'low', 'close', 'volume'])
-            current_price = df.iloc[-1]['close']
-            
+            st = states.get(trade['Pair'])
+            if st is None or st.last_price is None: continue
+            current_price = st.last_price
+
+            # MFE по внутрибарным экстремумам: закрытые с прошлого тика бары + формирующийся бар
+            bars = st.take_closed() + ([st.forming] if st.forming else [])
             if trade['Side'] == 'LONG':
-                trade['MFE_Price'] = max(trade.get('MFE_Price', current_price), current_price)
+                extreme = max([b[2] for b in bars] + [current_price])
+                trade['MFE_Price'] = max(trade.get('MFE_Price', extreme), extreme)
             else:
-                trade['MFE_Price'] = min(trade.get('MFE_Price', current_price), current_price)
+                extreme = min([b[3] for b in bars] + [current_price])
+                trade['MFE_Price'] = min(trade.get('MFE_Price', extreme), extreme)
 
             profit_pct = ((current_price - trade['Entry_Price']) / trade['Entry_Price'] * 100) if trade['Side'] == 'LONG' else ((trade['Entry_Price'] - current_price) / trade['Entry_Price'] * 100)
 
@@ -434,10 +600,6 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
                                f"<b>Новый SL:</b> <code>{format_price(new_sl)}</code>")
                         await broadcast(app, msg)
             
-            df_indicators = df.copy()
-            if len(df_indicators) < CONFIG.EMA_TREND_PERIOD: continue
-            df_indicators.ta.ema(length=CONFIG.EMA_FAST_PERIOD, append=True); df_indicators.ta.ema(length=CONFIG.EMA_SLOW_PERIOD, append=True)
-            last = df_indicators.iloc[-1]
             exit_reason = None
             
             # ИЗМЕНЕН ПОРЯДОК: Сначала жесткие выходы, потом мягкие
@@ -450,9 +612,9 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
                 elif current_price <= trade['TP_Price']: exit_reason = "TAKE_PROFIT"
             
             # 2. Проверка на инвалидацию по EMA
-            if not exit_reason:
-                ema_fast = last[f"EMA_{CONFIG.EMA_FAST_PERIOD}"]
-                ema_slow = last[f"EMA_{CONFIG.EMA_SLOW_PERIOD}"]
+            ema_fast = st.ema_fast.peek(current_price)
+            ema_slow = st.ema_slow.peek(current_price)
+            if not exit_reason and ema_fast is not None and ema_slow is not None:
                 if trade['Side'] == 'LONG' and ema_fast < ema_slow:
                     exit_reason = "INVALIDATION_EMA_CROSS"
                 elif trade['Side'] == 'SHORT' and ema_fast > ema_slow:
@@ -463,7 +625,7 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
                 try:
                     FMT = '%Y-%m-%d %H:%M:%S'
                     t_entry = datetime.strptime(trade['Timestamp_UTC'], FMT).replace(tzinfo=timezone.utc)
-                    time_in_trade = datetime.now(timezone.utc) - t_entry
+                    time_in_trade = clock.utcnow() - t_entry
                     
                     tp_diff = abs(trade['TP_Price'] - trade['Entry_Price'])
                     mfe_tp_pct = abs(trade['MFE_Price'] - trade['Entry_Price']) / tp_diff if tp_diff > 0 else 0
@@ -474,24 +636,24 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
                 except (ValueError, KeyError) as e:
                     log.warning(f"Could not calculate time_in_trade for {trade['Pair']}: {e}")
 
-            if exit_reason: trades_to_close.append((trade, exit_reason, df_indicators))
+            if exit_reason:
+                f = st.forming
+                atr_now = st.atr.peek(f[2], f[3], current_price) if f else st.atr.value
+                trades_to_close.append((trade, exit_reason, current_price, atr_now))
         except Exception as e:
             log.error(f"Error monitoring trade for {trade['Pair']}: {e}", exc_info=True)
     
     if trades_to_close:
-        for trade, reason, df_final in trades_to_close:
-            exit_price = df_final.iloc[-1]['close']
+        for trade, reason, exit_price, current_atr in trades_to_close:
             if reason == "TAKE_PROFIT":
                 pnl_display = trade['tp_pct'] * CONFIG.LEVERAGE
             else:
                 pnl_pct_raw = ((exit_price - trade['Entry_Price']) / trade['Entry_Price']) * (1 if trade['Side'] == "LONG" else -1)
                 pnl_display = pnl_pct_raw * 100 * CONFIG.LEVERAGE
             pnl_usd = CONFIG.POSITION_SIZE_USDT * pnl_display / 100
-            app.bot_data.setdefault("trade_cooldown", {})[trade['Pair']] = time.time()
+            app.bot_data.setdefault("trade_cooldown", {})[trade['Pair']] = clock.now()
             mfe_atr, mfe_tp_pct = 0, 0
-            df_final.ta.atr(length=CONFIG.ATR_PERIOD, append=True)
-            atr_col = next((c for c in df_final.columns if c.startswith("ATR")), None)
-            current_atr = df_final[atr_col].iloc[-1] if atr_col and not pd.isna(df_final[atr_col].iloc[-1]) else trade.get("ATR_Entry")
+            if not current_atr: current_atr = trade.get("ATR_Entry")
             if current_atr and current_atr > 0: mfe_atr = abs(trade['MFE_Price'] - trade['Entry_Price']) / current_atr
             tp_diff = abs(trade['TP_Price'] - trade['Entry_Price'])
             if tp_diff > 0: mfe_tp_pct = abs(trade['MFE_Price'] - trade['Entry_Price']) / tp_diff
@@ -500,7 +662,7 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
             try:
                 FMT = '%Y-%m-%d %H:%M:%S'
                 t_entry = datetime.strptime(trade['Timestamp_UTC'], FMT).replace(tzinfo=timezone.utc)
-                t_exit = datetime.now(timezone.utc)
+                t_exit = clock.utcnow()
                 time_in_trade = t_exit - t_entry
                 days = time_in_trade.days
                 hours, remainder = divmod(time_in_trade.seconds, 3600)
@@ -519,10 +681,24 @@ async def monitor_active_trades(exchange: ccxt.Exchange, app: Application):
                 msg = (f"{emoji} <b>СДЕЛКА ЗАКРЫТА ({reason})</b>\n\n"f"<b>Пара:</b> {trade['Pair']}\n"f"<b>Выход:</b> <code>{format_price(exit_price)}</code>\n"f"<b>Результат: ${pnl_usd:+.2f} ({pnl_display:+.2f}%)</b>\n"f"<i>{mfe_info}</i>")
                 await broadcast(app, msg)
             await trade_executor.update_closed_trade(trade['Signal_ID'], "CLOSED", exit_price, pnl_usd, pnl_display, reason, extra_fields=extra_fields)
-        closed_ids = {t['Signal_ID'] for t, _, _ in trades_to_close}
+        closed_ids = {t['Signal_ID'] for t, _, _, _ in trades_to_close}
         bot_data["active_trades"] = [t for t in active_trades if t['Signal_ID'] not in closed_ids]
 
+# Подмена биржи для replay/бенчмарков: callable без аргументов -> объект с API ccxt.
+EXCHANGE_FACTORY = None
+
+def make_exchange():
+    if EXCHANGE_FACTORY is not None:
+        return EXCHANGE_FACTORY()
+    exchange = ccxt.mexc({'options': {'defaultType': 'swap'}, 'enableRateLimit': True, 'rateLimit': 200})
+    record_path = os.getenv("RECORD_EXCHANGE")
+    if record_path:
+        import replay
+        exchange = replay.RecordingExchange(exchange, record_path)
+    return exchange
+
 async def scanner_main_loop(app: Application, broadcast):
+    global ML_SCORER
     log.info("Scanner Engine loop starting…")
     app.bot_data.setdefault("active_trades", [])
     app.bot_data.setdefault("trade_cooldown", {})
@@ -532,43 +708,72 @@ async def scanner_main_loop(app: Application, broadcast):
     try:
         creds_json = os.environ.get("GOOGLE_CREDENTIALS")
         sheet_key = os.environ.get("SHEET_ID")
-        if not creds_json or not sheet_key:
-            log.critical("GOOGLE_CREDENTIALS or SHEET_ID environment variables not set. Cannot start.")
-            return
-        creds_dict = json.loads(creds_json)
-        gc = gspread.service_account_from_dict(creds_dict)
-        sheet = gc.open_by_key(sheet_key)
-        await ensure_new_log_sheet(sheet)
-        trade_executor.get_headers(trade_executor.TRADE_LOG_WS)
-        log.info("Google Sheets initialized successfully.")
+        if trade_executor.TRADE_LOG_WS is not None:
+            log.info("Trade log worksheet already provided; skipping Google Sheets init.")
+        else:
+            if not creds_json or not sheet_key:
+                log.critical("GOOGLE_CREDENTIALS or SHEET_ID environment variables not set. Cannot start.")
+                return
+            creds_dict = json.loads(creds_json)
+            gc = gspread.service_account_from_dict(creds_dict)
+            sheet = gc.open_by_key(sheet_key)
+            await ensure_new_log_sheet(sheet)
+            trade_executor.get_headers(trade_executor.TRADE_LOG_WS)
+            log.info("Google Sheets initialized successfully.")
     except Exception as e:
         log.critical(f"Could not initialize Google Sheets during startup: {e}", exc_info=True)
         return
-    exchange = ccxt.mexc({'options': {'defaultType': 'swap'}, 'enableRateLimit': True, 'rateLimit': 200})
-    last_scan_time = 0
-    last_flush_time = 0
-    while app.bot_data.get("bot_on", False):
-        try:
-            current_time = time.time()
-            if not app.bot_data.get("scan_paused", False):
-                if current_time - last_scan_time >= CONFIG.SCANNER_INTERVAL_SECONDS:
-                    log.info(f"--- Running Market Scan (every {CONFIG.SCANNER_INTERVAL_SECONDS // 60} mins) ---")
-                    await find_trade_signals(exchange, app)
-                    last_scan_time = current_time
-                    log.info("--- Scan Finished ---")
-            else:
-                last_scan_time = 0
-            await monitor_active_trades(exchange, app)
-            if len(trade_executor.PENDING_TRADES) >= 20 or \
-               (current_time - last_flush_time >= 15 and trade_executor.PENDING_TRADES):
-                await trade_executor.flush_log_buffers()
-                last_flush_time = current_time
-            await asyncio.sleep(CONFIG.TICK_MONITOR_INTERVAL_SECONDS)
-        except asyncio.CancelledError:
-            log.info("Main loop cancelled."); break
-        except Exception as e:
-            log.error(f"Error in main loop: {e}", exc_info=True)
-            await asyncio.sleep(30)
-    await trade_executor.flush_log_buffers()
-    await exchange.close()
+    exchange = make_exchange()
+    try:
+        await market_cache.load_markets_cached(exchange)
+    except Exception as e:
+        log.critical(f"Could not load markets: {e}", exc_info=True)
+        await exchange.close()
+        return
+    feed = make_price_feed(exchange)
+    if CONFIG.ML_MODEL_FILE and ML_SCORER is None:
+        ML_SCORER = inference.load_scorer(CONFIG.ML_MODEL_FILE)
+    workers = []
+    try:
+        if CONFIG.SCAN_SHARDS > 1 and CONFIG.SCAN_LOCAL_WORKERS:
+            workers = await shard.spawn_workers(CONFIG.SCAN_SHARDS)
+        next_scan_at = 0.0
+        last_flush_time = 0
+        while app.bot_data.get("bot_on", False):
+            try:
+                current_time = clock.now()
+                market_cache.refresh_if_stale(exchange)
+                if workers:
+                    await shard.reap_workers(workers)
+                if not app.bot_data.get("scan_paused", False):
+                    if current_time >= next_scan_at:
+                        log.info(f"--- Running Market Scan ({CONFIG.TIMEFRAME} bar close) ---")
+                        pending = await find_trade_signals(exchange, app)
+                        log.info("--- Scan Finished ---")
+                        next_scan_at = next_bar_close_time(clock.now())
+                        bar_open = next_scan_at - CONFIG.SCAN_BAR_CLOSE_DELAY_SEC - tf_seconds(CONFIG.TIMEFRAME)
+                        if pending and clock.now() - bar_open < CONFIG.SCAN_RETRY_WINDOW_SEC:
+                            log.info(f"{pending} pairs have no closed bar yet; retrying in {CONFIG.SCAN_RETRY_SEC}s.")
+                            next_scan_at = clock.now() + CONFIG.SCAN_RETRY_SEC
+                else:
+                    next_scan_at = 0.0
+                await monitor_active_trades(exchange, app, feed)
+                if len(trade_executor.PENDING_TRADES) >= 20 or \
+                   (current_time - last_flush_time >= 15 and trade_executor.PENDING_TRADES):
+                    await trade_executor.flush_log_buffers()
+                    last_flush_time = current_time
+                wait = CONFIG.TICK_MONITOR_INTERVAL_SECONDS
+                if not app.bot_data.get("scan_paused", False):
+                    wait = min(wait, max(0.5, next_scan_at - clock.now()))
+                await clock.sleep(wait)
+            except asyncio.CancelledError:
+                log.info("Main loop cancelled."); break
+            except Exception as e:
+                log.error(f"Error in main loop: {e}", exc_info=True)
+                await clock.sleep(30)
+    finally:
+        await shard.stop_workers(workers)
+        await trade_executor.flush_log_buffers()
+        await feed.close()
+        await exchange.close()
     log.info("Scanner Engine loop stopped.")
@@ -0,0 +1,264 @@
+# shadow.py
+# Теневые варианты BMR-DCA: N наборов параметров ведут бумажные позиции на том же потоке
+# цены/индикаторов, что и живой цикл. Состояние — массивы (K,), шаг цикла — O(1) numpy-операций.
+from __future__ import annotations
+
+import itertools
+
+import numpy as np
+
+import scanner_bmr_dca as bmr
+import tick_math
+from scanner_bmr_dca import CONFIG
+
+TRAILING_PRESETS = {
+    "base":  list(CONFIG.TRAILING_STAGES),
+    "tight": [(0.25, 0.15), (0.50, 0.40), (0.75, 0.65)],
+    "loose": [(0.50, 0.30), (0.80, 0.60)],
+}
+
+
+def variant_name(v: dict) -> str:
+    g = "auto" if v["growth"] is None else f"{v['growth']:g}"
+    tac = "/".join(str(int(round(p * 100))) for p in v["tactical_pcts"])
+    return f"tp{v['tp_pct']*100:.2f} g{g} tac{tac} tr:{v['trailing']}"
+
+
+def default_grid() -> list[dict]:
+    """Сетка TP_PCT × DCA_GROWTH × TACTICAL_PCTS × TRAILING_STAGES; первый вариант — живой CONFIG."""
+    live = {"tp_pct": CONFIG.TP_PCT, "growth": None,
+            "tactical_pcts": tuple(CONFIG.TACTICAL_PCTS), "trailing": "base"}
+    grid = [live]
+    for tp, g, tac, tr in itertools.product(
+            (0.006, 0.008, 0.010, 0.012, 0.015),
+            (None, 1.6, 2.0, 2.5),
+            (tuple(CONFIG.TACTICAL_PCTS), (0.30, 0.60), (0.50, 1.00)),
+            tuple(TRAILING_PRESETS)):
+        v = {"tp_pct": tp, "growth": g, "tactical_pcts": tac, "trailing": tr}
+        if v != live:
+            grid.append(v)
+    return grid
+
+
+def _group(values: list) -> tuple[list, np.ndarray]:
+    uniq, ids = [], []
+    for v in values:
+        if v not in uniq:
+            uniq.append(v)
+        ids.append(uniq.index(v))
+    return uniq, np.array(ids, dtype=np.int64)
+
+
+class ShadowBook:
+    """Бумажные позиции K вариантов. side: +1 LONG, -1 SHORT, 0 — нет позиции."""
+
+    def __init__(self, variants: list[dict], leverage: int | None = None):
+        self.variants = [dict(v, tactical_pcts=tuple(v["tactical_pcts"])) for v in variants]
+        self.names = [variant_name(v) for v in self.variants]
+        self.signature = tuple(self.names)
+        k = len(self.variants)
+        self.levels = CONFIG.DCA_LEVELS
+        self.leverage = leverage or CONFIG.LEVERAGE
+
+        self.tp = np.array([v["tp_pct"] for v in self.variants], dtype=np.float64)
+        stages = [TRAILING_PRESETS[v["trailing"]] for v in self.variants]
+        n_st = max(1, max(len(s) for s in stages))
+        self.arm = np.full((k, n_st), np.inf)
+        self.lock = np.zeros((k, n_st))
+        for i, st in enumerate(stages):
+            for j, (arm, lock) in enumerate(st):
+                self.arm[i, j], self.lock[i, j] = arm, lock
+        self.growth_vals, self.growth_gid = _group([v["growth"] for v in self.variants])
+        self.tac_vals, self.tac_gid = _group([v["tactical_pcts"] for v in self.variants])
+        n_targets = max(len(t) for t in self.tac_vals) + len(CONFIG.STRATEGIC_PCTS)
+
+        self.side = np.zeros(k, dtype=np.int8)
+        self.steps = np.zeros(k, dtype=np.int64)
+        self.max_steps = np.zeros(k, dtype=np.int64)
+        self.reserved = np.zeros(k, dtype=bool)
+        self.trail = np.full(k, -1, dtype=np.int64)
+        self.qty = np.zeros(k)
+        self.avg = np.zeros(k)
+        self.cum_margin = np.zeros(k)
+        self.sl = np.full(k, np.nan)
+        self.brk_up = np.full(k, np.inf)
+        self.brk_dn = np.full(k, -np.inf)
+        self.margins = np.zeros((k, self.levels))
+        self.targets = np.full((k, n_targets), np.nan)
+
+        self.realized = np.zeros(k)
+        self.trades = np.zeros(k, dtype=np.int64)
+        self.wins = np.zeros(k, dtype=np.int64)
+        self.worst_upnl = np.zeros(k)
+        self.ticks = 0
+        self.last_px = None
+        self.started_at = None
+
+    def __len__(self):
+        return len(self.variants)
+
+    # --- переходы состояния ---
+    def _open(self, rows: np.ndarray, side: int, px: float, ind: dict,
+              rng_strat: dict, rng_tac: dict, tick: float, bank: float):
+        side_s = "LONG" if side > 0 else "SHORT"
+        total = bank * CONFIG.CUM_DEPOSIT_FRAC_AT_FULL
+        auto_growth = bmr.choose_growth(ind, rng_strat, rng_tac)
+        for g, growth in enumerate(self.growth_vals):
+            sel = rows[self.growth_gid[rows] == g]
+            if len(sel):
+                self.margins[sel] = bmr.plan_margins_bank_first(total, self.levels, growth or auto_growth)
+        strs = bmr.compute_pct_targets_ticks(px, side_s, rng_strat, tick, CONFIG.STRATEGIC_PCTS)
+        for g, pcts in enumerate(self.tac_vals):
+            sel = rows[self.tac_gid[rows] == g]
+            if not len(sel):
+                continue
+            tacs = bmr.compute_pct_targets_ticks(px, side_s, rng_tac, tick, list(pcts))
+            prices = tick_math.grid(tick).to_price(bmr.merge_target_ticks(side_s, tacs, strs))
+            self.targets[sel] = np.nan
+            self.targets[sel, :len(prices)] = prices
+        brk_up, brk_dn = bmr.break_levels(rng_strat)
+        self.side[rows] = side
+        self.steps[rows] = 0
+        self.qty[rows] = self.avg[rows] = self.cum_margin[rows] = 0.0
+        self.max_steps[rows] = min(6, self.levels)
+        self.reserved[rows] = False
+        self.trail[rows] = -1
+        self.sl[rows] = np.nan
+        self.brk_up[rows], self.brk_dn[rows] = brk_up, brk_dn
+        mask = np.zeros(len(self.side), dtype=bool)
+        mask[rows] = True
+        self._add(mask, px)
+
+    def _add(self, mask: np.ndarray, px: float):
+        if not mask.any():
+            return
+        rows = np.flatnonzero(mask)
+        margin = self.margins[rows, self.steps[rows]]
+        new_qty = margin * self.leverage / max(px, 1e-9)
+        qty = self.qty[rows]
+        self.avg[rows] = (self.avg[rows] * qty + px * new_qty) / np.maximum(qty + new_qty, 1e-9)
+        self.qty[rows] = qty + new_qty
+        self.cum_margin[rows] += margin
+        self.steps[rows] += 1
+
+    def on_tick(self, px: float, ind: dict, rng_strat: dict, rng_tac: dict, tick: float,
+                bank: float, fee_taker: float, fee_maker: float, entries_allowed: bool = True,
+                now: float | None = None):
+        """Один шаг всех вариантов по той же цене/индикаторам, что видел живой цикл."""
+        self.ticks += 1
+        self.last_px = px
+        if self.started_at is None:
+            self.started_at = now
+        side = self.side
+        active = side != 0
+
+        # пробой коридора: обычные доборы заморожены, один резерв на ретест
+        brk = active & ~self.reserved & ((px >= self.brk_up) | (px <= self.brk_dn))
+        if brk.any():
+            self.max_steps[brk] = np.minimum(self.steps[brk] + 1, self.levels)
+            self.reserved |= brk
+
+        if entries_allowed and not active.all():
+            pos_in = max(0.0, min(1.0, (px - rng_tac["lower"]) / max(rng_tac["width"], 1e-9)))
+            cand = 1 if pos_in <= 0.30 else (-1 if pos_in >= 0.70 else 0)
+            if cand:
+                self._open(np.flatnonzero(~active), cand, px, ind, rng_strat, rng_tac, tick, bank)
+                active = side != 0
+
+        # обычные доборы по лесенке (в manage_only, как и у живой позиции, доборов нет)
+        can_add = active & (self.steps < self.max_steps) & entries_allowed
+        idx = self.steps - 1
+        in_ladder = (idx >= 0) & (idx < self.targets.shape[1])
+        trig = np.where(in_ladder, self.targets[np.arange(len(side)), np.clip(idx, 0, self.targets.shape[1] - 1)], np.nan)
+        with np.errstate(invalid="ignore"):
+            hit = can_add & ~self.reserved & in_ladder & (side * (trig - px) >= 0)
+        self._add(hit, px)
+
+        # резервный добор на ретесте
+        res = can_add & self.reserved
+        if res.any():
+            back_long = px >= rng_strat["lower"] * (1 + CONFIG.REENTRY_BAND)
+            back_short = px <= rng_strat["upper"] * (1 - CONFIG.REENTRY_BAND)
+            rev_long = bmr.trend_reversal_confirmed("LONG", ind)
+            rev_short = bmr.trend_reversal_confirmed("SHORT", ind)
+            ok = np.where(side > 0, back_long and rev_long, back_short and rev_short)
+            retest = res & ok
+            self._add(retest, px)
+            self.max_steps[retest] = self.steps[retest]
+
+        # трейлинг-стоп по стадиям
+        avg = np.where(active, self.avg, 1.0)
+        gain = np.maximum(0.0, np.where(side > 0, px / avg - 1.0, avg / max(px, 1e-9) - 1.0)) / self.tp
+        chand = px - side * 3.0 * ind["atr5m"]
+        for s in range(self.arm.shape[1]):
+            armed = active & (gain >= self.arm[:, s])
+            if not armed.any():
+                break
+            cand = armed & (self.trail < s)
+            locked = avg * (1 + side * self.lock[:, s] * self.tp)
+            new_sl = np.where(side > 0, np.maximum(locked, chand), np.minimum(locked, chand))
+            new_sl = tick_math.grid(tick).snap(new_sl)
+            with np.errstate(invalid="ignore"):
+                improves = np.isnan(self.sl) | (side * (new_sl - self.sl) > 0)
+            upd = cand & improves
+            self.sl[upd] = new_sl[upd]
+            self.trail[upd] = s
+
+        # выходы
+        tp_price = avg * (1 + side * self.tp)
+        with np.errstate(invalid="ignore"):
+            tp_hit = active & (side * (px - tp_price) >= 0)
+            sl_hit = active & ~tp_hit & ~np.isnan(self.sl) & (side * (self.sl - px) >= 0)
+        notional = self.cum_margin * self.leverage
+        upnl = np.where(active, notional * (px / avg - 1.0) * side, 0.0)
+        np.minimum(self.worst_upnl, upnl, out=self.worst_upnl)
+        closed = tp_hit | sl_hit
+        if closed.any():
+            exit_p = np.where(tp_hit, tp_price, self.sl)
+            gross = notional * (exit_p / avg - 1.0) * side
+            net = gross - notional * fee_taker - exit_p * self.qty * fee_maker
+            self.realized[closed] += net[closed]
+            self.trades[closed] += 1
+            self.wins[closed & (net > 0)] += 1
+            self.side[closed] = 0
+            self.qty[closed] = self.avg[closed] = self.cum_margin[closed] = 0.0
+            self.sl[closed] = np.nan
+
+    # --- отчёт ---
+    def unrealized(self, px: float | None = None) -> np.ndarray:
+        px = self.last_px if px is None else px
+        if px is None:
+            return np.zeros(len(self.side))
+        active = self.side != 0
+        avg = np.where(active, self.avg, 1.0)
+        return np.where(active, self.cum_margin * self.leverage * (px / avg - 1.0) * self.side, 0.0)
+
+    def report(self, top: int = 10) -> list[dict]:
+        upnl = self.unrealized()
+        total = self.realized + upnl
+        order = np.argsort(-total, kind="stable")[:top]
+        rows = []
+        for i in order:
+            rows.append({
+                "rank": len(rows) + 1, "name": self.names[i], "live": i == 0,
+                "realized": float(self.realized[i]), "unrealized": float(upnl[i]),
+                "trades": int(self.trades[i]), "wins": int(self.wins[i]),
+                "worst_upnl": float(self.worst_upnl[i]),
+                "open": "LONG" if self.side[i] > 0 else ("SHORT" if self.side[i] < 0 else ""),
+                "steps": int(self.steps[i]),
+            })
+        return rows
+
+
+def format_report(book: ShadowBook, top: int = 10) -> str:
+    """Таблица для /shadow (моноширинный блок). Живой CONFIG помечен звёздочкой."""
+    rows = book.report(top)
+    live = next((r for r in book.report(len(book)) if r["live"]), None)
+    lines = [f"{'#':>3} {'PnL':>8} {'откр.':>8} {'сд.':>4} {'win':>4} {'просад.':>8}  вариант"]
+    for r in rows + ([live] if live and live not in rows else []):
+        wr = f"{r['wins'] / r['trades'] * 100:.0f}%" if r["trades"] else "-"
+        pos = f"{r['unrealized']:+.1f}" if r["open"] else "-"
+        mark = "*" if r["live"] else " "
+        lines.append(f"{r['rank'] if r in rows else '…':>3}{mark}{r['realized']:>+8.1f} {pos:>8} "
+                     f"{r['trades']:>4} {wr:>4} {r['worst_upnl']:>8.1f}  {r['name']}")
+    return "\n".join(lines)
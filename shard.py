@@ -0,0 +1,294 @@
+# shard.py
+# Шардированный скан swing-сканера. Координатор (scanner_engine.find_trade_signals) делит вселенную
+# пар на K шардов по crc32(symbol) % K и публикует их как лизы в SQLite; воркеры (процессы этой машины
+# или контейнеры с общим томом) забирают лизы, грузят свечи и проверяют условия входа только по своему
+# шарду и пишут кандидатов обратно. Координатор сливает списки и дальше ранжирует как обычно.
+# В лизе вместе с парами — какие из них засевать историей (их ещё нет в CORR координатора).
+# Шард, который никто не взял за CLAIM_WAIT_SEC (или чей лиз истёк), координатор считает сам.
+#
+#   python shard.py worker --index 0            # воркер, предпочитающий шард 0
+#   python shard.py worker --db /shared/scan.db # контейнер: общий файл БД
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import time
+import zlib
+from typing import Awaitable, Callable, Collection, List, Optional
+
+log = logging.getLogger("shard")
+
+SCAN_DB = os.getenv("SCAN_SHARD_DB", os.path.join("data", "scan_shards.db"))
+LEASE_SEC = 120          # лиз без результата дольше — воркер считается упавшим, шард переназначается
+CLAIM_WAIT_SEC = 5.0     # сколько координатор ждёт, пока шард возьмёт воркер
+STEAL_AFTER_SEC = 1.0    # воркер с --index берёт чужой шард, только если его хозяин не успел за это время
+SCAN_TIMEOUT_SEC = 180
+POLL_SEC = 0.2
+KEEP_SCANS = 50
+RESPAWN_SEC = 10.0       # не чаще одного перезапуска упавшего локального воркера за это время
+WORKER_FORGET_SEC = 3600 # воркер забывает пары, которых не было в его лизах дольше этого
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scans (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    expected_bar INTEGER NOT NULL,
+    shards INTEGER NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS leases (
+    scan_id INTEGER NOT NULL,
+    shard INTEGER NOT NULL,
+    symbols TEXT NOT NULL,
+    seed TEXT NOT NULL DEFAULT '[]',
+    owner TEXT,
+    expires REAL,
+    done INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    PRIMARY KEY (scan_id, shard)
+);
+"""
+
+
+def shard_of(symbol: str, shards: int) -> int:
+    """Стабильное назначение (не зависит от PYTHONHASHSEED и процесса)."""
+    return zlib.crc32(symbol.encode()) % shards
+
+
+def split(symbols: List[str], shards: int) -> List[List[str]]:
+    parts = [[] for _ in range(shards)]
+    for s in symbols:
+        parts[shard_of(s, shards)].append(s)
+    return parts
+
+
+def owner_id(index: Optional[int] = None, pid: Optional[int] = None) -> str:
+    return f"{socket.gethostname()}:{pid or os.getpid()}" + (f"#{index}" if index is not None else "")
+
+
+class LeaseStore:
+    def __init__(self, path: str = SCAN_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA busy_timeout=30000")
+        self.db.executescript(SCHEMA)
+        if "seed" not in {r[1] for r in self.db.execute("PRAGMA table_info(leases)")}:
+            self.db.execute("ALTER TABLE leases ADD COLUMN seed TEXT NOT NULL DEFAULT '[]'")   # БД до засева
+
+    def close(self):
+        self.db.close()
+
+    def post(self, parts: List[List[str]], expected_bar: int, seed: Collection[str] = ()) -> int:
+        db = self.db
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            scan_id = db.execute("INSERT INTO scans (expected_bar, shards, created) VALUES (?, ?, ?)",
+                                 (expected_bar, len(parts), time.time())).lastrowid
+            db.executemany("INSERT INTO leases (scan_id, shard, symbols, seed) VALUES (?, ?, ?, ?)",
+                           [(scan_id, i, json.dumps(p), json.dumps([s for s in p if s in seed]))
+                            for i, p in enumerate(parts)])
+            db.execute("DELETE FROM leases WHERE scan_id <= ?", (scan_id - KEEP_SCANS,))
+            db.execute("DELETE FROM scans WHERE id <= ?", (scan_id - KEEP_SCANS,))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        return scan_id
+
+    def claim(self, owner: str, prefer: Optional[int] = None, scan_id: Optional[int] = None) -> Optional[dict]:
+        """Забирает свободный (или просроченный) шард: сначала свежие сканы, в них — шард prefer."""
+        db, now = self.db, time.time()
+        pref = -1 if prefer is None else prefer
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            row = db.execute(
+                "SELECT l.scan_id, l.shard, l.symbols, s.expected_bar, l.seed FROM leases l JOIN scans s ON s.id = l.scan_id "
+                "WHERE l.done = 0 AND (l.owner IS NULL OR l.expires < ?) AND (? IS NULL OR l.scan_id = ?) "
+                "AND s.created > ? AND (? < 0 OR l.shard = ? OR s.created < ?) "
+                "ORDER BY l.scan_id DESC, (l.shard = ?) DESC, l.shard LIMIT 1",
+                (now, scan_id, scan_id, now - SCAN_TIMEOUT_SEC, pref, pref, now - STEAL_AFTER_SEC, pref)).fetchone()
+            if row is not None:
+                db.execute("UPDATE leases SET owner = ?, expires = ? WHERE scan_id = ? AND shard = ?",
+                           (owner, now + LEASE_SEC, row[0], row[1]))
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        if row is None:
+            return None
+        return {"scan_id": row[0], "shard": row[1], "symbols": json.loads(row[2]), "expected_bar": row[3],
+                "seed": json.loads(row[4])}
+
+    def complete(self, scan_id: int, shard: int, owner: str, result: dict) -> bool:
+        """Результат принимается только от текущего держателя лиза."""
+        cur = self.db.execute("UPDATE leases SET done = 1, result = ? WHERE scan_id = ? AND shard = ? "
+                              "AND owner = ? AND done = 0", (json.dumps(result), scan_id, shard, owner))
+        return cur.rowcount == 1
+
+    def release(self, owner: str) -> int:
+        """Освобождает незавершённые лизы владельца (упавший воркер) — их сразу можно забрать снова."""
+        cur = self.db.execute("UPDATE leases SET owner = NULL, expires = NULL WHERE owner = ? AND done = 0", (owner,))
+        return cur.rowcount
+
+    def status(self, scan_id: int) -> List[tuple]:
+        return self.db.execute("SELECT shard, owner, done, result FROM leases WHERE scan_id = ? ORDER BY shard",
+                               (scan_id,)).fetchall()
+
+
+_STORE: Optional[LeaseStore] = None
+
+
+def store() -> LeaseStore:
+    global _STORE
+    if _STORE is None:
+        _STORE = LeaseStore()
+    return _STORE
+
+
+def merge(results: List[dict]) -> dict:
+    out = {"candidates": [], "pending": 0, "returns": {}}
+    for r in results:
+        out["candidates"] += r["candidates"]
+        out["pending"] += r["pending"]
+        out["returns"].update(r["returns"])
+    return out
+
+
+async def scan(evaluate_local: Callable[[List[str], List[str]], Awaitable[dict]], symbols: List[str], shards: int,
+               expected_bar: int, seed: Collection[str] = ()) -> dict:
+    """Координатор: публикует шарды, ждёт воркеров, недобранные шарды считает сам, сливает результаты.
+    evaluate_local(symbols, seed) — оценка шарда в этом процессе."""
+    st = store()
+    t0 = time.monotonic()
+    scan_id = await asyncio.to_thread(st.post, split(symbols, shards), expected_bar, set(seed))
+    me = owner_id()
+    local = 0
+    while True:
+        rows = await asyncio.to_thread(st.status, scan_id)
+        if all(done for _, _, done, _ in rows):
+            break
+        waited = time.monotonic() - t0
+        if waited > SCAN_TIMEOUT_SEC:
+            log.error(f"Scan {scan_id}: timed out, {sum(1 for r in rows if not r[2])} shard(s) missing.")
+            break
+        if _LOCAL:
+            await reap_workers(_LOCAL)
+        job = await asyncio.to_thread(st.claim, me, None, scan_id) if waited >= CLAIM_WAIT_SEC else None
+        if job is None:
+            await asyncio.sleep(POLL_SEC)
+            continue
+        log.warning(f"Scan {scan_id}: shard {job['shard']} not taken by a worker; evaluating locally.")
+        result = await evaluate_local(job["symbols"], job["seed"])
+        await asyncio.to_thread(st.complete, scan_id, job["shard"], me, result)
+        local += 1
+    results = [json.loads(r[3]) for r in rows if r[2] and r[3]]
+    merged = merge(results)
+    log.info(f"Scan {scan_id}: {len(results)}/{shards} shards ({local} local) in {time.monotonic() - t0:.2f}s, "
+             f"{len(merged['candidates'])} candidates.")
+    return merged
+
+
+# ---------------------------------------------------------------------------
+# Воркер
+# ---------------------------------------------------------------------------
+async def run_worker(index: Optional[int] = None, db: str = SCAN_DB):
+    import market_cache
+    import scanner_engine as se
+    import inference
+
+    st = LeaseStore(db)
+    me = owner_id(index)
+    exchange = se.make_exchange()
+    await market_cache.load_markets_cached(exchange)
+    if se.CONFIG.ML_MODEL_FILE:
+        se.ML_SCORER = inference.load_scorer(se.CONFIG.ML_MODEL_FILE)
+    log.info(f"Shard worker {me} ready (db {db}).")
+    seen = {}     # пара -> когда последний раз была в лизе этого воркера
+    try:
+        while True:
+            job = await asyncio.to_thread(st.claim, me, index)
+            if job is None:
+                await asyncio.sleep(POLL_SEC)
+                continue
+            t0 = time.monotonic()
+            seen.update(dict.fromkeys(job["symbols"], t0))
+            seen = {s: t for s, t in seen.items() if t0 - t < WORKER_FORGET_SEC}
+            se.prune_state(set(seen))
+            result = await se.evaluate_pairs(exchange, job["symbols"], job["expected_bar"], seed=job["seed"])
+            ok = await asyncio.to_thread(st.complete, job["scan_id"], job["shard"], me, result)
+            log.info(f"Scan {job['scan_id']} shard {job['shard']}: {len(job['symbols'])} pairs, "
+                     f"{len(result['candidates'])} candidates in {time.monotonic() - t0:.2f}s"
+                     + ("" if ok else " (lease lost, result dropped)"))
+    finally:
+        await exchange.close()
+        st.close()
+
+
+_LOCAL: List[asyncio.subprocess.Process] = []     # локальные воркеры этого процесса (scan() их проверяет)
+_RESPAWNED_AT: dict = {}
+
+
+async def spawn_worker(index: int, db: str = SCAN_DB) -> asyncio.subprocess.Process:
+    script = os.path.abspath(__file__)
+    return await asyncio.create_subprocess_exec(sys.executable, script, "worker", "--index", str(index), "--db", db)
+
+
+async def spawn_workers(shards: int, db: str = SCAN_DB) -> List[asyncio.subprocess.Process]:
+    """Локальный режим: по воркеру на шард, процессы этой машины."""
+    procs = [await spawn_worker(i, db) for i in range(shards)]
+    log.info(f"Started {len(procs)} local shard workers.")
+    _LOCAL[:] = procs
+    return _LOCAL
+
+
+async def reap_workers(procs: List[asyncio.subprocess.Process], db: str = SCAN_DB,
+                       lease_store: Optional[LeaseStore] = None):
+    """Находит завершившиеся локальные воркеры (procs — по индексу шарда): освобождает их лизы,
+    чтобы шард сразу забрали другие, и перезапускает воркер на месте в списке."""
+    for i, p in enumerate(procs):
+        if p.returncode is None:
+            continue
+        st = lease_store or store()
+        freed = await asyncio.to_thread(st.release, owner_id(i, p.pid))
+        if time.monotonic() - _RESPAWNED_AT.get(i, -RESPAWN_SEC) < RESPAWN_SEC:
+            continue
+        log.error(f"Shard worker #{i} (pid {p.pid}) exited with code {p.returncode}; "
+                  f"released {freed} lease(s), restarting.")
+        _RESPAWNED_AT[i] = time.monotonic()
+        procs[i] = await spawn_worker(i, db)
+
+
+async def stop_workers(procs: List[asyncio.subprocess.Process]):
+    stopping = list(procs)
+    procs.clear()
+    for p in stopping:
+        if p.returncode is None:
+            p.terminate()
+    for p in stopping:
+        try:
+            await asyncio.wait_for(p.wait(), 10)
+        except asyncio.TimeoutError:
+            p.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded scan worker.")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    w = sub.add_parser("worker")
+    w.add_argument("--index", type=int, default=None, help="preferred shard")
+    w.add_argument("--db", default=SCAN_DB)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(run_worker(args.index, args.db))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# snapshot_utils.py
+import os
+import pickle
+import logging
+
+import clock
+
+log = logging.getLogger("bot")
+
+SNAPSHOT_FILE = os.getenv("BMR_SNAPSHOT_FILE", "bmr_snapshot.pkl")
+SNAPSHOT_VERSION = 1
+
+
+def save_snapshot(state: dict, path: str | None = None) -> int:
+    """Атомарно пишет бинарный снапшот (pickle) состояния цикла. Возвращает размер в байтах."""
+    path = path or SNAPSHOT_FILE
+    payload = dict(state, version=SNAPSHOT_VERSION, saved_at=clock.now())
+    blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(blob)
+    os.replace(tmp, path)
+    return len(blob)
+
+
+def load_snapshot(symbol: str, max_age_sec: float, path: str | None = None) -> dict | None:
+    """Читает снапшот, если он для того же символа и не старше max_age_sec."""
+    path = path or SNAPSHOT_FILE
+    try:
+        with open(path, "rb") as f:
+            payload = pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        log.error(f"Не удалось прочитать снапшот {path}: {e}")
+        return None
+    if not isinstance(payload, dict) or payload.get("version") != SNAPSHOT_VERSION:
+        return None
+    if payload.get("symbol") != symbol:
+        log.info(f"Снапшот для {payload.get('symbol')}, текущий символ {symbol} — пропускаю.")
+        return None
+    age = clock.now() - payload.get("saved_at", 0)
+    if age > max_age_sec:
+        log.info(f"Снапшот устарел ({age/60:.0f} мин) — пропускаю.")
+        return None
+    return payload
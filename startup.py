@@ -0,0 +1,86 @@
+# startup.py
+# Быстрый старт бота: тяжёлые модули (pandas, ccxt, gspread...) импортируются лениво или в фоне,
+# фазы запуска (импорт, Sheets, рынки, диапазоны) замеряются и сводятся в один отчёт.
+import asyncio
+import importlib
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+log = logging.getLogger("startup")
+
+
+class LazyModule:
+    """Импортирует модуль при первом обращении к атрибуту.
+    Обращение синхронное: пока preload() импортирует модуль в потоке, оно ждёт блокировку импорта
+    и останавливает event loop. Из loop до первого обращения — await load()."""
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+    @property
+    def loaded(self) -> bool:
+        """Импорт завершён (модуль в sys.modules появляется уже в начале импорта)."""
+        mod = sys.modules.get(self._name)
+        return mod is not None and not getattr(getattr(mod, "__spec__", None), "_initializing", False)
+
+    async def load(self):
+        """Дожидается импорта (своего или идущего в preload) в рабочем потоке, не блокируя loop."""
+        if not self.loaded:
+            await asyncio.to_thread(importlib.import_module, self._name)
+
+
+async def preload(*names: str):
+    """Импорт модулей в рабочем потоке, чтобы loop продолжал отвечать на команды."""
+    for name in names:
+        if name not in sys.modules:
+            await asyncio.to_thread(importlib.import_module, name)
+
+
+class StartupTimer:
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = t0 if t0 is not None else time.perf_counter()
+        self.phases: Dict[str, Tuple[float, float]] = {}
+        self.finished = False
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if not self.finished:
+                self.phases[name] = (start - self.t0, time.perf_counter() - self.t0)
+
+    def mark(self, name: str):
+        """Момент без длительности (например, «бот отвечает на команды»)."""
+        if not self.finished:
+            at = time.perf_counter() - self.t0
+            self.phases[name] = (at, at)
+
+    def report(self) -> str:
+        lines = []
+        for name, (a, b) in sorted(self.phases.items(), key=lambda kv: kv[1][0]):
+            lines.append(f"{name:<22} {a:6.2f}s -> {b:6.2f}s" + (f"  ({b - a:.2f}s)" if b > a else ""))
+        return "\n".join(lines)
+
+    def finish(self, name: str = "ready"):
+        if self.finished:
+            return
+        self.mark(name)
+        self.finished = True
+        log.info("Startup phases:\n" + self.report())
+
+
+# Таймер процесса: отсчёт от первого импорта этого модуля (main импортирует его первым).
+STARTUP = StartupTimer()
+
+
+def loop_timer() -> StartupTimer:
+    """Первый запуск цикла пишет фазы в таймер процесса, последующие (/run) — в свой."""
+    return STARTUP if not STARTUP.finished else StartupTimer()
@@ -0,0 +1,92 @@
+# synthetic_market.py
+# Синтетический рынок для бенчмарков и replay: OHLCV по N символам с заданными режимами.
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from candle_buffer import tf_ms
+
+YEAR_SEC = 365 * 86400
+
+# drift / vol — годовые; kappa > 0 — возврат к среднему (флэт) за бар
+REGIMES = {
+    "range":      {"drift": 0.0,  "vol": 0.6, "kappa": 0.02},
+    "trend_up":   {"drift": 2.5,  "vol": 0.6, "kappa": 0.0},
+    "trend_down": {"drift": -2.5, "vol": 0.6, "kappa": 0.0},
+    "volatile":   {"drift": 0.0,  "vol": 1.8, "kappa": 0.0},
+    "calm":       {"drift": 0.0,  "vol": 0.15, "kappa": 0.01},
+}
+
+
+def make_ohlcv(n_bars: int, timeframe: str, end_ms: int, p0: float = 100.0,
+               regimes: Sequence[Tuple[str, int]] | None = None, seed: int | None = None,
+               notional_per_bar: float = 50_000.0) -> np.ndarray:
+    """GBM/OU-ряд (n_bars, 6): ts, open, high, low, close, volume. Последний бар открыт в end_ms - tf.
+
+    regimes — последовательность (имя режима, число баров); остаток добивается последним режимом.
+    """
+    rng = np.random.default_rng(seed)
+    step = tf_ms(timeframe)
+    dt = step / 1000.0 / YEAR_SEC
+    plan = list(regimes or [("range", n_bars)])
+    params = []
+    for name, n in plan:
+        params.extend([REGIMES[name]] * int(n))
+    params = (params + [REGIMES[plan[-1][0]]] * n_bars)[:n_bars]
+    drift = np.array([p["drift"] for p in params])
+    vol = np.array([p["vol"] for p in params])
+    kappa = np.array([p["kappa"] for p in params])
+
+    eps = rng.standard_normal(n_bars)
+    log_p0 = np.log(p0)
+    log_c = np.empty(n_bars)
+    x = log_p0
+    sig = vol * np.sqrt(dt)
+    mu = (drift - 0.5 * vol ** 2) * dt
+    for i in range(n_bars):
+        x = x + mu[i] + kappa[i] * (log_p0 - x) + sig[i] * eps[i]
+        log_c[i] = x
+    close = np.exp(log_c)
+    open_ = np.r_[p0, close[:-1]]
+    wick = np.abs(rng.standard_normal((2, n_bars))) * sig * 0.5
+    high = np.maximum(open_, close) * np.exp(wick[0])
+    low = np.minimum(open_, close) * np.exp(-wick[1])
+    volume = notional_per_bar * rng.lognormal(0.0, 0.5, n_bars) / close
+    ts = (end_ms // step) * step - step * np.arange(n_bars, 0, -1)
+    return np.column_stack([ts, open_, high, low, close, volume]).astype(np.float64)
+
+
+def swap_market(symbol: str, tick: float = 1e-4) -> dict:
+    base = symbol.split("/")[0]
+    return {
+        "id": f"{base}_USDT", "symbol": symbol, "base": base, "quote": "USDT", "settle": "USDT",
+        "type": "swap", "spot": False, "swap": True, "future": False, "option": False,
+        "contract": True, "linear": True, "active": True,
+        "precision": {"price": tick, "amount": 1},
+        "limits": {"price": {"min": tick}},
+    }
+
+
+def _tick_for(price: float) -> float:
+    return float(10 ** (np.floor(np.log10(price)) - 4))
+
+
+def make_market(n_symbols: int, timeframes: Dict[str, int], end_ms: int,
+                regimes: Sequence[Tuple[str, int]] | None = None, seed: int = 0,
+                extra_symbols: List[str] = ()) -> Tuple[dict, Dict[Tuple[str, str], np.ndarray]]:
+    """Рынок из n_symbols USDT-свопов: (markets, {(symbol, tf): ohlcv}).
+
+    timeframes — {tf: число баров}. Режимы у символов чередуются, если regimes не задан.
+    """
+    rng = np.random.default_rng(seed)
+    names = list(REGIMES)
+    symbols = [f"SYN{i:04d}/USDT:USDT" for i in range(n_symbols)] + list(extra_symbols)
+    markets, bars = {}, {}
+    for i, sym in enumerate(symbols):
+        p0 = float(10 ** rng.uniform(-1, 3))
+        markets[sym] = swap_market(sym, _tick_for(p0))
+        for j, (tf, n) in enumerate(timeframes.items()):
+            plan = regimes or [(names[i % len(names)], n)]
+            bars[(sym, tf)] = make_ohlcv(n, tf, end_ms, p0=p0, regimes=plan,
+                                         seed=seed * 1_000_003 + i * 31 + j)
+    return markets, bars
@@ -0,0 +1,17 @@
+import asyncio
+import types
+
+import scanner_bmr_dca
+
+
+def test_stale_commands_are_dropped():
+    async def run():
+        app = types.SimpleNamespace()
+        scanner_bmr_dca.post_command(app, "stop")
+        scanner_bmr_dca.post_command(app, "close")
+        assert scanner_bmr_dca.drain_commands(app) == ["stop", "close"]
+        assert await scanner_bmr_dca.wait_command(app, 0.01) is None
+        scanner_bmr_dca.post_command(app, "open")
+        assert await scanner_bmr_dca.wait_command(app, 0.01) == "open"
+
+    asyncio.run(run())
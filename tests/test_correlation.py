@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+from correlation import CorrelationEngine
+
+BAR = 900_000
+
+
+def _bars(n, seed, base=None, beta=0.0):
+    rng = np.random.default_rng(seed)
+    r = rng.normal(0, 1e-3, n) + (beta * base if base is not None else 0.0)
+    c = 100.0 * np.exp(np.cumsum(r))
+    ts = np.arange(n, dtype=np.float64) * BAR
+    return np.column_stack([ts, c, c, c, c, np.ones(n)]), r
+
+
+def _brute(a, b, window):
+    ra = np.diff(np.log(a[:, 4]))[-window:]
+    rb = np.diff(np.log(b[:, 4]))[-window:]
+    return np.corrcoef(ra, rb)[0, 1]
+
+
+def test_incremental_matches_brute_force():
+    eng = CorrelationEngine(window=32, min_obs=16, capacity=2)
+    a, base = _bars(120, 1)
+    b, _ = _bars(120, 2, base, beta=0.8)
+    for t in range(2, 120):
+        eng.observe("A", a[:t][-2:])
+        eng.observe("B", b[:t][-2:])
+    # в окне — 32 бара до текущего (строка текущего бара ещё копится)
+    r = eng.corr(["A", "B"])[0, 1]
+    assert r == pytest.approx(_brute(a[:118], b[:118], 32), abs=1e-9)
+
+
+def test_first_observe_seeds_history():
+    eng = CorrelationEngine(window=96, min_obs=48)
+    a, base = _bars(250, 3)
+    b, _ = _bars(250, 4, base, beta=0.8)
+    eng.observe("A", a)
+    eng.observe("B", b)
+    r = eng.corr(["A", "B"])[0, 1]
+    assert np.isfinite(r)
+    assert r == pytest.approx(_brute(a[:-1], b[:-1], 96), abs=1e-9)
+    # дальше — инкрементально, без повторного засева
+    a2, b2 = _bars(251, 3)[0], _bars(251, 4, np.r_[base, 0.0], beta=0.8)[0]
+    eng.observe("A", a2[-2:])
+    eng.observe("B", b2[-2:])
+    assert eng.corr(["A", "B"])[0, 1] == pytest.approx(_brute(a2[:-1], b2[:-1], 96), abs=1e-9)
+
+
+def test_late_symbol_seeds_into_existing_rows():
+    eng = CorrelationEngine(window=40, min_obs=20)
+    a, base = _bars(200, 5)
+    b, _ = _bars(200, 6, base, beta=-0.9)
+    for t in range(150, 200):
+        eng.observe("A", a[:t][-2:] if t > 150 else a[:t])
+    eng.observe("B", b[:199])
+    r = eng.corr(["A", "B"])[0, 1]
+    assert r < 0
+    assert r == pytest.approx(_brute(a[:198], b[:198], 40), abs=1e-9)
+
+
+def test_forget_and_select():
+    eng = CorrelationEngine(window=64, min_obs=32)
+    a, base = _bars(200, 7)
+    b, _ = _bars(200, 8, base, beta=1.0)
+    c, _ = _bars(200, 9)
+    for sym, bars in (("A", a), ("B", b), ("C", c)):
+        eng.observe(sym, bars)
+    picked = eng.select([("B", "LONG"), ("C", "LONG")], [("A", "LONG")], k=2, max_corr=0.5)
+    assert picked == [1]
+    eng.forget("B")
+    assert np.isnan(eng.corr(["A", "B"])[0, 1])
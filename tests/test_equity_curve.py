@@ -0,0 +1,76 @@
+import math
+
+import numpy as np
+
+import equity_curve
+from equity_curve import HIST_LEN, RAW_LEN, PositionEquity
+
+
+def test_peak_drawdown_and_under_water():
+    eq = PositionEquity(opened_at=0.0)
+    for ts, upnl in ((10, 5.0), (20, 8.0), (30, 2.0), (40, 6.0), (50, -1.0)):
+        eq.update(ts, upnl, margin=100.0, usage=0.1, liq_dist=30.0)
+    assert (eq.peak, eq.peak_ts) == (8.0, 20)
+    assert (eq.max_dd, eq.max_dd_ts) == (9.0, 50)
+    assert (eq.mae, eq.mfe) == (-1.0, 8.0)
+    assert eq.under_water() == 30 and eq.tuw_max == 30
+    eq.update(60, 9.0, margin=100.0, usage=0.2, liq_dist=25.0)
+    assert eq.under_water() == 0.0 and eq.tuw_max == 30
+    assert eq.usage_max == 0.2 and eq.liq_dist_min == 25.0
+
+
+def test_compact_keeps_history_bounded():
+    eq = PositionEquity(opened_at=0.0, bucket_sec=1.0)
+    n = HIST_LEN * 5 + 7
+    upnl = np.sin(np.arange(n) / 13.0) * 10
+    for i, u in enumerate(upnl):
+        eq.update(float(i), float(u), margin=100.0, usage=0.1, liq_dist=float(n - i))
+        assert eq.buckets <= HIST_LEN
+    h = eq.history()
+    assert eq.bucket_sec > 1.0 and len(h) == eq.buckets
+    assert np.all(np.diff(h["ts"]) > 0)
+    assert np.all((h["ts"] - eq.opened_at) % eq.bucket_sec == 0)
+    assert h["upnl_min"].min() == upnl.min() and h["upnl_max"].max() == upnl.max()
+    assert h["upnl_last"][-1] == upnl[-1] and h["liq_dist_min"][-1] == 1.0
+
+
+def test_compact_handles_gaps():
+    eq = PositionEquity(opened_at=0.0, bucket_sec=1.0)
+    for i in range(HIST_LEN * 3):
+        eq.update(float(i * i), 0.0, margin=1.0, usage=0.0, liq_dist=float("nan"))
+    assert 0 < eq.buckets <= HIST_LEN
+    assert math.isnan(eq.liq_dist_min)
+
+
+def test_alerts_fire_once_per_threshold():
+    eq = PositionEquity(opened_at=0.0)
+    assert eq.update(1, 0.0, 10.0, 0.1, 12.0, bank=100.0) == []
+    out = eq.update(2, -6.0, 10.0, 0.1, 4.0, bank=100.0)
+    assert len(out) == 3            # ликвидация 10% и 5%, просадка 5% банка
+    assert eq.update(3, -7.0, 10.0, 0.1, 3.0, bank=100.0) == []
+    out = eq.update(4, -25.0, 10.0, 0.1, 2.0, bank=100.0)
+    assert len(out) == 3            # ликвидация 2.5%, просадка 10% и 20%
+    assert eq.update(5, -30.0, 10.0, 0.1, 1.0, bank=100.0) == []
+
+
+def test_recent_is_time_ordered_after_wrap():
+    eq = PositionEquity(opened_at=0.0)
+    assert len(eq.recent()) == 0
+    for i in range(5):
+        eq.update(float(i), 0.0, 1.0, 0.0, 10.0)
+    assert eq.recent()["ts"].tolist() == [0.0, 1.0, 2.0, 3.0, 4.0]
+    n = RAW_LEN + 17
+    for i in range(5, n):
+        eq.update(float(i), 0.0, 1.0, 0.0, 10.0)
+    ts = eq.recent()["ts"]
+    assert len(ts) == RAW_LEN and ts[0] == n - RAW_LEN and ts[-1] == n - 1
+    assert np.all(np.diff(ts) == 1)
+
+
+def test_format_status():
+    assert equity_curve.format_status(None) == ""
+    eq = PositionEquity(opened_at=0.0)
+    assert equity_curve.format_status(eq) == ""
+    eq.update(60, 2.0, 50.0, 0.05, float("nan"))
+    text = equity_curve.format_status(eq)
+    assert "+2.00 USDT (+4.00% маржи)" in text and "N/A" in text
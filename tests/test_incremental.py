@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from incremental import AtrState, EmaState, EwmState, RsiState, StochState
+
+# эталоны — формулы pandas_ta 0.3.x без TA-Lib, записанные через pandas
+
+
+def _rma(x, length):
+    return pd.Series(x).ewm(alpha=1.0 / length, min_periods=length).mean().to_numpy()
+
+
+def _ema(x, length):
+    s = pd.Series(x)
+    seed = s.iloc[:length].mean()
+    s = s.copy()
+    s.iloc[:length - 1] = np.nan
+    s.iloc[length - 1] = seed
+    return s.ewm(span=length, adjust=False).mean().to_numpy()
+
+
+def _rsi(c, length):
+    d = pd.Series(c).diff()
+    up, dn = _rma(d.clip(lower=0), length), _rma((-d).clip(lower=0), length)
+    return 100 * up / (up + dn)
+
+
+def _atr(h, l, c, length):
+    pc = pd.Series(c).shift(1)
+    tr = pd.concat([pd.Series(h) - pd.Series(l), (pd.Series(h) - pc).abs(), (pd.Series(l) - pc).abs()],
+                   axis=1).max(axis=1, skipna=False)
+    return _rma(tr, length)
+
+
+@pytest.fixture(scope="module")
+def ohlc():
+    rng = np.random.default_rng(11)
+    c = 100 * np.exp(np.cumsum(rng.normal(0, 2e-3, 400)))
+    h = c * (1 + rng.uniform(0, 2e-3, 400))
+    l = c * (1 - rng.uniform(0, 2e-3, 400))
+    return h, l, c
+
+
+def _chunks(n):
+    return [(0, 5), (5, 40), (40, 41), (41, 300), (300, n)]
+
+
+def test_rsi_matches_pandas_ta_from_first_value(ohlc):
+    _, _, c = ohlc
+    ref = _rsi(c, 14)
+    one = RsiState(14).update_many(c)
+    np.testing.assert_allclose(one, ref, rtol=1e-10, equal_nan=True)
+    st = RsiState(14)
+    parts = np.concatenate([st.update_many(c[a:b]) for a, b in _chunks(len(c))])
+    np.testing.assert_allclose(parts, ref, rtol=1e-10, equal_nan=True)
+    st = RsiState(14)
+    bars = np.array([np.nan if v is None else v for v in (st.update(x) for x in c)])
+    np.testing.assert_allclose(bars, ref, rtol=1e-10, equal_nan=True)
+
+
+def test_atr_matches_pandas_ta(ohlc):
+    h, l, c = ohlc
+    ref = _atr(h, l, c, 14)
+    np.testing.assert_allclose(AtrState(14).update_many(h, l, c), ref, rtol=1e-10, equal_nan=True)
+    st = AtrState(14)
+    bars = []
+    for i in range(len(c)):
+        nxt = st.peek(h[i], l[i], c[i]) if i else None
+        v = st.update(h[i], l[i], c[i])
+        if nxt is not None:
+            assert nxt == pytest.approx(v)
+        bars.append(np.nan if v is None else v)
+    np.testing.assert_allclose(bars, ref, rtol=1e-10, equal_nan=True)
+
+
+def test_ema_sma_seed(ohlc):
+    _, _, c = ohlc
+    ref = _ema(c, 50)
+    st = EmaState(50)
+    parts = np.concatenate([st.update_many(c[a:b]) for a, b in _chunks(len(c))])
+    np.testing.assert_allclose(parts, ref, rtol=1e-10, equal_nan=True)
+    assert st.peek(c[-1]) == pytest.approx(st.alpha * c[-1] + (1 - st.alpha) * st.value)
+
+
+def test_ewm_state_peek_and_warmup():
+    st = EwmState(3)
+    assert st.update(1.0) is None and st.update(2.0) is None
+    assert st.peek(3.0) == pytest.approx(_rma([1.0, 2.0, 3.0], 3)[-1])
+    assert st.update(3.0) == pytest.approx(_rma([1.0, 2.0, 3.0], 3)[-1])
+
+
+def test_stoch_matches_rolling(ohlc):
+    h, l, c = ohlc
+    hh = pd.Series(h).rolling(14).max()
+    ll = pd.Series(l).rolling(14).min()
+    k = (100 * (pd.Series(c) - ll) / (hh - ll)).rolling(3).mean()
+    d = k.rolling(3).mean()
+    st = StochState(14, 3, 3)
+    parts = [st.update_many(h[a:b], l[a:b], c[a:b]) for a, b in _chunks(len(c))]
+    np.testing.assert_allclose(np.concatenate([p[0] for p in parts]), k, rtol=1e-10, equal_nan=True)
+    np.testing.assert_allclose(np.concatenate([p[1] for p in parts]), d, rtol=1e-10, equal_nan=True)
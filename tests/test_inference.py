@@ -0,0 +1,40 @@
+import numpy as np
+
+import inference
+
+
+class _Booster:
+    feature_names = None
+
+    def inplace_predict(self, X):
+        return np.tile([0.2, 0.5, 0.3], (len(X), 1))
+
+
+def _bars(n, start=0):
+    rng = np.random.default_rng(0)
+    c = 100 * np.exp(np.cumsum(rng.normal(0, 1e-3, n)))
+    ts = (np.arange(n) + start) * 60_000.0
+    return np.column_stack([ts, c, c * 1.001, c * 0.999, c, np.ones(n)])
+
+
+def test_scoring_waits_for_warmup_and_uses_history():
+    sc = inference.ModelScorer(_Booster())
+    bars = _bars(inference.WARMUP_BARS + 250)
+    recent = bars[-250:]
+    assert sc.needs_history("X", recent)
+    assert not sc.observe("X", recent)
+    assert sc.predict(["X"]) == {}
+    sc.forget("X")
+    assert sc.observe("X", recent, history=bars[:-250])
+    assert not sc.needs_history("X", recent)
+    assert set(sc.predict(["X"])) == {"X"}
+
+
+def test_incremental_rows_match_one_shot_transform():
+    bars = _bars(inference.WARMUP_BARS + 50)
+    a, b = inference.ModelScorer(_Booster()), inference.ModelScorer(_Booster())
+    a.observe("X", bars)
+    b.observe("X", bars[:-10])
+    for i in range(10, 0, -1):
+        b.observe("X", bars[:len(bars) - i + 1][-250:])
+    np.testing.assert_allclose(a.symbols["X"].row, b.symbols["X"].row, rtol=1e-6)
@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+
+import journal
+
+
+def _events(n_trades):
+    out = []
+    for i in range(n_trades):
+        sid = f"S{i}"
+        side = "LONG" if i % 2 else "SHORT"
+        ts = f"2024-01-01 {i % 24:02d}:00:00"
+        out.append({"Signal_ID": sid, "Event": "OPEN", "Side": side, "Timestamp_UTC": ts, "Step_No": 1})
+        out.append({"Signal_ID": sid, "Event": "ADD", "Side": side, "Timestamp_UTC": ts, "Step_No": 2})
+        pnl = 1.5 if i % 3 else -2.0
+        out.append({"Signal_ID": sid, "Event": "TP_HIT" if pnl > 0 else "SL_HIT", "Side": side,
+                    "Timestamp_UTC": ts, "PNL_Realized_USDT": pnl, "PNL_Realized_Pct": pnl,
+                    "Time_In_Trade_min": 30 + i})
+    return out
+
+
+def test_incremental_stats_match_rebuild_across_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "SEGMENT_ROWS", 7)
+    j = journal.Journal(str(tmp_path))
+    for ev in _events(10):
+        j.append(ev)
+    assert len(j.segments()) == 30 // 7
+    assert j.read().num_rows == 30
+    assert json.loads(json.dumps(j.rebuild())) == json.loads(json.dumps(j.stats))
+    st = j.stats
+    assert st["trades"] == 10 and st["wins"] == 6
+    assert st["steps_hist"] == {"2": 10}
+    assert st["exits"]["SL_HIT"] == 4
+
+
+def test_reopen_and_stale_stats(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "SEGMENT_ROWS", 5)
+    j = journal.Journal(str(tmp_path))
+    for ev in _events(4):
+        j.append(ev)
+    expected = j.stats
+    assert journal.Journal(str(tmp_path)).stats == expected
+    os.remove(os.path.join(str(tmp_path), journal.STATS_FILE))
+    assert json.loads(json.dumps(journal.Journal(str(tmp_path)).stats)) == json.loads(json.dumps(expected))
+
+
+def test_interrupted_seal_is_recovered(tmp_path, monkeypatch):
+    monkeypatch.setattr(journal, "SEGMENT_ROWS", 100)
+    j = journal.Journal(str(tmp_path))
+    for ev in _events(2):
+        j.append(ev)
+    os.replace(os.path.join(str(tmp_path), journal.TAIL_FILE), os.path.join(str(tmp_path), "sealed-000001.jsonl"))
+    j2 = journal.Journal(str(tmp_path))
+    assert len(j2.segments()) == 1 and j2.tail_rows == 0
+    assert j2.stats["rows"] == 6
+
+
+def test_record_from_executor(tmp_path):
+    journal.use(str(tmp_path))
+    try:
+        async def go():
+            loop = asyncio.get_running_loop()
+            await asyncio.gather(*[loop.run_in_executor(None, journal.record, ev) for ev in _events(20)])
+        asyncio.run(go())
+        st = journal.current_stats(str(tmp_path))
+        assert st["rows"] == 60
+        assert st is not journal.journal().stats
+    finally:
+        journal.use(None)
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+import risk_mc
+import scanner_bmr_dca as bmr
+from scanner_bmr_dca import CONFIG
+
+BANK = 1000.0
+
+
+def _pos(side: str = "LONG", entry: float = 100.0) -> bmr.Position:
+    pos = bmr.Position(side, "MC")
+    pos.plan_margins(BANK, 2.0)
+    pos.max_steps = 1
+    pos.add_step(entry, "ENTRY")
+    pos.build_ladder(BANK, 0.0)
+    return pos
+
+
+def _run(pos, closes, atr=0.1):
+    c = np.array([closes], dtype=np.float64)
+    return risk_mc.run_rules(pos, c, c.copy(), c.copy(), atr, BANK, 0.0, 0.0)
+
+
+def test_trailing_reaches_last_stage_and_exits_on_its_lock():
+    pos = _pos()
+    # 0.36 / 0.61 / 0.86 TP, затем откат ниже замка стадии 3 (100.75)
+    rep = _run(pos, [100.36, 100.61, 100.86, 100.6])
+    assert rep["p_sl"] == 1.0 and rep["p_open"] == 0.0
+    notional = pos.ladder["cum_margin"][0] * pos.leverage
+    assert rep["pnl_mean"] == pytest.approx(notional * (100.75 / 100.0 - 1.0))
+
+
+def test_short_mirror():
+    pos = _pos("SHORT")
+    rep = _run(pos, [99.64, 99.39, 99.14, 99.4])
+    assert rep["p_sl"] == 1.0
+    notional = pos.ladder["cum_margin"][0] * pos.leverage
+    assert rep["pnl_mean"] == pytest.approx(notional * (1.0 - 99.25 / 100.0))
+
+
+def test_take_profit_and_open():
+    pos = _pos()
+    assert _run(pos, [100.2, 100.0 * (1 + CONFIG.TP_PCT) + 0.01])["p_tp"] == 1.0
+    assert _run(pos, [100.1, 100.2, 100.1])["p_open"] == 1.0
+
+
+def test_simulate_bootstrap_is_seeded():
+    pos = _pos()
+    rng = np.random.default_rng(1)
+    c = 100.0 * np.exp(np.cumsum(rng.normal(0, 1e-3, 400)))
+    bars = np.column_stack([np.arange(400), c, c * 1.0005, c * 0.9995, c, np.ones(400)])
+    a = risk_mc.simulate(pos, bars, 100.0, 0.1, BANK, 0.0, 0.0, paths=200, horizon=50, seed=7)
+    b = risk_mc.simulate(pos, bars, 100.0, 0.1, BANK, 0.0, 0.0, paths=200, horizon=50, seed=7)
+    a.pop("elapsed_ms"), b.pop("elapsed_ms")
+    assert a == b
+    assert sum(a[f"p_{k}"] for k in risk_mc.OUTCOMES) == pytest.approx(1.0)
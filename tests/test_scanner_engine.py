@@ -0,0 +1,105 @@
+import asyncio
+import types
+
+import numpy as np
+
+import clock
+import correlation
+import scanner_engine as se
+
+BAR = 900_000
+A, B = "A/USDT:USDT", "B/USDT:USDT"
+
+
+def _market(n, seed=0):
+    rng = np.random.default_rng(seed)
+    base = rng.normal(0, 2e-3, n)
+    out = {}
+    for sym in (A, B):
+        c = 100.0 * np.exp(np.cumsum(base + rng.normal(0, 3e-4, n)))
+        ts = np.arange(n, dtype=np.float64) * BAR
+        out[sym] = np.column_stack([ts, c, c, c, c, np.ones(n)])
+    return out
+
+
+class _Exchange:
+    id = "fake"
+
+    def __init__(self, bars):
+        self.bars = bars
+        self.volume = dict.fromkeys(bars, 1e9)
+
+    async def fetch_tickers(self):
+        return {s: {"quoteVolume": v} for s, v in self.volume.items()}
+
+    async def fetch_ohlcv(self, symbol, timeframe, limit):
+        b = self.bars[symbol]
+        return b[b[:, 0] <= clock.now() * 1000][-limit:].tolist()
+
+
+def _setup(monkeypatch, n, shards=1):
+    ex = _Exchange(_market(n))
+    monkeypatch.setattr(se, "OHLCV_CACHE", {})
+    monkeypatch.setattr(se, "LAST_EVAL_BAR", {})
+    monkeypatch.setattr(se, "CORR", correlation.CorrelationEngine(se.CONFIG.CORR_WINDOW_BARS, se.CONFIG.CORR_MIN_OBS))
+    monkeypatch.setattr(se.CONFIG, "MARKET_REGIME_FILTER", False)
+    monkeypatch.setattr(se.CONFIG, "SCAN_SHARDS", shards)
+    monkeypatch.setattr(se.market_cache, "get_index", lambda exchange: {"swap_usdt": {A, B}})
+    vclock = clock.VirtualClock(0)
+    monkeypatch.setattr(clock, "CLOCK", vclock)
+    return ex, vclock
+
+
+def test_held_pair_keeps_blocking_correlated_candidate(monkeypatch):
+    n, start = 400, 250
+    ex, vclock = _setup(monkeypatch, n)
+    app = types.SimpleNamespace(bot_data={})
+
+    async def run():
+        for step in range(start, n - 1):
+            vclock._now = (step + 1) * BAR / 1000 + 5
+            await se.find_trade_signals(ex, app)
+            if step == start:   # после первого скана по A открыта позиция — A уходит из вселенной
+                app.bot_data["active_trades"] = [{"Pair": A, "Side": "LONG"}]
+
+    asyncio.run(run())
+    assert n - 1 - start > se.CONFIG.CORR_WINDOW_BARS - se.CONFIG.CORR_MIN_OBS
+    assert se.CORR.corr([A, B])[0, 1] > 0.9
+    assert se.CORR.select([(B, "LONG")], [(A, "LONG")], 1, se.CONFIG.CORR_MAX) == []
+
+
+def test_sharded_coordinator_prunes_and_reseeds(monkeypatch):
+    n, start = 400, 250
+    ex, vclock = _setup(monkeypatch, n, shards=2)
+    app = types.SimpleNamespace(bot_data={"active_trades": [{"Pair": A, "Side": "LONG"}]})
+    seeds = []
+
+    async def remote_scan(evaluate_local, symbols, shards, expected_bar, seed=()):
+        # воркеры в других процессах: кэш координатора не трогают, засев берут из лиза
+        seeds.append(set(seed))
+        returns = {}
+        for s in symbols:
+            b = ex.bars[s]
+            closed = b[b[:, 0] <= expected_bar]
+            returns[s] = closed[-(se.CONFIG.CORR_WINDOW_BARS + 2 if s in seed else 2):].tolist()
+        return {"candidates": [], "pending": 0, "returns": returns}
+
+    monkeypatch.setattr(se.shard, "scan", remote_scan)
+
+    async def scan_at(step):
+        vclock._now = (step + 1) * BAR / 1000 + 5
+        await se.find_trade_signals(ex, app)
+
+    async def run():
+        for step in range(start, start + 60):
+            await scan_at(step)
+        assert B not in se.OHLCV_CACHE and se.CORR.corr([A, B])[0, 1] > 0.9
+        ex.volume[B] = 0.0               # B выпала из ликвидных — координатор её забывает
+        await scan_at(start + 60)
+        assert B not in se.CORR.index
+        ex.volume[B] = 1e9
+        await scan_at(start + 61)        # вернулась — засевается заново, корреляция известна сразу
+        assert B in seeds[-1] and seeds[-2] == set()
+        assert se.CORR.corr([A, B])[0, 1] > 0.9
+
+    asyncio.run(run())
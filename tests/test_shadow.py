@@ -0,0 +1,73 @@
+import numpy as np
+import pytest
+
+import scanner_bmr_dca as bmr
+import shadow
+from scanner_bmr_dca import CONFIG
+
+TICK = 0.01
+AVG = 100.0
+RNG = {"lower": 90.0, "upper": 110.0, "width": 20.0, "atr1h": 1.0}
+
+
+def _live_variant():
+    return {"tp_pct": CONFIG.TP_PCT, "growth": None,
+            "tactical_pcts": tuple(CONFIG.TACTICAL_PCTS), "trailing": "base"}
+
+
+def _book(side: int = 1) -> shadow.ShadowBook:
+    book = shadow.ShadowBook([_live_variant()])
+    book.side[:] = side
+    book.avg[:] = AVG
+    book.qty[:] = 1.0
+    book.cum_margin[:] = 10.0
+    book.steps[:] = book.max_steps[:] = 1
+    return book
+
+
+def _pos(side: str = "LONG") -> bmr.Position:
+    pos = bmr.Position(side, "T")
+    pos.avg = AVG
+    pos.qty = 1.0
+    pos.steps_filled = 1
+    return pos
+
+
+def _tick(book, px, atr):
+    book.on_tick(px, {"atr5m": atr}, RNG, RNG, TICK, 1000.0, 0.0, 0.0, entries_allowed=False, now=0.0)
+
+
+@pytest.mark.parametrize("side", [1, -1])
+@pytest.mark.parametrize("gains", [(0.4, 0.7, 0.9), (0.9,), (0.4, 0.3, 0.7, 0.9)])
+def test_shadow_trailing_matches_live(side, gains):
+    book, pos = _book(side), _pos("LONG" if side > 0 else "SHORT")
+    for g in gains:
+        px = AVG * (1 + side * g * CONFIG.TP_PCT)
+        _tick(book, px, atr=0.1)
+        bmr.advance_trailing(pos, px, 0.1, TICK)
+        assert book.side[0] == side
+        assert book.trail[0] == pos.trail_stage
+        assert book.sl[0] == pytest.approx(pos.sl_price)
+    assert pos.trail_stage == len(CONFIG.TRAILING_STAGES) - 1
+
+
+def test_shadow_stages_progress_through_all_levels():
+    book = _book()
+    stages = []
+    for g in (0.4, 0.7, 0.9):
+        _tick(book, AVG * (1 + g * CONFIG.TP_PCT), atr=0.1)
+        stages.append(int(book.trail[0]))
+    assert stages == [0, 1, 2]
+    assert book.sl[0] == pytest.approx(AVG * (1 + 0.75 * CONFIG.TP_PCT))
+
+
+def test_shadow_adds_respect_manage_only():
+    book = _book()
+    book.margins[:] = 10.0
+    book.max_steps[:] = 3
+    book.targets[:] = np.nan
+    book.targets[0, 0] = 99.0
+    _tick(book, 98.9, atr=0.1)
+    assert book.steps[0] == 1
+    book.on_tick(98.9, {"atr5m": 0.1}, RNG, RNG, TICK, 1000.0, 0.0, 0.0, entries_allowed=True, now=0.0)
+    assert book.steps[0] == 2
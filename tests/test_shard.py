@@ -0,0 +1,86 @@
+import asyncio
+import time
+
+import shard
+
+
+def _store(tmp_path):
+    return shard.LeaseStore(str(tmp_path / "scan.db"))
+
+
+def test_split_is_stable_and_complete():
+    syms = [f"S{i}/USDT:USDT" for i in range(50)]
+    parts = shard.split(syms, 4)
+    assert sorted(s for p in parts for s in p) == sorted(syms)
+    assert [sorted(p) for p in parts] == [sorted(p) for p in shard.split(list(reversed(syms)), 4)]
+    assert shard.shard_of("BTC/USDT:USDT", 4) == shard.shard_of("BTC/USDT:USDT", 4)
+
+
+def test_claim_complete_only_by_owner(tmp_path):
+    st = _store(tmp_path)
+    scan_id = st.post([["A"], ["B"]], expected_bar=1)
+    job = st.claim("w1", prefer=1)
+    assert job["shard"] == 1 and job["symbols"] == ["B"]
+    assert not st.complete(scan_id, 1, "w2", {"x": 1})
+    assert st.complete(scan_id, 1, "w1", {"x": 1})
+    assert st.claim("w2", scan_id=scan_id)["shard"] == 0
+    assert st.claim("w3", scan_id=scan_id) is None
+
+
+def test_release_by_owner_frees_unfinished_leases(tmp_path):
+    st = _store(tmp_path)
+    scan_id = st.post([["A"], ["B"]], expected_bar=1)
+    st.claim("dead#0", prefer=0)
+    st.claim("dead#0", prefer=1)
+    st.complete(scan_id, 1, "dead#0", {})
+    assert st.release("dead#0") == 1
+    job = st.claim("alive#1", scan_id=scan_id)
+    assert job["shard"] == 0
+
+
+class _Proc:
+    def __init__(self, pid, returncode=None):
+        self.pid, self.returncode = pid, returncode
+
+
+def test_reap_releases_and_respawns_dead_worker(tmp_path, monkeypatch):
+    st = _store(tmp_path)
+    scan_id = st.post([["A"], ["B"]], expected_bar=1)
+    st.claim(shard.owner_id(1, 4242), prefer=1)
+    spawned = []
+
+    async def fake_spawn(index, db=shard.SCAN_DB):
+        spawned.append(index)
+        return _Proc(9000 + index)
+
+    monkeypatch.setattr(shard, "spawn_worker", fake_spawn)
+    monkeypatch.setattr(shard, "_RESPAWNED_AT", {})
+    procs = [_Proc(4241), _Proc(4242, returncode=-9)]
+    asyncio.run(shard.reap_workers(procs, lease_store=st))
+    assert spawned == [1] and procs[1].pid == 9001 and procs[0].pid == 4241
+    assert st.claim("other", scan_id=scan_id, prefer=1)["shard"] == 1
+    # повторная смерть сразу после перезапуска — лизы освобождаются, перезапуск ждёт RESPAWN_SEC
+    procs[1].returncode = 1
+    asyncio.run(shard.reap_workers(procs, lease_store=st))
+    assert spawned == [1]
+    monkeypatch.setattr(shard, "_RESPAWNED_AT", {1: time.monotonic() - shard.RESPAWN_SEC - 1})
+    asyncio.run(shard.reap_workers(procs, lease_store=st))
+    assert spawned == [1, 1]
+
+
+def test_lease_carries_its_part_of_the_seed(tmp_path):
+    st = _store(tmp_path)
+    scan_id = st.post([["A", "B"], ["C"]], expected_bar=1, seed={"B", "C", "Z"})
+    jobs = {j["shard"]: j for j in (st.claim("w", scan_id=scan_id), st.claim("w", scan_id=scan_id))}
+    assert jobs[0]["seed"] == ["B"] and jobs[1]["seed"] == ["C"]
+
+
+def test_old_db_gets_seed_column(tmp_path):
+    import sqlite3
+    path = str(tmp_path / "old.db")
+    db = sqlite3.connect(path)
+    db.executescript(shard.SCHEMA.replace("    seed TEXT NOT NULL DEFAULT '[]',\n", ""))
+    db.close()
+    st = shard.LeaseStore(path)
+    st.post([["A"]], expected_bar=1)
+    assert st.claim("w")["seed"] == []
@@ -0,0 +1,45 @@
+import math
+
+import numpy as np
+import pytest
+
+import tick_math
+
+
+@pytest.mark.parametrize("tick, decimals", [(0.0001, 4), (0.005, 3), (0.5, 1), (1, 0), (10, 0), (1e-8, 8)])
+def test_tick_decimals(tick, decimals):
+    assert tick_math.tick_decimals(tick) == decimals
+
+
+def test_round_trip_has_no_float_tails():
+    g = tick_math.grid(0.0001)
+    n = g.to_ticks(1.0849999999)
+    assert n == 10850 and isinstance(n, int)
+    assert g.to_price(n) == 1.085
+    assert g.to_price(np.int64(n)) == 1.085
+    assert repr(g.snap(0.1 + 0.2)) == "0.3"
+
+
+def test_arrays_keep_nan():
+    g = tick_math.grid(0.01)
+    ticks = g.to_ticks([1.004, 1.006, 2.0])
+    assert ticks.dtype == np.int64 and ticks.tolist() == [100, 101, 200]
+    np.testing.assert_array_equal(g.to_price(ticks), [1.0, 1.01, 2.0])
+    snapped = g.snap(np.array([1.234, np.nan]))
+    assert snapped[0] == 1.23 and math.isnan(snapped[1])
+    assert g.snap(None) is None and math.isnan(g.snap(float("nan")))
+
+
+def test_fmt_and_bad_tick():
+    g = tick_math.grid(0.005)
+    assert g.fmt(1.5) == "1.500"
+    assert g.fmt(None) == "N/A" and g.fmt(float("nan")) == "N/A"
+    assert tick_math.grid(0.005) is g
+    with pytest.raises(ValueError):
+        tick_math.TickGrid(0)
+
+
+def test_spaced():
+    assert tick_math.spaced([100, 100, 101, 103, 102, 106], +1, min_gap=1) == [0, 3, 5]
+    assert tick_math.spaced([100, 99, 97, 96, 90], -1, min_gap=2) == [0, 2, 4]
+    assert tick_math.spaced([], +1) == []
@@ -0,0 +1,54 @@
+import glob
+import os
+
+import numpy as np
+
+import feature_pipeline as fp
+import walk_forward as wf
+
+
+def _ohlcv(n, seed, t0=0, step=60_000):
+    rng = np.random.default_rng(seed)
+    c = 100.0 * np.exp(np.cumsum(rng.normal(0, 2e-3, n)))
+    h, l = c * (1 + rng.uniform(0, 3e-3, n)), c * (1 - rng.uniform(0, 3e-3, n))
+    ts = t0 + np.arange(n, dtype=np.float64) * step
+    return np.column_stack([ts, c, h, l, c, rng.uniform(1, 10, n)])
+
+
+def _dataset(tmp_path):
+    def chunks(a, size=300):
+        return (a[i:i + size] for i in range(0, len(a), size))
+    # два символа со сдвигом по времени — в кэше строки перемешиваются
+    sources = {"A": chunks(_ohlcv(1500, 1)), "B": chunks(_ohlcv(1500, 2, t0=30_000))}
+    d = str(tmp_path / "features")
+    return d, fp.build_dataset(sources, d)
+
+
+def test_cache_is_time_sorted_merge_of_shards(tmp_path, monkeypatch):
+    d, manifest = _dataset(tmp_path)
+    monkeypatch.setattr(wf, "COPY_ROWS", 97)
+    meta = wf.build_cache(d, manifest)
+    X, y, t = wf.load_cache(d)
+    t_all = np.concatenate([fp.load_shard_ts(d, sh["id"]) for sh in manifest["shards"]])
+    X_all, y_all = (np.concatenate(a) for a in zip(*fp.iter_shards(d, manifest)))
+    order = np.argsort(t_all, kind="stable")
+    assert meta["rows"] == len(t_all) and meta["bar_ms"] == 60_000
+    np.testing.assert_array_equal(t, t_all[order])
+    np.testing.assert_array_equal(y, y_all[order])
+    np.testing.assert_array_equal(X, X_all[order])
+
+
+def test_external_memory_search_and_fit(tmp_path, monkeypatch):
+    d, manifest = _dataset(tmp_path)
+    monkeypatch.setattr(wf, "COPY_ROWS", 500)
+    report = wf.run(d, manifest, wf.param_grid("single"), n_folds=2, workers=1, rounds=5, early_stopping=2,
+                    external_memory=True, log=lambda *_: None)
+    assert {r["fold"] for r in report["results"]} == {f["id"] for f in report["folds"]}
+    model = str(tmp_path / "model.json")
+    booster = wf.fit_final(d, report["best"]["params"], 5, model, external_memory=True)
+    assert os.path.exists(model)
+    assert not glob.glob(os.path.join(wf.cache_path(d), "xgb-*"))
+    X, _, _ = wf.load_cache(d)
+    in_ram = wf.fit_final(d, report["best"]["params"], 5, str(tmp_path / "model_ram.json"))
+    np.testing.assert_allclose(booster.inplace_predict(np.asarray(X[:200])),
+                               in_ram.inplace_predict(np.asarray(X[:200])), atol=1e-5)
@@ -0,0 +1,62 @@
+# tick_math.py
+# Цены движка позиций/целей/триггеров в целых тиках (int64): сравнения, дедуп и шаги — точные
+# целочисленные операции, в float цена возвращается только на выходе (сообщения, Sheets, Position).
+from decimal import Decimal
+from functools import lru_cache
+from typing import Iterable, Optional
+
+import numpy as np
+
+
+def tick_decimals(tick: float) -> int:
+    """Число знаков после запятой у шага цены: 0.0001 -> 4, 0.005 -> 3, 10 -> 0."""
+    return max(0, -Decimal(repr(float(tick))).normalize().as_tuple().exponent)
+
+
+class TickGrid:
+    __slots__ = ("tick", "decimals")
+
+    def __init__(self, tick: float):
+        if not tick or tick <= 0:
+            raise ValueError(f"tick must be positive, got {tick!r}")
+        self.tick = float(tick)
+        self.decimals = tick_decimals(tick)
+
+    def to_ticks(self, x):
+        """Цена -> ближайшее целое число тиков (скаляр -> int, массив -> int64)."""
+        if isinstance(x, (float, int)):
+            return round(x / self.tick)
+        return np.rint(np.asarray(x, dtype=np.float64) / self.tick).astype(np.int64)
+
+    def to_price(self, n):
+        """Тики -> float, округлённый до знаков тика (без хвостов вида 1.0849999999)."""
+        if type(n) is int or isinstance(n, np.integer):
+            return round(int(n) * self.tick, self.decimals)
+        return np.round(np.asarray(n, dtype=np.float64) * self.tick, self.decimals)
+
+    def snap(self, x):
+        """Привязка цены к сетке; None/NaN проходят как есть (в массиве NaN остаётся NaN)."""
+        if x is None or isinstance(x, (float, int)):
+            return x if x is None or x != x else round(round(x / self.tick) * self.tick, self.decimals)
+        return np.round(np.rint(np.asarray(x, dtype=np.float64) / self.tick) * self.tick, self.decimals)
+
+    def fmt(self, x: Optional[float]) -> str:
+        if x is None or x != x:
+            return "N/A"
+        return f"{x:.{self.decimals}f}"
+
+
+@lru_cache(maxsize=256)
+def grid(tick: float) -> TickGrid:
+    return TickGrid(tick)
+
+
+def spaced(ticks: Iterable[int], direction: int, min_gap: int = 1) -> list[int]:
+    """Индексы элементов, ушедших от предыдущего оставленного в сторону direction (+1 вверх, -1 вниз)
+    больше чем на min_gap тиков; первый элемент остаётся всегда."""
+    keep, last = [], None
+    for i, t in enumerate(ticks):
+        if last is None or direction * (t - last) > min_gap:
+            keep.append(i)
+            last = t
+    return keep
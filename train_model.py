@@ -1,80 +1,71 @@
-# train_model.py (v2.0, Multi-Class)
-import pandas as pd
-import pandas_ta as ta
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report
-from xgboost import XGBClassifier
-import numpy as np
+# train_model.py (v3.0, Multi-Class, потоковая выборка)
+# Данные читаются кусками (CSV или data_lake), фичи и метки пишутся шардами float32 (feature_pipeline),
+# параметры подбираются walk-forward (walk_forward.py), финальная модель обучается на всей истории.
+import argparse
 import os
 
-print("Шаг 1: Загрузка исторических данных...")
-DATA_FILE = 'data/sol_1m_data_binance.csv'
-if not os.path.exists(DATA_FILE):
-    print(f"Ошибка: Файл '{DATA_FILE}' не найден.")
-    exit()
-df = pd.read_csv(DATA_FILE)
+import numpy as np
 
-print("Шаг 2: Расчет индикаторов (фичей)...")
-df.ta.rsi(length=14, append=True)
-df.ta.stoch(k=14, d=3, smooth_k=3, append=True)
-df.ta.ema(length=50, append=True)
-df.ta.ema(length=200, append=True)
-df.dropna(inplace=True)
-df.reset_index(drop=True, inplace=True)
+import feature_pipeline as fp
 
-print("Шаг 3: Разметка данных (LONG, SHORT, SL)...")
-def create_multiclass_labels(df_to_label, look_forward_period=30, tp_pct=0.01, sl_pct=0.005):
-    df_to_label = df_to_label.copy()
-    
-    # Расчет будущих цен
-    future_highs = df_to_label['high'].rolling(window=look_forward_period).max().shift(-look_forward_period)
-    future_lows = df_to_label['low'].rolling(window=look_forward_period).min().shift(-look_forward_period)
-    
-    # --- Цели для LONG ---
-    long_tp_price = df_to_label['close'] * (1 + tp_pct)
-    long_sl_price = df_to_label['close'] * (1 - sl_pct)
-    long_tp_hit = future_highs >= long_tp_price
-    long_sl_hit = future_lows <= long_sl_price
-    
-    # --- Цели для SHORT ---
-    short_tp_price = df_to_label['close'] * (1 - tp_pct)
-    short_sl_price = df_to_label['close'] * (1 + sl_pct)
-    short_tp_hit = future_lows <= short_tp_price
-    short_sl_hit = future_highs >= short_sl_price
+DATA_FILE = 'data/sol_1m_data_binance.csv'
+DATASET_DIR = 'data/features'
+MODEL_FILE = 'trading_model.json'
 
-    # --- Создание итоговой метки ---
-    # 0 = SL, 1 = LONG TP, 2 = SHORT TP
-    conditions = [
-        long_tp_hit & ~long_sl_hit,   # Только LONG TP
-        short_tp_hit & ~short_sl_hit, # Только SHORT TP
-        long_sl_hit,                  # LONG SL (имеет приоритет над SHORT TP)
-        short_sl_hit,                 # SHORT SL
-    ]
-    choices = [1, 2, 0, 0]
-    df_to_label['target'] = np.select(conditions, choices, default=0) # По умолчанию 0 (ничего не произошло)
 
-    df_to_label.dropna(subset=['target'], inplace=True)
-    return df_to_label
+def main():
+    parser = argparse.ArgumentParser(description="Train the multi-class entry model.")
+    parser.add_argument("--csv", default=DATA_FILE)
+    parser.add_argument("--lake-symbols", default="", help="symbols from data_lake instead of CSV, comma-separated")
+    parser.add_argument("--exchange", default="binance")
+    parser.add_argument("--timeframe", default="1m")
+    parser.add_argument("--dataset", default=DATASET_DIR)
+    parser.add_argument("--rebuild", action="store_true", help="rebuild feature shards even if present")
+    parser.add_argument("--chunk-rows", type=int, default=fp.CHUNK_ROWS)
+    parser.add_argument("--grid", default="small", help="walk_forward.GRIDS: single/small/default")
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rounds", type=int, default=500, help="max boosting rounds (early stopping)")
+    parser.add_argument("--external-memory", action="store_true", help="keep DMatrix pages on disk")
+    args = parser.parse_args()
 
-labeled_df = create_multiclass_labels(df)
-print(f"Соотношение классов после разметки:\n{labeled_df['target'].value_counts(normalize=True)}")
+    print("Шаг 1-3: Загрузка данных, расчет фичей и разметка (потоково)...")
+    if args.rebuild or not os.path.exists(os.path.join(args.dataset, fp.MANIFEST)):
+        if args.lake_symbols:
+            sources = {s: fp.iter_lake(args.exchange, args.timeframe, s) for s in args.lake_symbols.split(",") if s}
+        else:
+            if not os.path.exists(args.csv):
+                print(f"Ошибка: Файл '{args.csv}' не найден.")
+                return
+            sources = {os.path.basename(args.csv): fp.iter_csv(args.csv, args.chunk_rows)}
+        manifest = fp.build_dataset(sources, args.dataset)
+    else:
+        manifest = fp.load_manifest(args.dataset)
+    counts = np.zeros(len(fp.LABELS))
+    for _, y in fp.iter_shards(args.dataset, manifest):
+        counts += np.bincount(y, minlength=len(fp.LABELS))
+    print(f"Строк: {int(counts.sum())}, шардов: {len(manifest['shards'])}")
+    print("Соотношение классов после разметки:\n" +
+          "\n".join(f"{i}    {c / max(counts.sum(), 1):.6f}" for i, c in enumerate(counts)))
 
-print("Шаг 4: Обучение мультиклассовой модели...")
-features = ['RSI_14', 'STOCHk_14_3_3', 'EMA_50', 'EMA_200', 'close', 'volume']
-X = labeled_df[features]
-y = labeled_df['target']
+    print("Шаг 4: Walk-forward подбор параметров (фолды по времени, параллельно)...")
+    import walk_forward as wf
+    report = wf.run(args.dataset, manifest, wf.param_grid(args.grid), n_folds=args.folds,
+                    workers=args.workers, rounds=args.rounds, external_memory=args.external_memory)
+    print(wf.format_summary(report["summary"]))
 
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    print("Шаг 5: Оценка качества модели (out-of-sample по фолдам)...")
+    best = report["best"]
+    for r in sorted((r for r in report["results"] if r["candidate"] == best["candidate"]), key=lambda r: r["fold"]):
+        print(f"fold {r['fold']}: mlogloss={r['mlogloss']:.4f} acc={r['accuracy']:.3f} "
+              f"pL={r['precision_long']:.3f} pS={r['precision_short']:.3f} signals={r['signals']}/{r['rows']}")
 
-# Используем objective 'multi:softprob' для нескольких классов
-model = XGBClassifier(objective='multi:softprob', num_class=3, use_label_encoder=False, eval_metric='mlogloss')
-model.fit(X_train, y_train)
+    print("Шаг 6: Сохранение модели...")
+    # Сохраняем модель в формате JSON для лучшей совместимости
+    wf.fit_final(args.dataset, best["params"], best["best_iteration"] + 1, MODEL_FILE,
+                 external_memory=args.external_memory)
+    print(f"\n✅ Готово! Модель обучена и сохранена в файл '{MODEL_FILE}'. Параметры: {best['params']}")
 
-print("Шаг 5: Оценка качества модели...")
-y_pred = model.predict(X_test)
-print(classification_report(y_test, y_pred, target_names=['SL/Nothing', 'LONG Win', 'SHORT Win']))
 
-print("Шаг 6: Сохранение модели...")
-# Сохраняем модель в формате JSON для лучшей совместимости
-model.save_model('trading_model.json')
-print("\n✅ Готово! Модель обучена и сохранена в файл 'trading_model.json'.")
+if __name__ == "__main__":
+    main()
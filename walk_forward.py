@@ -0,0 +1,371 @@
+# walk_forward.py
+# Walk-forward подбор и оценка модели по шардам feature_pipeline.
+# Матрица фичей один раз сводится в упорядоченный по времени кэш (X/y/t .npy, memory-map): фолды — это
+# непрерывные срезы без копий, воркеры открывают кэш сами, квантованная QuantileDMatrix фолда строится
+# один раз и переиспользуется всеми кандидатами параметров этого фолда. С external_memory матрицы строятся
+# итератором по кэшу кусками COPY_ROWS, страницы XGBoost лежат на диске (ExtMemQuantileDMatrix).
+import argparse
+import glob
+import itertools
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+
+import feature_pipeline as fp
+
+CACHE_DIR = "wf-cache"
+COPY_ROWS = 1_000_000
+
+BASE_PARAMS = {"objective": "multi:softprob", "num_class": 3, "eval_metric": "mlogloss", "tree_method": "hist"}
+
+GRIDS = {
+    "single": {"max_depth": [6], "eta": [0.3]},
+    "small": {"max_depth": [4, 6], "eta": [0.1], "subsample": [0.8], "colsample_bytree": [0.8],
+              "min_child_weight": [1, 10]},
+    "default": {"max_depth": [3, 5, 7], "eta": [0.05, 0.1], "subsample": [0.7, 0.9],
+                "colsample_bytree": [0.8], "min_child_weight": [1, 10]},
+}
+
+
+def param_grid(name: str = "small") -> list[dict]:
+    grid = GRIDS[name]
+    keys = list(grid)
+    return [dict(zip(keys, vals)) for vals in itertools.product(*(grid[k] for k in keys))]
+
+
+# ---------------------------------------------------------------------------
+# Кэш матрицы
+# ---------------------------------------------------------------------------
+def cache_path(dataset_dir: str) -> str:
+    return os.path.join(dataset_dir, CACHE_DIR)
+
+
+def _cache_key(manifest: dict) -> list:
+    shards = manifest["shards"]
+    return [len(shards), sum(sh["rows"] for sh in shards), shards[-1]["last_ts"] if shards else 0]
+
+
+def _windows(ts: list, n: int, rows: int) -> list[tuple[int, int]]:
+    """Границы [lo, hi) по времени, в каждой около rows строк всех шардов (ts шардов отсортированы)."""
+    ts = [t for t in ts if len(t)]
+    if not ts:
+        return []
+    t_min, t_max = min(int(t[0]) for t in ts), max(int(t[-1]) for t in ts) + 1
+    edges = np.unique(np.linspace(t_min, t_max, 8 * math.ceil(n / rows) + 1).astype(np.int64))
+    counts = sum(np.diff(np.searchsorted(t, edges)) for t in ts)
+    out, lo, acc = [], int(edges[0]), 0
+    for a, c in zip(edges[:-1], counts):
+        if acc and acc + c > rows:
+            out.append((lo, int(a)))
+            lo, acc = int(a), 0
+        acc += c
+    out.append((lo, int(edges[-1])))
+    return out
+
+
+def build_cache(dataset_dir: str, manifest: dict, force: bool = False) -> dict:
+    """Сводит шарды в X/y/t, отсортированные по времени (для нескольких символов — вперемешку по ts).
+    Шарды символа уже идут по времени, поэтому сортировка — слиянием по окнам времени: в памяти
+    не больше окна (~COPY_ROWS строк) при любом объёме истории."""
+    d = cache_path(dataset_dir)
+    meta_file = os.path.join(d, "meta.json")
+    if not force and os.path.exists(meta_file):
+        with open(meta_file) as f:
+            meta = json.load(f)
+        if meta.get("key") == _cache_key(manifest):
+            return meta
+    os.makedirs(d, exist_ok=True)
+    shards = manifest["shards"]
+    n = sum(sh["rows"] for sh in shards)
+    nf = len(manifest["features"])
+    ts = [fp.load_shard_ts(dataset_dir, sh["id"]) for sh in shards]
+    for sh, t in zip(shards, ts):
+        if np.any(np.diff(t) < 0):
+            raise ValueError(f"Shard {sh['id']} ({sh['symbol']}) is not sorted by time")
+    step = int(np.median(np.diff(ts[0]))) if shards and shards[0]["rows"] > 1 else 60_000
+    X_out = np.lib.format.open_memmap(os.path.join(d, "X.npy"), mode="w+", dtype=np.float32, shape=(n, nf))
+    y_out = np.lib.format.open_memmap(os.path.join(d, "y.npy"), mode="w+", dtype=np.int8, shape=(n,))
+    t_out = np.lib.format.open_memmap(os.path.join(d, "t.npy"), mode="w+", dtype=np.int64, shape=(n,))
+    pos = 0
+    for lo, hi in _windows(ts, n, COPY_ROWS):
+        parts = []
+        for sh, t in zip(shards, ts):
+            a, b = np.searchsorted(t, [lo, hi])
+            if b > a:
+                parts.append((sh["id"], t, a, b))
+        if not parts:
+            continue
+        t_w = np.concatenate([t[a:b] for _, t, a, b in parts])
+        order = np.argsort(t_w, kind="stable")
+        m = len(order)
+        X_w, y_w = [], []
+        for sid, _, a, b in parts:
+            X, y = fp.load_shard(dataset_dir, sid)
+            X_w.append(X[a:b])
+            y_w.append(y[a:b])
+        X_out[pos:pos + m] = np.concatenate(X_w)[order]
+        y_out[pos:pos + m] = np.concatenate(y_w)[order]
+        t_out[pos:pos + m] = t_w[order]
+        pos += m
+    for a in (X_out, y_out, t_out):
+        a.flush()
+    del X_out, y_out, t_out
+    meta = {"rows": int(n), "key": _cache_key(manifest), "bar_ms": step,
+            "embargo_ms": step * int(manifest.get("look_forward", 0)), "features": manifest["features"]}
+    with open(meta_file, "w") as f:
+        json.dump(meta, f)
+    return meta
+
+
+def load_cache(dataset_dir: str):
+    d = cache_path(dataset_dir)
+    return tuple(np.load(os.path.join(d, f"{k}.npy"), mmap_mode="r") for k in ("X", "y", "t"))
+
+
+# ---------------------------------------------------------------------------
+# Фолды
+# ---------------------------------------------------------------------------
+def make_folds(t: np.ndarray, n_folds: int = 5, valid_frac: float = 0.15, embargo_ms: int = 0,
+               rolling: bool = False) -> list[dict]:
+    """Фолды по времени: train -> [эмбарго] -> valid (ранняя остановка) -> [эмбарго] -> test (следующий отрезок).
+
+    Эмбарго убирает строки, чей горизонт разметки заходит в следующий отрезок.
+    """
+    if not len(t):
+        return []
+    edges = np.linspace(int(t[0]), int(t[-1]) + 1, n_folds + 2)
+    idx = lambda ts: int(np.searchsorted(t, ts, side="left"))
+    folds = []
+    for k in range(n_folds):
+        t_lo = edges[k] if rolling else edges[0]
+        t_hi, t_end = edges[k + 1], edges[k + 2]
+        t_valid = t_hi - (t_hi - t_lo) * valid_frac
+        train = (idx(t_lo), idx(t_valid - embargo_ms))
+        valid = (idx(t_valid), idx(t_hi - embargo_ms))
+        test = (idx(t_hi), idx(t_end))
+        if min(train[1] - train[0], valid[1] - valid[0], test[1] - test[0]) <= 0:
+            continue
+        folds.append({"id": k, "train": train, "valid": valid, "test": test,
+                      "test_from": int(t[test[0]]), "test_to": int(t[test[1] - 1])})
+    return folds
+
+
+# ---------------------------------------------------------------------------
+# Воркеры
+# ---------------------------------------------------------------------------
+def cache_matrix(X: np.ndarray, y: np.ndarray, max_bin: int = 256, nthread: int | None = None,
+                 cache_prefix: str | None = None, ref=None):
+    """QuantileDMatrix по срезу кэша, подаваемому кусками COPY_ROWS (без копии всего среза в памяти).
+    cache_prefix -> external memory: квантованные страницы на диске."""
+    import xgboost as xgb
+
+    class CacheIter(xgb.DataIter):
+        def __init__(self):
+            self._pos = 0
+            super().__init__(cache_prefix=cache_prefix)
+
+        def next(self, input_data):
+            if self._pos >= len(y):
+                return False
+            s = slice(self._pos, self._pos + COPY_ROWS)
+            input_data(data=np.asarray(X[s]), label=np.asarray(y[s]))
+            self._pos += COPY_ROWS
+            return True
+
+        def reset(self):
+            self._pos = 0
+
+    it = CacheIter()
+    if cache_prefix:
+        ext = getattr(xgb, "ExtMemQuantileDMatrix", None)
+        return ext(it, max_bin=max_bin, nthread=nthread, ref=ref) if ext else xgb.DMatrix(it, nthread=nthread)
+    return xgb.QuantileDMatrix(it, max_bin=max_bin, nthread=nthread, ref=ref)
+
+
+def drop_pages(cache_prefix: str):
+    for path in glob.glob(cache_prefix + "*"):
+        os.remove(path)
+
+
+_W: dict = {}
+
+
+def _init_worker(dataset_dir: str, external_memory: bool = False):
+    _W["X"], _W["y"], _W["t"] = load_cache(dataset_dir)
+    _W["fold"] = None
+    _W["pages"] = os.path.join(cache_path(dataset_dir), f"xgb-{os.getpid()}") if external_memory else None
+
+
+def _fold_matrices(fold: dict, max_bin: int, nthread: int):
+    """QuantileDMatrix фолда; в процессе держим только последний фолд."""
+    if _W["fold"] is not None and _W["fold"][0] == fold["id"]:
+        return _W["fold"][1]
+    X, y, pages = _W["X"], _W["y"], _W["pages"]
+    _W["fold"] = None
+    if pages:
+        drop_pages(pages)
+    (a, b), (c, d) = fold["train"], fold["valid"]
+    dtrain = cache_matrix(X[a:b], y[a:b], max_bin, nthread, f"{pages}-train" if pages else None)
+    dvalid = cache_matrix(X[c:d], y[c:d], max_bin, nthread, f"{pages}-valid" if pages else None, ref=dtrain)
+    _W["fold"] = (fold["id"], (dtrain, dvalid))
+    return dtrain, dvalid
+
+
+def metrics(y: np.ndarray, proba: np.ndarray) -> dict:
+    from sklearn.metrics import f1_score, precision_score
+    pred = proba.argmax(axis=1)
+    p_true = np.clip(proba[np.arange(len(y)), y], 1e-15, 1.0)
+    prec = precision_score(y, pred, labels=[1, 2], average=None, zero_division=0)
+    return {"mlogloss": float(-np.log(p_true).mean()), "accuracy": float((pred == y).mean()),
+            "f1_macro": float(f1_score(y, pred, labels=[0, 1, 2], average="macro", zero_division=0)),
+            "precision_long": float(prec[0]), "precision_short": float(prec[1]),
+            "signals": int((pred != 0).sum()), "rows": int(len(y))}
+
+
+def _run_task(fold: dict, candidates: list[tuple[int, dict]], nthread: int, rounds: int,
+              early_stopping: int, max_bin: int) -> list[dict]:
+    import xgboost as xgb
+    dtrain, dvalid = _fold_matrices(fold, max_bin, nthread)
+    a, b = fold["test"]
+    X_test, y_test = np.asarray(_W["X"][a:b]), np.asarray(_W["y"][a:b]).astype(np.int64)
+    out = []
+    for cid, cand in candidates:
+        t0 = time.perf_counter()
+        params = {**BASE_PARAMS, **cand, "nthread": nthread}
+        booster = xgb.train(params, dtrain, num_boost_round=rounds, evals=[(dvalid, "valid")],
+                            early_stopping_rounds=early_stopping, verbose_eval=False)
+        best = int(getattr(booster, "best_iteration", rounds - 1))
+        proba = booster.inplace_predict(X_test, iteration_range=(0, best + 1))
+        out.append({"fold": fold["id"], "candidate": cid, "best_iteration": best,
+                    "valid_mlogloss": float(getattr(booster, "best_score", float("nan"))),
+                    "train_sec": round(time.perf_counter() - t0, 3), **metrics(y_test, proba)})
+    return out
+
+
+# ---------------------------------------------------------------------------
+# Запуск
+# ---------------------------------------------------------------------------
+def aggregate(results: list[dict], candidates: list[dict]) -> list[dict]:
+    """Сводка по кандидатам (среднее/std по фолдам), отсортирована по mlogloss на тестах."""
+    rows = []
+    for cid, cand in enumerate(candidates):
+        rs = [r for r in results if r["candidate"] == cid]
+        if not rs:
+            continue
+        row = {"candidate": cid, "params": cand, "folds": len(rs),
+               "best_iteration": int(np.median([r["best_iteration"] for r in rs]))}
+        for k in ("mlogloss", "accuracy", "f1_macro", "precision_long", "precision_short"):
+            vals = np.array([r[k] for r in rs])
+            row[k] = float(vals.mean())
+            row[f"{k}_std"] = float(vals.std())
+        rows.append(row)
+    return sorted(rows, key=lambda r: r["mlogloss"])
+
+
+def run(dataset_dir: str, manifest: dict, candidates: list[dict], n_folds: int = 5, workers: int | None = None,
+        rounds: int = 500, early_stopping: int = 30, max_bin: int = 256, rolling: bool = False,
+        external_memory: bool = False, log=print) -> dict:
+    meta = build_cache(dataset_dir, manifest)
+    _, _, t = load_cache(dataset_dir)
+    folds = make_folds(t, n_folds, embargo_ms=meta["embargo_ms"], rolling=rolling)
+    if not folds:
+        raise ValueError("Недостаточно данных для walk-forward")
+    cpu = os.cpu_count() or 1
+    workers = max(1, min(workers or cpu, len(folds) * len(candidates)))
+    nthread = max(1, cpu // workers)
+    # кандидаты фолда делятся на части, чтобы загрузить все процессы; внутри части DMatrix общая
+    parts = max(1, min(len(candidates), math.ceil(workers / len(folds))))
+    indexed = list(enumerate(candidates))
+    tasks = [(f, indexed[i::parts]) for f in folds for i in range(parts)]
+    log(f"walk-forward: {meta['rows']} rows, {len(folds)} folds x {len(candidates)} candidates, "
+        f"{workers} workers x {nthread} threads")
+    t0 = time.perf_counter()
+    results = []
+    try:
+        if workers == 1:
+            _init_worker(dataset_dir, external_memory)
+            for f, cands in tasks:
+                results.extend(_run_task(f, cands, nthread, rounds, early_stopping, max_bin))
+                log(f"fold {f['id']} done ({time.perf_counter() - t0:.1f}s)")
+        else:
+            with ProcessPoolExecutor(workers, mp_context=get_context("spawn"), initializer=_init_worker,
+                                     initargs=(dataset_dir, external_memory)) as pool:
+                futures = [pool.submit(_run_task, f, cands, nthread, rounds, early_stopping, max_bin)
+                           for f, cands in tasks]
+                for fut, (f, _) in zip(futures, tasks):
+                    results.extend(fut.result())
+                    log(f"fold {f['id']} done ({time.perf_counter() - t0:.1f}s)")
+    finally:
+        _W["fold"] = None
+        if external_memory:
+            drop_pages(os.path.join(cache_path(dataset_dir), "xgb-"))   # страницы фолдов всех воркеров
+    summary = aggregate(results, candidates)
+    return {"folds": folds, "results": results, "summary": summary, "best": summary[0],
+            "wall_sec": round(time.perf_counter() - t0, 2)}
+
+
+def fit_final(dataset_dir: str, params: dict, num_rounds: int, model_path: str, max_bin: int = 256,
+              external_memory: bool = False):
+    """Обучение выбранных параметров на всей истории (итератором по кэшу; external_memory — страницы на диске)."""
+    import xgboost as xgb
+    X, y, _ = load_cache(dataset_dir)
+    pages = os.path.join(cache_path(dataset_dir), "xgb-final") if external_memory else None
+    try:
+        dall = cache_matrix(X, y, max_bin, cache_prefix=pages)
+        booster = xgb.train({**BASE_PARAMS, **params}, dall, num_boost_round=max(1, num_rounds))
+        del dall
+    finally:
+        if pages:
+            drop_pages(pages)
+    booster.save_model(model_path)
+    return booster
+
+
+def format_summary(summary: list[dict], top: int = 10) -> str:
+    lines = [f"{'#':>3} {'mlogloss':>9} {'±':>6} {'acc':>6} {'f1':>6} {'pL':>6} {'pS':>6} {'it':>5}  params"]
+    for r in summary[:top]:
+        lines.append(f"{r['candidate']:>3} {r['mlogloss']:>9.4f} {r['mlogloss_std']:>6.3f} {r['accuracy']:>6.3f} "
+                     f"{r['f1_macro']:>6.3f} {r['precision_long']:>6.3f} {r['precision_short']:>6.3f} "
+                     f"{r['best_iteration']:>5}  {json.dumps(r['params'])}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Walk-forward search over feature_pipeline shards.")
+    parser.add_argument("--dataset", default="data/features")
+    parser.add_argument("--grid", default="small", choices=list(GRIDS))
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--rounds", type=int, default=500)
+    parser.add_argument("--early-stopping", type=int, default=30)
+    parser.add_argument("--rolling", action="store_true", help="rolling instead of expanding train window")
+    parser.add_argument("--rebuild-cache", action="store_true")
+    parser.add_argument("--external-memory", action="store_true", help="keep DMatrix pages on disk")
+    parser.add_argument("--out", default=None, help="write full report as JSON")
+    parser.add_argument("--save-model", default=None, help="refit best params on all data and save")
+    args = parser.parse_args()
+
+    manifest = fp.load_manifest(args.dataset)
+    if args.rebuild_cache:
+        build_cache(args.dataset, manifest, force=True)
+    report = run(args.dataset, manifest, param_grid(args.grid), args.folds, args.workers, args.rounds,
+                 args.early_stopping, rolling=args.rolling, external_memory=args.external_memory)
+    print(format_summary(report["summary"]))
+    print(f"wall: {report['wall_sec']}s")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.save_model:
+        best = report["best"]
+        fit_final(args.dataset, best["params"], best["best_iteration"] + 1, args.save_model,
+                  external_memory=args.external_memory)
+        print(f"saved {args.save_model}")
+
+
+if __name__ == "__main__":
+    main()